@@ -0,0 +1,78 @@
+"""Long-lived pythonparser for ParserPool.
+
+Runs the pythonparser script in this interpreter for every request, so the
+interpreter start and the parso import happen once per worker instead of once
+per file. Requests and responses go over stdin/stdout:
+
+    request   <byte count>\\n<source, utf-8>
+    response  ok <byte count>\\n<pythonparser's output>
+              error <byte count>\\n<message>
+
+    python3 pythonparser_worker.py [path of the pythonparser script]
+"""
+import contextlib
+import io
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import traceback
+
+
+def find_pythonparser(name):
+    path = name if os.path.sep in name else shutil.which(name)
+    if path is None or not os.path.isfile(path):
+        raise SystemExit("pythonparser not found: %s, set gt.pp.path or the PATH" % name)
+    return path
+
+
+def parse(script, source_path):
+    """pythonparser's stdout for the file, raises if it fails like a non-zero exit."""
+    output = io.StringIO()
+    argv = sys.argv
+    sys.argv = [script, source_path]
+    try:
+        with contextlib.redirect_stdout(output):
+            runpy.run_path(script, run_name='__main__')
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise RuntimeError("pythonparser exited with %s" % e.code)
+    finally:
+        sys.argv = argv
+    return output.getvalue()
+
+
+def serve(script, requests, responses):
+    fd, source_path = tempfile.mkstemp(suffix='.py', prefix='pythonparser_worker')
+    os.close(fd)
+    try:
+        while True:
+            header = requests.readline()
+            if not header:
+                return
+            source = requests.read(int(header))
+            with open(source_path, 'wb') as f:
+                f.write(source)
+            try:
+                status, body = b'ok', parse(script, source_path).encode('utf-8')
+            except Exception:
+                status, body = b'error', traceback.format_exc().encode('utf-8')
+            responses.write(b'%s %d\n' % (status, len(body)))
+            responses.write(body)
+            responses.flush()
+    finally:
+        os.remove(source_path)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    script = find_pythonparser(argv[0] if argv else 'pythonparser')
+    # the responses keep the real stdout, anything else written to it goes to stderr
+    responses = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    serve(script, sys.stdin.buffer, responses)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
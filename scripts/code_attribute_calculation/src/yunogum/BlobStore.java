@@ -0,0 +1,80 @@
+package yunogum;
+
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.FileReader;
+import java.io.IOException;
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+import com.opencsv.CSVReader;
+
+/**
+ * Reads the content addressed store built by cr_classification.blob_store.
+ * Every unique snapshot is kept once under objects/ and manifest.csv maps comment_id,side to blob ids.
+ */
+public class BlobStore {
+    public static final String DEFAULT_ROOT = "blobs";
+    public static final String OLD = "Old";
+    public static final String NEW = "New";
+
+    String root;
+    //comment_id+side -> files
+    Map<String, List<File>> files = new HashMap<>();
+    Map<File, String> blobIds = new HashMap<>();
+
+    public BlobStore(String root) throws IOException {
+        this.root = root;
+        try (
+            BufferedReader reader = new BufferedReader(new FileReader(new File(root, "manifest.csv")));
+            CSVReader csvReader = new CSVReader(reader)
+        ) {
+            String[] row = csvReader.readNext();//1st row is column labels
+            while ((row = csvReader.readNext()) != null) {
+                String commentId = row[0];
+                String side = row[1];
+                String fileName = row[2];
+                String blobId = row[3];
+                File blob = blobFile(blobId, fileName);
+                files.computeIfAbsent(key(commentId, side), k -> new ArrayList<>()).add(blob);
+                blobIds.put(blob, blobId);
+            }
+        } catch (IOException e) {
+            throw e;
+        } catch (Exception e) {
+            throw new IOException("bad manifest " + e);
+        }
+    }
+
+    static String key(String commentId, String side){
+        return commentId + "/" + side;
+    }
+
+    File blobFile(String blobId, String fileName){
+        //keep the extension, gumtree picks the parser from it
+        int dot = fileName.lastIndexOf('.');
+        String extension = dot >= 0 ? fileName.substring(dot) : "";
+        return new File(root, "objects/" + blobId.substring(0, 2) + "/" + blobId + extension);
+    }
+
+    /**
+     * Same contract as File.listFiles() on "Data New/commentId/side": null when the side has no files
+     */
+    public File[] listFiles(String commentId, String side){
+        List<File> sideFiles = files.get(key(commentId, side));
+        return sideFiles == null ? null : sideFiles.toArray(new File[0]);
+    }
+
+    public String getBlobId(File blob){
+        return blobIds.get(blob);
+    }
+
+    /**
+     * Blobs are content addressed so two snapshots are equal iff they are the same blob
+     */
+    public boolean isSameContent(File a, File b){
+        return a != null && b != null && a.equals(b);
+    }
+}
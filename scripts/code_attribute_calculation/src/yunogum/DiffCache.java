@@ -0,0 +1,237 @@
+package yunogum;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.File;
+import java.io.FileInputStream;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+
+import com.github.gumtreediff.actions.Diff;
+import com.github.gumtreediff.actions.EditScript;
+import com.github.gumtreediff.actions.SimplifiedChawatheScriptGenerator;
+import com.github.gumtreediff.actions.TreeClassifier;
+import com.github.gumtreediff.gen.TreeGenerator;
+import com.github.gumtreediff.gen.TreeGenerators;
+import com.github.gumtreediff.io.TreeIoUtils;
+import com.github.gumtreediff.matchers.Mapping;
+import com.github.gumtreediff.matchers.MappingStore;
+import com.github.gumtreediff.matchers.Matchers;
+import com.github.gumtreediff.tree.Tree;
+import com.github.gumtreediff.tree.TreeContext;
+
+/**
+ * Persistent cache of the parsed trees and GumTree mappings of the snapshots in the blob store.
+ * A blob's tree is stored once as GumTree xml under trees/(blob id).xml and the mappings of an (old blob, new blob) pair
+ * under diffs/(old blob id)_(new blob id).mappings, as pre-order node indices. The edit script is regenerated from the
+ * mappings, so a comment on an already seen pair skips pythonparser and the matcher.
+ * The last few diffs are also kept in memory, rows of the same pair are usually run one after another.
+ * The worker threads of a run share one cache, a pair is computed by one thread at a time under one of LOCK_STRIPES
+ * locks picked by its key, so the others wait for it and then find it in memory. An entry is only read after that, its
+ * lazy state is filled in before it is published.
+ */
+public class DiffCache {
+    public static final String TREES_DIR = "trees";
+    public static final String DIFFS_DIR = "diffs";
+    //bump when the parser or the matcher changes, older mappings are then recomputed
+    public static final int VERSION = 1;
+    public static final int MEMORY_ENTRIES = 16;
+    public static final int LOCK_STRIPES = 64;
+
+    public static class Entry {
+        public final Diff diff;
+        public final TreeClassifier classifier;
+
+        Entry(Diff diff){
+            this.diff = diff;
+            long start = System.nanoTime();
+            this.classifier = diff.createAllNodeClassifier();
+            //the tree metrics and the classifier sets are computed lazily and unsynchronized, an entry is shared by
+            //the worker threads so they are all computed here, under the pair's lock, before the entry is published
+            diff.src.getRoot().getMetrics();
+            diff.dst.getRoot().getMetrics();
+            classifier.getInsertedDsts();
+            classifier.getDeletedSrcs();
+            classifier.getUpdatedSrcs();
+            classifier.getUpdatedDsts();
+            classifier.getMovedSrcs();
+            classifier.getMovedDsts();
+            RowProfile.time("classifier", start);
+        }
+    }
+
+    BlobStore blobStore;
+    //parses the blobs that have no tree yet, null for GumTree's registered generator(a pythonparser process per file)
+    TreeGenerator generator;
+    File treesRoot;
+    File diffsRoot;
+    //a fixed number of locks, a lock per pair would grow with every pair of the run
+    Object[] locks = new Object[LOCK_STRIPES];
+    Map<String, Entry> recent = new LinkedHashMap<String, Entry>(MEMORY_ENTRIES, 0.75f, true){
+        @Override
+        protected boolean removeEldestEntry(Map.Entry<String, Entry> eldest){
+            return size() > MEMORY_ENTRIES;
+        }
+    };
+
+    public DiffCache(BlobStore blobStore){
+        this(blobStore, null);
+    }
+
+    public DiffCache(BlobStore blobStore, TreeGenerator generator){
+        this.blobStore = blobStore;
+        this.generator = generator;
+        this.treesRoot = new File(blobStore.root, TREES_DIR);
+        this.diffsRoot = new File(blobStore.root, DIFFS_DIR);
+        for (int i = 0; i < locks.length; i++) {
+            locks[i] = new Object();
+        }
+        treesRoot.mkdirs();
+        diffsRoot.mkdirs();
+    }
+
+    /**
+     * Same Diff as Diff.compute(oldFile, newFile), with its all node classifier
+     */
+    public Entry get(File oldFile, File newFile) throws IOException {
+        String oldId = blobStore.getBlobId(oldFile);
+        String newId = blobStore.getBlobId(newFile);
+        if(oldId == null || newId == null){
+            long start = System.nanoTime();
+            Diff diff = Diff.compute(oldFile.getPath(), newFile.getPath());
+            RowProfile.time("diff uncached", start);
+            return new Entry(diff);
+        }
+        String key = oldId + "_" + newId;
+        //one thread computes a pair, the others wait for it
+        synchronized (locks[Math.floorMod(key.hashCode(), locks.length)]) {
+            synchronized (recent) {
+                Entry entry = recent.get(key);
+                if(entry != null){
+                    RowProfile.count("diffInMemory", 1);
+                    return entry;
+                }
+            }
+            Entry entry = new Entry(load(key, oldFile, oldId, newFile, newId));
+            synchronized (recent) {
+                recent.put(key, entry);
+            }
+            return entry;
+        }
+    }
+
+    Diff load(String key, File oldFile, String oldId, File newFile, String newId) throws IOException {
+        TreeContext src = tree(oldFile, oldId);
+        //a dupe pair still gets two trees, like two parses
+        TreeContext dst = tree(newFile, newId);
+        File mappingsFile = new File(diffsRoot, key + ".mappings");
+        long start = System.nanoTime();
+        MappingStore mappings = readMappings(mappingsFile, src, dst);
+        RowProfile.time("read mappings", start);
+        if(mappings == null){
+            start = System.nanoTime();
+            mappings = Matchers.getInstance().getMatcher().match(src.getRoot(), dst.getRoot());
+            RowProfile.time("match", start);
+            writeMappings(mappingsFile, mappings, src, dst);
+        }
+        start = System.nanoTime();
+        EditScript editScript = new SimplifiedChawatheScriptGenerator().computeActions(mappings);
+        RowProfile.time("edit script", start);
+        return new Diff(src, dst, mappings, editScript);
+    }
+
+    TreeContext tree(File file, String blobId) throws IOException {
+        File treeFile = new File(treesRoot, blobId + ".xml");
+        if(treeFile.exists()){
+            long start = System.nanoTime();
+            try{
+                return TreeIoUtils.fromXml().generateFrom().file(treeFile.getPath());
+            }catch(Exception e){
+                MetricRunner.dlog("reparsing " + file + " " + e);
+            }finally{
+                RowProfile.time("read tree", start);
+            }
+        }
+        //pythonparser subprocess
+        long start = System.nanoTime();
+        TreeContext context = generator != null
+            ? generator.generateFrom().file(file.getPath())
+            : TreeGenerators.getInstance().getTree(file.getPath());
+        RowProfile.time("parse", start);
+        File tmpFile = new File(treesRoot, blobId + ".xml.tmp." + Thread.currentThread().getId());
+        try{
+            TreeIoUtils.toXml(context).writeTo(tmpFile.getPath());
+            tmpFile.renameTo(treeFile);
+        }catch(Exception e){
+            MetricRunner.dlog("could not write tree " + treeFile + " " + e);
+            tmpFile.delete();
+        }
+        return context;
+    }
+
+    static List<Tree> preOrder(TreeContext context){
+        List<Tree> nodes = new ArrayList<>();
+        for (Tree t : context.getRoot().preOrder()) {
+            nodes.add(t);
+        }
+        return nodes;
+    }
+
+    static MappingStore readMappings(File mappingsFile, TreeContext src, TreeContext dst){
+        if(!mappingsFile.exists()){
+            return null;
+        }
+        List<Tree> srcNodes = preOrder(src);
+        List<Tree> dstNodes = preOrder(dst);
+        try(DataInputStream in = new DataInputStream(new BufferedInputStream(new FileInputStream(mappingsFile)))){
+            if(in.readInt() != VERSION || in.readInt() != srcNodes.size() || in.readInt() != dstNodes.size()){
+                return null;
+            }
+            MappingStore mappings = new MappingStore(src.getRoot(), dst.getRoot());
+            int size = in.readInt();
+            for (int i = 0; i < size; i++) {
+                mappings.addMapping(srcNodes.get(in.readInt()), dstNodes.get(in.readInt()));
+            }
+            return mappings;
+        }catch(IOException | IndexOutOfBoundsException e){
+            MetricRunner.dlog("rematching " + mappingsFile + " " + e);
+            return null;
+        }
+    }
+
+    static void writeMappings(File mappingsFile, MappingStore mappings, TreeContext src, TreeContext dst){
+        Map<Tree, Integer> srcIndex = new HashMap<>();
+        Map<Tree, Integer> dstIndex = new HashMap<>();
+        List<Tree> srcNodes = preOrder(src);
+        List<Tree> dstNodes = preOrder(dst);
+        for (int i = 0; i < srcNodes.size(); i++) {
+            srcIndex.put(srcNodes.get(i), i);
+        }
+        for (int i = 0; i < dstNodes.size(); i++) {
+            dstIndex.put(dstNodes.get(i), i);
+        }
+        File tmpFile = new File(mappingsFile.getPath() + ".tmp." + Thread.currentThread().getId());
+        try(DataOutputStream out = new DataOutputStream(new BufferedOutputStream(new FileOutputStream(tmpFile)))){
+            out.writeInt(VERSION);
+            out.writeInt(srcNodes.size());
+            out.writeInt(dstNodes.size());
+            out.writeInt(mappings.size());
+            for (Mapping m : mappings) {
+                out.writeInt(srcIndex.get(m.first));
+                out.writeInt(dstIndex.get(m.second));
+            }
+            out.close();
+            tmpFile.renameTo(mappingsFile);
+        }catch(IOException e){
+            MetricRunner.dlog("could not write mappings " + mappingsFile + " " + e);
+            tmpFile.delete();
+        }
+    }
+}
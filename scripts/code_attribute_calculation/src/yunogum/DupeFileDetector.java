@@ -24,6 +24,10 @@ import java.io.FileReader;
 import java.io.FileWriter;
 import java.io.IOException;  
 
+/**
+ * isDupe of every row of a csv to (csv path)_dupe.csv, with the share of dupes per category on stdout.
+ * Unlike MetricRunner it has no resume, a stopped run or a row that fails the file checks is run again from the start.
+ */
 public class DupeFileDetector {
     public static final boolean DEBUG =false;
     public static final boolean PRINT_TO_FILE =true;
@@ -71,16 +75,17 @@ public class DupeFileDetector {
         try (
             BufferedReader reader = new BufferedReader(new FileReader(new File(csv)));
             CSVReader csvReader = new CSVReader(reader);
-            CSVWriter writer = new CSVWriter(new FileWriter(csvPath+ "_metrics"+".csv"))
+            CSVWriter writer = new CSVWriter(new FileWriter(csvPath+ "_metrics"+".csv"));
+            //rows are written as they are read, flushed so a stopped run leaves a valid csv
+            CSVWriter dupWriter = new CSVWriter(new FileWriter(csvPath+"_dupe.csv"))
         ) {
 
 
-            List<String[]> rows = csvReader.readAll();
+            BlobStore blobStore = new BlobStore(BlobStore.DEFAULT_ROOT);
+            dupWriter.writeNext(new String[]{"CommentID", "isDupe"});
+            dupWriter.flush();
 
-           
-
-
-            boolean isColumnLabelRow = true;//1st row is column labels
+            int rowCount = 0;//including the column labels, like the rows of the csv
 
             int totalDupes = 0;
             int dupesInFalsePositive = 0; 
@@ -93,14 +98,12 @@ public class DupeFileDetector {
             int numEvolve = 0; 
             int numDiscuss = 0; 
 
-            List<String[]> dupeResults = new ArrayList<>(rows.size());
-    
-            for (int r = 0;r< rows.size();r++) {
-                if(isColumnLabelRow){
-                    isColumnLabelRow = false;
-                    continue;
-                }
-                String[] row = rows.get(r);
+            String[] row = csvReader.readNext();//1st row is column labels
+            if(row != null){
+                rowCount++;
+            }
+            while ((row = csvReader.readNext()) != null) {
+                rowCount++;
                 String category = row[2];
 
           
@@ -109,14 +112,12 @@ public class DupeFileDetector {
                 String folderName = row[1];//1st col is the one with commentid which is the folder name
                 // System.out.println("FolderName : " + folderName);
                 
-                File oldFolder = new File("Data New/"+folderName +"/Old");
-                File[] oldFiles = oldFolder.listFiles();
+                File[] oldFiles = blobStore.listFiles(folderName, BlobStore.OLD);
                 // log("oldFiles " + (oldFiles == null? "null":"notnull"));
                 File oldFile = oldFiles != null && oldFiles.length > 0? oldFiles[0]: null;
 
-                File newFolder = new File("Data New/"+folderName +"/New");
 
-                File[] newFiles = newFolder.listFiles();
+                File[] newFiles = blobStore.listFiles(folderName, BlobStore.NEW);
                 // log("newFiles " + (newFiles == null? "null":"notnull"));
                 File newFile = newFiles != null && newFiles.length > 0? newFiles[0]: null;
                 
@@ -140,11 +141,12 @@ public class DupeFileDetector {
                     System.out.println("normal : " + folderName + " " + category);
                 }
 
-                boolean isTwoEqual = FileUtils.contentEquals(oldFile, newFile);
+                boolean isTwoEqual = blobStore.isSameContent(oldFile, newFile);
                 String srcFile = oldFile.getPath();
                 String dstFile = newFile.getPath();
                 
-                dupeResults.add( new String[]{folderName,Integer.toString(isTwoEqual? 1 : 0) });
+                dupWriter.writeNext(new String[]{folderName,Integer.toString(isTwoEqual? 1 : 0) });
+                dupWriter.flush();
 
                 if(isTwoEqual){
                     System.out.println("FolderName : " + folderName + " " + category);
@@ -174,22 +176,13 @@ public class DupeFileDetector {
                 }
             }
             System.out.println("numDupes " + totalDupes);
-            System.out.println((100 * totalDupes/rows.size())+"% " );
-            System.out.println("rows check " + (numFalsePositive + numEvolve + numDiscuss + numFunctional) + " vs " + rows.size());
+            System.out.println((100 * totalDupes/rowCount)+"% " );
+            System.out.println("rows check " + (numFalsePositive + numEvolve + numDiscuss + numFunctional) + " vs " + rowCount);
             System.out.println((100.0f *dupesInFalsePositive / numFalsePositive)+"% dupesInFalsePositive " + dupesInFalsePositive + " / "+  (numFalsePositive));
             System.out.println((100.0f *dupesInEvolve / numEvolve)+"% dupesInEvolve " + dupesInEvolve + " / "+  (numEvolve));
             System.out.println((100.0f *dupesInDiscuss / numDiscuss)+"% dupesInDiscuss " + dupesInDiscuss + " / "+  (numDiscuss));
             System.out.println((100.0f *dupesInFunctional / numFunctional)+"% dupesInFunctional " + dupesInFunctional + " / "+  (numFunctional) );
             System.out.println((dupesInFalsePositive + dupesInEvolve + dupesInDiscuss +dupesInFunctional) == totalDupes? "total ok " : "total not ok");
-
-            String dupeCSV = csvPath+"_dupe.csv";
-            // Registry.Factory<? extends Client> client;
-            try (
-                CSVWriter dupWriter = new CSVWriter(new FileWriter(csvPath+"_dupe.csv"))
-            ) {
-                dupWriter.writeNext(new String[]{"CommentID", "isDupe"});
-                dupWriter.writeAll(dupeResults);
-            }
         }catch(Exception e){
             logAll("csv error" + e);
             e.printStackTrace();
@@ -0,0 +1,272 @@
+package yunogum;
+
+import java.io.BufferedInputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.File;
+import java.io.FileInputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.RandomAccessFile;
+import java.io.StringWriter;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+import com.opencsv.CSVParser;
+import com.opencsv.CSVWriter;
+
+import yunogum.MetricCalculator.MetricCalculator;
+
+/**
+ * Append only table of computed metrics for incremental runs.
+ * A record holds the columns of one calculator for one input, keyed by comment_id, line number and the old and new
+ * blob ids, and stamped with the calculator's version. A run only computes the calculators whose record is missing or
+ * has another version, so bumping MetricCalculator.version() of one calculator recomputes just its columns.
+ * Records are written to the file as they come, a later record for the same key and calculator replaces an earlier one.
+ * Only the file offset of the latest record of every key and calculator is kept in memory(under a 64 bit hash of
+ * them), a record is read back from the file when it is looked up.
+ */
+public class FeatureTable {
+    public static final String[] HEADER = {"comment_id", "line_number", "old_blob", "new_blob", "calculator", "version", "values"};
+    //record of the file checks: its error, empty when the calculators ran. Only errors that follow from the blobs are
+    //stored(see MetricRunner.calcRow), version 1 also stored I/O failures
+    public static final String FILES = "files";
+    public static final int FILES_VERSION = 2;
+
+    RandomAccessFile file;
+    //end of the last complete record, where the next one is written
+    long end;
+    //hash of key and calculator -> offset of its latest record
+    Map<Long, Long> offsets = new HashMap<>();
+
+    public FeatureTable(File path) throws IOException {
+        if(path.exists()){
+            try(InputStream in = new BufferedInputStream(new FileInputStream(path))){
+                byte[] line;
+                while ((line = readLine(in)) != null) {
+                    String[] record = parse(line);
+                    if(record == null || record.length != HEADER.length){
+                        break;//a run stopped in the middle of a record
+                    }
+                    //1st row is column labels
+                    if(end > 0){
+                        offsets.put(hash(key(record[0], record[1], record[2], record[3]), record[4]), end);
+                    }
+                    end += line.length;
+                }
+            }
+        }
+        file = new RandomAccessFile(path, "rw");
+        if(file.length() > end){
+            MetricRunner.logAll("feature table ends early, dropping the last " + (file.length() - end) + " bytes");
+            file.setLength(end);
+        }
+        if(end == 0){
+            write(HEADER);
+        }
+    }
+
+    /**
+     * Next line of in with its \n, null at the end or if the last line has no \n(it was cut short)
+     */
+    static byte[] readLine(InputStream in) throws IOException {
+        ByteArrayOutputStream line = new ByteArrayOutputStream();
+        int b;
+        while ((b = in.read()) >= 0) {
+            line.write(b);
+            if(b == '\n'){
+                return line.toByteArray();
+            }
+        }
+        return null;
+    }
+
+    /**
+     * Fields of a csv line, null if it does not parse
+     */
+    static String[] parse(byte[] line){
+        String text = new String(line, StandardCharsets.UTF_8).replaceAll("\r?\n$", "");
+        CSVParser parser = new CSVParser();
+        try{
+            String[] record = parser.parseLine(text);
+            return parser.isPending() ? null : record;
+        }catch(IOException e){
+            return null;
+        }
+    }
+
+    static String format(String[] record){
+        StringWriter line = new StringWriter();
+        try(CSVWriter writer = new CSVWriter(line)){
+            writer.writeNext(record);
+        }catch(IOException e){
+            throw new IllegalStateException(e);
+        }
+        return line.toString();
+    }
+
+    /**
+     * 64 bit FNV-1a of a key and calculator, a collision only makes one of them look missing
+     */
+    static long hash(String key, String calculator){
+        long hash = 0xcbf29ce484222325L;
+        for (char c : (key + "/" + calculator).toCharArray()) {
+            hash = (hash ^ c) * 0x100000001b3L;
+        }
+        return hash;
+    }
+
+    /**
+     * Version of a calculator's columns, it also covers the window settings of MetricRunner
+     */
+    static String version(int calculatorVersion){
+        return calculatorVersion + "-" + MetricRunner.LINE_RANGE + (MetricRunner.USE_FUNCTION_SCOPE ? "-functionscope" : "");
+    }
+
+    static String calculatorName(MetricCalculator calculator){
+        return calculator.getClass().getSimpleName();
+    }
+
+    static String blobs(BlobStore blobStore, File[] files){
+        if(files == null || files.length == 0){
+            return "";
+        }
+        List<String> ids = new ArrayList<>();
+        for (File file : files) {
+            ids.add(blobStore.getBlobId(file));
+        }
+        return String.join("+", ids);
+    }
+
+    public static String[] keyFields(String commentId, String lineNo, BlobStore blobStore, File[] oldFiles, File[] newFiles){
+        return new String[]{commentId, lineNo, blobs(blobStore, oldFiles), blobs(blobStore, newFiles)};
+    }
+
+    static String key(String commentId, String lineNo, String oldBlob, String newBlob){
+        return commentId + "/" + lineNo + "/" + oldBlob + "/" + newBlob;
+    }
+
+    static String key(String[] keyFields){
+        return key(keyFields[0], keyFields[1], keyFields[2], keyFields[3]);
+    }
+
+    synchronized String[] current(String[] keyFields, String calculator, int calculatorVersion){
+        Long offset = offsets.get(hash(key(keyFields), calculator));
+        if(offset == null){
+            return null;
+        }
+        String[] record;
+        try{
+            record = parse(readAt(offset));
+        }catch(IOException e){
+            MetricRunner.logAll("could not read feature table " + e);
+            return null;
+        }
+        if(record == null || record.length != HEADER.length || !key(keyFields).equals(key(record[0], record[1], record[2], record[3]))
+                || !record[4].equals(calculator)){
+            return null;
+        }
+        return record[5].equals(version(calculatorVersion)) ? record : null;
+    }
+
+    /**
+     * Line of the file starting at offset
+     */
+    byte[] readAt(long offset) throws IOException {
+        ByteArrayOutputStream line = new ByteArrayOutputStream();
+        byte[] buffer = new byte[512];
+        file.seek(offset);
+        int n;
+        while ((n = file.read(buffer)) > 0) {
+            for (int i = 0; i < n; i++) {
+                if(buffer[i] == '\n'){
+                    line.write(buffer, 0, i + 1);
+                    return line.toByteArray();
+                }
+            }
+            line.write(buffer, 0, n);
+        }
+        return line.toByteArray();
+    }
+
+    public boolean hasFiles(String[] keyFields){
+        return current(keyFields, FILES, FILES_VERSION) != null;
+    }
+
+    /**
+     * Stored error of the input, null if the calculators ran
+     */
+    public String error(String[] keyFields){
+        String[] record = current(keyFields, FILES, FILES_VERSION);
+        return record == null || record[6].isEmpty() ? null : record[6];
+    }
+
+    /**
+     * Puts the stored values of the up to date calculators into metrics and returns the calculators left to run
+     */
+    public List<MetricCalculator> stale(String[] keyFields, List<MetricCalculator> calculators, Map<String, Integer> metrics){
+        if(!hasFiles(keyFields)){
+            return calculators;
+        }
+        List<MetricCalculator> stale = new ArrayList<>();
+        for (MetricCalculator calculator : calculators) {
+            String[] record = current(keyFields, calculatorName(calculator), calculator.version());
+            if(record == null){
+                stale.add(calculator);
+                continue;
+            }
+            for (String value : record[6].split(";")) {
+                if(!value.isEmpty()){
+                    int split = value.lastIndexOf('=');
+                    metrics.put(value.substring(0, split), Integer.parseInt(value.substring(split + 1)));
+                }
+            }
+        }
+        return stale;
+    }
+
+    public void put(String[] keyFields, MetricCalculator calculator, Map<String, Integer> metrics){
+        List<String> columns = new ArrayList<>();
+        calculator.putHeader(columns);
+        List<String> values = new ArrayList<>();
+        for (String column : columns) {
+            values.add(column + "=" + metrics.getOrDefault(column, 0));
+        }
+        append(keyFields, calculatorName(calculator), version(calculator.version()), String.join(";", values));
+    }
+
+    public void putFiles(String[] keyFields, String error){
+        if(hasFiles(keyFields) && (error == null ? "" : error).equals(current(keyFields, FILES, FILES_VERSION)[6])){
+            return;
+        }
+        append(keyFields, FILES, version(FILES_VERSION), error == null ? "" : error);
+    }
+
+    synchronized void append(String[] keyFields, String calculator, String version, String values){
+        String[] record = {keyFields[0], keyFields[1], keyFields[2], keyFields[3], calculator, version, values};
+        try{
+            long offset = write(record);
+            offsets.put(hash(key(keyFields), calculator), offset);
+        }catch(IOException e){
+            MetricRunner.logAll("could not write feature table " + e);
+        }
+    }
+
+    /**
+     * Writes record at the end of the file and returns its offset
+     */
+    long write(String[] record) throws IOException {
+        byte[] line = format(record).getBytes(StandardCharsets.UTF_8);
+        file.seek(end);
+        file.write(line);
+        long offset = end;
+        end += line.length;
+        return offset;
+    }
+
+    public synchronized void close() throws IOException {
+        file.close();
+    }
+}
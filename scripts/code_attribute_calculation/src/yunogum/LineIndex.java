@@ -0,0 +1,87 @@
+package yunogum;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.BufferedReader;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.File;
+import java.io.FileInputStream;
+import java.io.FileOutputStream;
+import java.io.FileReader;
+import java.io.IOException;
+import java.util.ArrayList;
+import java.util.Collections;
+import java.util.List;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+
+/**
+ * Persistent per file index of the character count up to each line(the layout PythonFileData expects).
+ * Stored next to the file as file.chars so a blob shared by many comments is scanned once.
+ */
+public class LineIndex {
+    public static final String INDEX_SUFFIX = ".chars";
+    static Map<String, List<Integer>> loaded = new ConcurrentHashMap<>();
+
+    public static List<Integer> charCountUpToEachLine(String filePath){
+        return loaded.computeIfAbsent(filePath, LineIndex::load);
+    }
+
+    static List<Integer> load(String filePath){
+        File indexFile = new File(filePath + INDEX_SUFFIX);
+        if(indexFile.exists() && indexFile.lastModified() >= new File(filePath).lastModified()){
+            try(DataInputStream in = new DataInputStream(new BufferedInputStream(new FileInputStream(indexFile)))){
+                int size = in.readInt();
+                List<Integer> results = new ArrayList<>(size);
+                for(int i = 0; i < size; i++){
+                    results.add(in.readInt());
+                }
+                return Collections.unmodifiableList(results);
+            }catch(IOException e){
+                MetricRunner.dlog("rebuilding line index " + indexFile + " " + e);
+            }
+        }
+        List<Integer> results = scan(filePath);
+        if(!new File(filePath).exists()){
+            return results;
+        }
+        File tmpFile = new File(filePath + INDEX_SUFFIX + ".tmp");
+        try(DataOutputStream out = new DataOutputStream(new BufferedOutputStream(new FileOutputStream(tmpFile)))){
+            out.writeInt(results.size());
+            for (Integer count : results) {
+                out.writeInt(count);
+            }
+            out.close();
+            tmpFile.renameTo(indexFile);
+        }catch(IOException e){
+            MetricRunner.dlog("could not write line index " + indexFile + " " + e);
+        }
+        return Collections.unmodifiableList(results);
+    }
+
+    static List<Integer> scan(String filePath){
+        List<Integer> results = new ArrayList<>();
+
+        try(BufferedReader br = new BufferedReader(new FileReader(filePath)))
+        {
+            String line = null;
+
+            int runningCount = 0;
+            results.add(runningCount);
+            while ((line = br.readLine()) != null)
+            {
+                //we are  reading lines, not the entire file char by char
+                //this means that we ignore the additional \n character
+                //this'll break if newlien is two characters
+                //but it's not for the files I've looked at.
+                runningCount +=  line.length() + 1;
+                results.add(runningCount);//the last value is the count of cahrs in file
+            }
+
+        }catch(Exception e){
+
+        }
+        return results;
+    }
+}
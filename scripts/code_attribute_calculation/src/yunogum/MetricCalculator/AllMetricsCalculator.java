@@ -63,116 +63,89 @@ public class AllMetricsCalculator extends MetricCalculator {
     } 
 
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        
-        calcMovedBlocksInIfConditions(metrics,  results, classifier, fileData);
-        
-        calcAddedOrUpdatedComments(metrics,  results, classifier, fileData);
-        
-        calcInsertedAsssertConditions(metrics,  results, classifier, fileData);
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
 
-        calcInsertedTryCatch(metrics,  results, classifier, fileData);
+    public boolean register(MetricDispatcher dispatcher){
+        registerMovedBlocksInIfConditions(dispatcher);
+
+        registerAddedOrUpdatedComments(dispatcher);
+
+        registerInsertedAsssertConditions(dispatcher);
+
+        registerInsertedTryCatch(dispatcher);
 
         // calcModificationInsideCondtion(metrics,  results, classifier, fileData);
 
-        calcUpdatedValueAssignments(metrics,  results, classifier, fileData);
+        registerUpdatedValueAssignments(dispatcher);
 
-        calcRemovalTryCatch(metrics,  results, classifier, fileData);
+        registerRemovalTryCatch(dispatcher);
 
-        calcMismatchedFuncArguments(metrics,  results, classifier, fileData);
+        registerMismatchedFuncArguments(dispatcher);
+        return true;
     }
 
 
 
-    public static void calcMovedBlocksInIfConditions(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        int MovedBlocksInIfConditions = 0;
-        boolean wasLastChildSuite = true;
-        for(Tree t: results.src.getRoot().preOrder()){
-            if(t.getType().name.equals("if_stmt")){
-                int childNo = 0;
-                for (Tree childTree : t.getChildren()) {
-                    if(AstUtils.isTreeType(childTree, AstUtils.SUITE)){
-                        wasLastChildSuite = true;
-                        if(childNo == (t.getChildren().size() - 1 )){
-                        
-                        }
-                    }else{
-                        if(!wasLastChildSuite){
-                            System.out.println("EXEPECTED NON-SUITE child to be followed by SUITE.");
-                        }
-                        wasLastChildSuite = false;
+    private void registerMovedBlocksInIfConditions(MetricDispatcher dispatcher) {
+        dispatcher.on(this, MetricDispatcher.Kind.SRC_TREE, (t, row) -> {
+            boolean wasLastChildSuite = true;
+            for (Tree childTree : t.getChildren()) {
+                if(AstUtils.isTreeType(childTree, AstUtils.SUITE)){
+                    wasLastChildSuite = true;
+                }else{
+                    if(!wasLastChildSuite){
+                        System.out.println("EXEPECTED NON-SUITE child to be followed by SUITE.");
                     }
-                    childNo++;
+                    wasLastChildSuite = false;
                 }
-                Tree tDst = results.mappings.getDstForSrc(t);
-                if(tDst != null){
-                    if(tDst.getType().name.equals("if_stmt")){
-                        for (Tree childTree : tDst.getChildren()) {
-                            if(AstUtils.isTreeType(childTree, AstUtils.SUITE)){
-                            
-                            }else{
-                                if(classifier.getMovedSrcs().contains(childTree)){
-                                    MovedBlocksInIfConditions++;
-                                }
-                            }
+            }
+            Tree tDst = row.results.mappings.getDstForSrc(t);
+            if(tDst != null){
+                if(tDst.getType().name.equals("if_stmt")){
+                    for (Tree childTree : tDst.getChildren()) {
+                        if(!AstUtils.isTreeType(childTree, AstUtils.SUITE) && row.classifier.getMovedSrcs().contains(childTree)){
+                            row.add("MovedBlocksInIfConditions");
                         }
-                    }else{
-                        System.out.println("if mapped to ???" + t + " " +tDst );
                     }
+                }else{
+                    System.out.println("if mapped to ???" + t + " " +tDst );
                 }
             }
-        }
-
-        metrics.put("MovedBlocksInIfConditions", MovedBlocksInIfConditions);
-        
-        System.out.println(MovedBlocksInIfConditions);
-
+        }, "if_stmt");
+        dispatcher.after(this, row -> System.out.println(row.metrics.get("MovedBlocksInIfConditions")));
     }
 
 
-    private static int calcAddedOrUpdatedComments(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        int updatedComments = 0;
-        for (Tree t : classifier.getUpdatedSrcs()) {
-            Tree dstTree = results.mappings.getDstForSrc(t);
-            if (t.getType().toString().equals("string")//add this condition check before all trees in src (NOT DST)
-            && fileData.isSrcNodeInExtendedRange(t) 
-            && fileData.checkIfInFunctionScope(t))
-                updatedComments++;
-        }
-        int addedComments = 0;
-        for (Tree t : classifier.getInsertedDsts()) {
-            if (t.getType().toString().equals("string")//add this condition check before all trees in dst (NOT SRC) 
-            && fileData.isDstNodeInExtendedRange(t)) {
-                addedComments++;
+    private void registerAddedOrUpdatedComments(MetricDispatcher dispatcher) {
+        dispatcher.on(this, MetricDispatcher.Kind.UPDATED_SRC, (t, row) -> {
+            //add this condition check before all trees in src (NOT DST)
+            if (row.fileData.isSrcNodeInExtendedRange(t) && row.fileData.checkIfInFunctionScope(t))
+                row.add("AddedOrUpdatedComments");
+        }, "string");
+        dispatcher.on(this, MetricDispatcher.Kind.INSERTED_DST, (t, row) -> {
+            //add this condition check before all trees in dst (NOT SRC)
+            if (row.fileData.isDstNodeInExtendedRange(t)) {
+                row.add("AddedOrUpdatedComments");
             }
-        }
-        metrics.put("AddedOrUpdatedComments", updatedComments + addedComments);
-        return updatedComments + addedComments;
+        }, "string");
     }
 
-    private static int calcInsertedAsssertConditions(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
-        int insertedAsssertConditions = 0;
-        for (Tree t : classifier.getInsertedDsts()) {
-            if (t.getType().name.equals("assert_stmt")//add this condition check before all trees in dst (NOT SRC) 
-            && fileData.isDstNodeInExtendedRange(t)) {
-                insertedAsssertConditions++;
-            }
-        }
-        metrics.put("InsertedAssertConditions", insertedAsssertConditions);
-        return insertedAsssertConditions;
+    private void registerInsertedAsssertConditions(MetricDispatcher dispatcher){
+        countInsertedInRange(dispatcher, "InsertedAssertConditions", "assert_stmt");
     }
 
-    private static int calcInsertedTryCatch(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
-        int InsertedTryCatch = 0;
-        for (Tree t : classifier.getInsertedDsts()) {
-            if ((t.getType().name.equals("try_stmt") || t.getType().name.equals("except_clause")) 
-            //add this condition check before all trees in dst (NOT SRC) 
-            && fileData.isDstNodeInExtendedRange(t)){
-                InsertedTryCatch++;
-            }
+    private void registerInsertedTryCatch(MetricDispatcher dispatcher){
+        countInsertedInRange(dispatcher, "InsertedTryCatch", "try_stmt", "except_clause");
+    }
 
-        }
-        metrics.put("InsertedTryCatch", InsertedTryCatch);
-        return InsertedTryCatch;
+    private void countInsertedInRange(MetricDispatcher dispatcher, String metric, String... types){
+        dispatcher.on(this, MetricDispatcher.Kind.INSERTED_DST, (t, row) -> {
+            //add this condition check before all trees in dst (NOT SRC)
+            if (row.fileData.isDstNodeInExtendedRange(t)) {
+                row.add(metric);
+            }
+        }, types);
     }
 
     private static int calcModificationInsideCondtion(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
@@ -205,55 +178,38 @@ public class AllMetricsCalculator extends MetricCalculator {
         return ModificationInsideCondtion;
     }
     
-    private static int calcUpdatedValueAssignments(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
-        int UpdatedValueAssignments = 0;
-        for (Tree t : classifier.getUpdatedDsts()) {
-            if ((t.getType().name.equals("string") || t.getType().name.equals("number")) 
-            //add this condition check before all trees in dst (NOT SRC) 
-            && fileData.isDstNodeInExtendedRange(t)){
-                UpdatedValueAssignments++;
+    private void registerUpdatedValueAssignments(MetricDispatcher dispatcher){
+        dispatcher.on(this, MetricDispatcher.Kind.UPDATED_DST, (t, row) -> {
+            //add this condition check before all trees in dst (NOT SRC)
+            if (row.fileData.isDstNodeInExtendedRange(t)){
+                row.add("UpdatedValueAssignments");
             }
-        }
-        metrics.put("UpdatedValueAssignments", UpdatedValueAssignments);
-        return UpdatedValueAssignments;
+        }, "string", "number");
     }
 
-    private static int calcRemovalTryCatch(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
-        int deletedTryCatchStmts = 0;
-        for (Tree t : classifier.getDeletedSrcs()) {
-            if (t.getType().name.equals("try_stmt") //add this condition check before all trees in src (NOT DST)
-            && fileData.isSrcNodeInExtendedRange(t) 
-            && fileData.checkIfInFunctionScope(t)){
-                deletedTryCatchStmts++;
-            } else if (t.getType().name.equals("except_clause")) {
-                deletedTryCatchStmts++;
+    private void registerRemovalTryCatch(MetricDispatcher dispatcher){
+        dispatcher.on(this, MetricDispatcher.Kind.DELETED_SRC, (t, row) -> {
+            //add this condition check before all trees in src (NOT DST)
+            if (row.fileData.isSrcNodeInExtendedRange(t) && row.fileData.checkIfInFunctionScope(t)){
+                row.add("RemovedTryCatch");
             }
-        }
-        metrics.put("RemovedTryCatch", deletedTryCatchStmts);
-        return deletedTryCatchStmts;
+        }, "try_stmt");
+        dispatcher.on(this, MetricDispatcher.Kind.DELETED_SRC, (t, row) -> row.add("RemovedTryCatch"), "except_clause");
     }
 
-    private static int calcMismatchedFuncArguments(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
-        int deletedParamsInDest = 0;
-        for (Tree t : classifier.getDeletedSrcs()) {
-            // System.out.println(t);
-            if (t.getType().toString().equals("param")//add this condition check before all trees in src (NOT DST)
-            && fileData.isSrcNodeInExtendedRange(t) 
-            && fileData.checkIfInFunctionScope(t)) {
-                deletedParamsInDest++;
+    private void registerMismatchedFuncArguments(MetricDispatcher dispatcher){
+        dispatcher.on(this, MetricDispatcher.Kind.DELETED_SRC, (t, row) -> {
+            //add this condition check before all trees in src (NOT DST)
+            if (row.fileData.isSrcNodeInExtendedRange(t) && row.fileData.checkIfInFunctionScope(t)) {
+                row.add("UpdatedFuncArguments");
             }
-        }
-        int insertedParamsInDest = 0;
-        for (Tree t : classifier.getInsertedDsts()) {
-            // System.out.println(t);
-            if (t.getType().toString().equals("param") //add this condition check before all trees in dst (NOT SRC) 
-            && fileData.isDstNodeInExtendedRange(t)) {
-                insertedParamsInDest++;
+        }, "param");
+        dispatcher.on(this, MetricDispatcher.Kind.INSERTED_DST, (t, row) -> {
+            //add this condition check before all trees in dst (NOT SRC)
+            if (row.fileData.isDstNodeInExtendedRange(t)) {
+                row.add("UpdatedFuncArguments");
             }
-        }
-        metrics.put("UpdatedFuncArguments", deletedParamsInDest + insertedParamsInDest);
-
-        return deletedParamsInDest + insertedParamsInDest;
+        }, "param");
     }
 
 
@@ -11,11 +11,12 @@ import yunogum.PythonFileData;
 
 public class AnyInsertedMetrics extends UniversalMetrics{
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        // MetricRunner.dlog("SRC---------------------------------------------------:\n" + results.src);
-        // MetricRunner.dlog("DST---------------------------------------------------:\n" + results.dst);
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
 
-        //#TODO filter these within range
-        metrics.put("anyInserted", filterRange(classifier.getInsertedDsts(), fileData, false));
+    public boolean register(MetricDispatcher dispatcher){
+        countInRange(dispatcher, MetricDispatcher.Kind.INSERTED_DST, "anyInserted", false);
+        return true;
     }
 
 
@@ -11,11 +11,12 @@ import yunogum.PythonFileData;
 
 public class AnyMovedMetrics extends UniversalMetrics{
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        // MetricRunner.dlog("SRC---------------------------------------------------:\n" + results.src);
-        // MetricRunner.dlog("DST---------------------------------------------------:\n" + results.dst);
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
 
-        //#TODO filter these within range
-        metrics.put("getMovedSrcs",filterRange( classifier.getMovedSrcs(), fileData, true));
+    public boolean register(MetricDispatcher dispatcher){
+        countInRange(dispatcher, MetricDispatcher.Kind.MOVED_SRC, "getMovedSrcs", true);
+        return true;
     }
 
 
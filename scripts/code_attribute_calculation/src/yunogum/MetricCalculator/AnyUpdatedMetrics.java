@@ -11,11 +11,12 @@ import yunogum.PythonFileData;
 
 public class AnyUpdatedMetrics extends UniversalMetrics{
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        // MetricRunner.dlog("SRC---------------------------------------------------:\n" + results.src);
-        // MetricRunner.dlog("DST---------------------------------------------------:\n" + results.dst);
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
 
-        //#TODO filter these within range
-        metrics.put("UpdatedSrcs", filterRange(classifier.getUpdatedSrcs(), fileData, true));
+    public boolean register(MetricDispatcher dispatcher){
+        countInRange(dispatcher, MetricDispatcher.Kind.UPDATED_SRC, "UpdatedSrcs", true);
+        return true;
     }
 
 
@@ -11,9 +11,16 @@ import yunogum.PythonFileData;
 public class DeletedElseMetrics extends ElseMetrics{
 
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        int elseDeleted = countElse(classifier.getDeletedSrcs(), fileData, true);
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
 
-        metrics.put("elseDeleted", elseDeleted);
+    public boolean register(MetricDispatcher dispatcher){
+        dispatcher.on(this, MetricDispatcher.Kind.DELETED_SRC, (t, row) -> {
+            if(isElse(t, row.fileData, true)){
+                row.add("elseDeleted");
+            }
+        }, AstUtils.SUITE);
+        return true;
     }
 
 
@@ -16,20 +16,19 @@ import yunogum.PythonFileData;
 
 public  class DeletedIfMetrics extends IfMetrics{
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        int deletedIfStmts = 0;
-        for(Tree t: classifier.getDeletedSrcs()){
-            if(t.getType().name.equals(AstUtils.IF_STMT) ){
-                if(fileData.isSrcNodeInExtendedRange(t) && fileData.checkIfInFunctionScope(t)){
-                    deletedIfStmts++;
-                    // MetricRunner.dlog((t.toTreeString()));
-                    MetricRunner.dlog("deletion in extended range :\n" + t.toTreeString());
-                }else{
-                    MetricRunner.dlog("deletion out of range :\n" + t.toTreeString());
-                }
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
+
+    public boolean register(MetricDispatcher dispatcher){
+        dispatcher.on(this, MetricDispatcher.Kind.DELETED_SRC, (t, row) -> {
+            if(row.fileData.isSrcNodeInExtendedRange(t) && row.fileData.checkIfInFunctionScope(t)){
+                row.add("deletedIfStmts");
+                MetricRunner.dlog("deletion in extended range :\n" + t.toTreeString());
+            }else{
+                MetricRunner.dlog("deletion out of range :\n" + t.toTreeString());
             }
-            
-        }
-        metrics.put("deletedIfStmts", deletedIfStmts);
+        }, AstUtils.IF_STMT);
+        return true;
     }
 
 
@@ -26,26 +26,25 @@ public abstract class ElseMetrics extends MetricCalculator{
     public int countElse(Iterable<Tree> iter, PythonFileData fileData, boolean isSrc){
         int count = 0;
         for (Tree t : iter) {
-
-            
-            if(AstUtils.isTreeType(t, AstUtils.SUITE)){
-                Tree parent = t.getParent();
-                if(AstUtils.isTreeType(parent, AstUtils.IF_STMT)){
-                    if( 
-                        (
-                            (isSrc && !fileData.isSrcNodeInExtendedRange(t) && !fileData.checkIfInFunctionScope(t)) ||
-                            (!isSrc && !fileData.isInsertedNodeInExtendedRange(t) 
-                        )   
-                    )){
-                        continue;
-                    }
-                    count++;
-                }
+            if(AstUtils.isTreeType(t, AstUtils.SUITE) && isElse(t, fileData, isSrc)){
+                count++;
             }
         }
 
         return count;
     }
 
+    //t is a suite
+    public boolean isElse(Tree t, PythonFileData fileData, boolean isSrc){
+        Tree parent = t.getParent();
+        if(!AstUtils.isTreeType(parent, AstUtils.IF_STMT)){
+            return false;
+        }
+        return !(
+                    (isSrc && !fileData.isSrcNodeInExtendedRange(t) && !fileData.checkIfInFunctionScope(t)) ||
+                    (!isSrc && !fileData.isInsertedNodeInExtendedRange(t))
+                );
+    }
+
 
 }
\ No newline at end of file
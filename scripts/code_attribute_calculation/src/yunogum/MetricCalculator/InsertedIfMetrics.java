@@ -14,30 +14,27 @@ import yunogum.PythonFileData;
 
 public  class InsertedIfMetrics extends IfMetrics{
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        int insertedIfConditions = 0;
-        for (Tree t : classifier.getInsertedDsts()) {
-            if(t.getType().name.equals(AstUtils.IF_STMT) ){
-                if(fileData.isInsertedNodeInExtendedRange(t)){
-                    InsertAction insertion = fileData.dstTreeToSrcInsertActionMap.getOrDefault(t, null);
-                    if(fileData.checkIfInFunctionScope(insertion.mappedSrcParent)) {
-                        insertedIfConditions++;
-                        MetricRunner.dlog("insertion in extended range :\n" + t.toTreeString());
-                    }
-
-                }else{
-                    if(MetricRunner.DEBUG){
-                        MetricRunner.dlog(fileData.getDstNodeParentOverlappingExtendedRange(t));
-                        MetricRunner.dlog("insertion out of range :\n" + t.toTreeString());
-                    }
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
+
+    public boolean register(MetricDispatcher dispatcher){
+        dispatcher.on(this, MetricDispatcher.Kind.INSERTED_DST, (t, row) -> {
+            PythonFileData fileData = row.fileData;
+            if(fileData.isInsertedNodeInExtendedRange(t)){
+                InsertAction insertion = fileData.dstTreeToSrcInsertActionMap.getOrDefault(t, null);
+                if(fileData.checkIfInFunctionScope(insertion.mappedSrcParent)) {
+                    row.add("insertedIfConditions");
+                    MetricRunner.dlog("insertion in extended range :\n" + t.toTreeString());
                 }
 
+            }else{
+                if(MetricRunner.DEBUG){
+                    MetricRunner.dlog(fileData.getDstNodeParentOverlappingExtendedRange(t));
+                    MetricRunner.dlog("insertion out of range :\n" + t.toTreeString());
+                }
             }
-            
-            // MetricRunner.dlog(t);
-            // MetricRunner.dlog("-----------");
-            // MetricRunner.dlog(t.toTreeString());
-        }
-        metrics.put("insertedIfConditions", insertedIfConditions);
+        }, AstUtils.IF_STMT);
+        return true;
     }
 
 
@@ -24,70 +24,56 @@ public class LineMetric extends MetricCalculator {
         headers.add("EntireLineDeleted");
     } 
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        int AnythingInLineMoved = 0;
-        int AnythingInLineUpdated = 0;
-        int AnythingInLineDeleted = 0;
-        int AnythingMovedIntoLine = 0;
-        int AnythingInsertedIntoLine = 0;
-  
-        boolean EntireLineDeleted = true;
-        boolean LineParentMoved = false;
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
+
+    public boolean register(MetricDispatcher dispatcher){
         //anything in line is likely already in same function scope so not worht checking
-        for (Tree tree : fileData.treesInRangeOfLine) {
+        dispatcher.on(this, MetricDispatcher.Kind.LINE_SRC, (tree, row) -> {
+            PythonFileData fileData = row.fileData;
             //line char range overestimates but that's ok because we won't get anything OUTSIDE the line
             boolean inLineCharRange = tree.getPos() >= fileData.lineCharStart  && tree.getEndPos() <= fileData.lineCharEnd;
-            
-            if(classifier.getDeletedSrcs().contains(tree)){
-                if(inLineCharRange){
-                    AnythingInLineDeleted++;
-                }
+            if(!inLineCharRange){
+                return;
+            }
+            if(row.classifier.getDeletedSrcs().contains(tree)){
+                row.add("AnythingInLineDeleted");
             }else{
-                if(inLineCharRange){
-                    EntireLineDeleted = false;
-                }
+                row.count("notDeletedInLine");
             }
-
-            if(classifier.getUpdatedSrcs().contains(tree)){
-                if(inLineCharRange){
-                    AnythingInLineUpdated++;
-                }
+            if(row.classifier.getUpdatedSrcs().contains(tree)){
+                row.add("AnythingInLineUpdated");
             }
-
-            if(classifier.getMovedSrcs().contains(tree)){
-                if(inLineCharRange){
-                    AnythingInLineMoved++;
-                }
+            if(row.classifier.getMovedSrcs().contains(tree)){
+                row.add("AnythingInLineMoved");
             }
-        }
+        });
 
-        
-        for (Tree insertedDstTree : classifier.getInsertedDsts()) {
+        dispatcher.on(this, MetricDispatcher.Kind.INSERTED_DST, (insertedDstTree, row) -> {
+            PythonFileData fileData = row.fileData;
             InsertAction srcInsertion = fileData.dstTreeToSrcInsertActionMap.getOrDefault(insertedDstTree, null);
             //#TODO the insertion position is actually a arange
             //as nodes after the insertion postion could be deleted
             if(srcInsertion != null &&  srcInsertion.charPosition <= fileData.lineCharStart && srcInsertion.charPosition <= fileData.lineCharEnd){
-                AnythingInsertedIntoLine++;
+                row.add("AnythingInsertedIntoLine");
             }
-        }
+        });
 
-        for (Tree tree : classifier.getMovedSrcs()) {
+        dispatcher.on(this, MetricDispatcher.Kind.MOVED_SRC, (tree, row) -> {
+            PythonFileData fileData = row.fileData;
             if(tree.getPos() <= fileData.lineCharStart && tree.getEndPos() >= fileData.lineCharEnd){
-                LineParentMoved = true;
+                row.metrics.put("EntireLineMoved", 1);
             }
 
             if(fileData.lineCharStart  <= tree.getPos() &&  tree.getEndPos() <= fileData.lineCharEnd ){
-                AnythingMovedIntoLine++;
+                row.add("AnythingMovedIntoLine");
             }
-        }
-        
-        EntireLineDeleted = EntireLineDeleted && (AnythingInLineDeleted > 0);
+        });
 
-        metrics.put("AnythingInLineMoved", AnythingInLineMoved);
-        metrics.put("AnythingInLineUpdated",AnythingInLineUpdated);
-        metrics.put("AnythingInLineDeleted",AnythingInLineDeleted);
-        metrics.put("AnythingMovedIntoLine",AnythingMovedIntoLine);
-        metrics.put("AnythingInsertedIntoLine",AnythingInsertedIntoLine);
-        metrics.put("EntireLineMoved",LineParentMoved?1:0);
-        metrics.put("EntireLineDeleted",EntireLineDeleted?1:0);
+        dispatcher.after(this, row -> {
+            boolean EntireLineDeleted = row.counted("notDeletedInLine") == 0 && row.metrics.get("AnythingInLineDeleted") > 0;
+            row.metrics.put("EntireLineDeleted", EntireLineDeleted?1:0);
+        });
+        return true;
     }
 }
@@ -11,4 +11,19 @@ import yunogum.PythonFileData;
 public abstract class MetricCalculator {
     public abstract void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData);
     public abstract void putHeader(List<String> headers);
+
+    /**
+     * Bump when the calculator's output changes, incremental runs (FeatureTable) then recompute its columns
+     */
+    public int version(){
+        return 1;
+    }
+
+    /**
+     * Registers visitors with the dispatcher so the node sets are traversed once for all calculators.
+     * Returns false if the calculator does not, MetricDispatcher then runs its calc.
+     */
+    public boolean register(MetricDispatcher dispatcher){
+        return false;
+    }
 }
@@ -0,0 +1,226 @@
+package yunogum.MetricCalculator;
+
+import java.util.ArrayList;
+import java.util.Collections;
+import java.util.EnumMap;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.TreeMap;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.atomic.LongAdder;
+import java.util.function.Supplier;
+
+import com.github.gumtreediff.actions.Diff;
+import com.github.gumtreediff.actions.TreeClassifier;
+import com.github.gumtreediff.tree.Tree;
+
+import yunogum.MetricRunner;
+import yunogum.PythonFileData;
+import yunogum.RowProfile;
+
+/**
+ * Single pass over the node sets of a src,dst pair for many calculators.
+ * Calculators register a visitor per Kind of node set and node type in MetricCalculator.register, each set is then
+ * iterated once and every node is handed to the visitors of its type. Calculators that do not register run their calc.
+ * Time spent in each calculator's visitors goes to the row's RowProfile and is added up over all rows, see logTimings.
+ */
+public class MetricDispatcher {
+    //node sets, traversed in this order so visitors of later sets can use what earlier ones collected
+    public enum Kind {
+        SRC_TREE,       //every node of the src tree, pre-order
+        LINE_SRC,       //src trees in range of the line (PythonFileData.treesInRangeOfLine)
+        DELETED_SRC,
+        UPDATED_SRC,
+        UPDATED_DST,
+        MOVED_SRC,
+        INSERTED_DST
+    }
+
+    public interface NodeVisitor {
+        void visit(Tree t, Row row);
+    }
+
+    public interface RowVisitor {
+        void visit(Row row);
+    }
+
+    /**
+     * The src,dst pair being visited, and per row state of the visitors
+     */
+    public static class Row {
+        public final Map<String, Integer> metrics;
+        public final Diff results;
+        public final TreeClassifier classifier;
+        public final PythonFileData fileData;
+        Map<String, Object> state = new HashMap<>();
+        Map<String, Integer> counts = new HashMap<>();
+
+        Row(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
+            this.metrics = metrics;
+            this.results = results;
+            this.classifier = classifier;
+            this.fileData = fileData;
+        }
+
+        public void add(String metric){
+            metrics.merge(metric, 1, Integer::sum);
+        }
+
+        //counters of the visitors that are not metric columns
+        public void count(String key){
+            counts.merge(key, 1, Integer::sum);
+        }
+
+        public int counted(String key){
+            return counts.getOrDefault(key, 0);
+        }
+
+        @SuppressWarnings("unchecked")
+        public <T> T state(String key, Supplier<T> init){
+            return (T) state.computeIfAbsent(key, k -> init.get());
+        }
+    }
+
+    static class Registration {
+        MetricCalculator calculator;
+        NodeVisitor visitor;
+        //in this row
+        long nanos;
+
+        Registration(MetricCalculator calculator, NodeVisitor visitor){
+            this.calculator = calculator;
+            this.visitor = visitor;
+        }
+    }
+
+    //calculator -> nanoseconds in its visitors (or calc), over all rows and threads
+    static final Map<String, LongAdder> NANOS = new ConcurrentHashMap<>();
+
+    //kind -> node type -> visitors, null type for the visitors of every node
+    Map<Kind, Map<String, List<Registration>>> visitors = new EnumMap<>(Kind.class);
+    List<MetricCalculator> registered = new ArrayList<>();
+    List<MetricCalculator> unregistered = new ArrayList<>();
+    List<Registration> after = new ArrayList<>();
+    List<Registration> all = new ArrayList<>();
+
+    public MetricDispatcher(List<MetricCalculator> calculators){
+        for (MetricCalculator calculator : calculators) {
+            if(calculator.register(this)){
+                registered.add(calculator);
+            }else{
+                unregistered.add(calculator);
+            }
+        }
+    }
+
+    static void addTime(MetricCalculator calculator, long nanos){
+        String name = calculator.getClass().getSimpleName();
+        NANOS.computeIfAbsent(name, k -> new LongAdder()).add(nanos);
+        RowProfile.add("calculator " + name, nanos);
+    }
+
+    /**
+     * Calls visitor for the nodes of kind with one of types, every node if no type is given
+     */
+    public void on(MetricCalculator calculator, Kind kind, NodeVisitor visitor, String... types){
+        Map<String, List<Registration>> byType = visitors.computeIfAbsent(kind, k -> new HashMap<>());
+        Registration registration = new Registration(calculator, visitor);
+        all.add(registration);
+        if(types.length == 0){
+            byType.computeIfAbsent(null, k -> new ArrayList<>()).add(registration);
+        }
+        for (String type : types) {
+            byType.computeIfAbsent(type, k -> new ArrayList<>()).add(registration);
+        }
+    }
+
+    /**
+     * Calls visitor once every node set was visited, for metrics combining several sets
+     */
+    public void after(MetricCalculator calculator, RowVisitor visitor){
+        Registration registration = new Registration(calculator, (t, row) -> visitor.visit(row));
+        all.add(registration);
+        after.add(registration);
+    }
+
+    public void run(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
+        Row row = new Row(metrics, results, classifier, fileData);
+        //registered calculators count up from 0
+        List<String> headers = new ArrayList<>();
+        for (MetricCalculator calculator : registered) {
+            calculator.putHeader(headers);
+        }
+        for (String header : headers) {
+            metrics.put(header, 0);
+        }
+
+        for (Map.Entry<Kind, Map<String, List<Registration>>> entry : visitors.entrySet()) {
+            Map<String, List<Registration>> byType = entry.getValue();
+            List<Registration> any = byType.getOrDefault(null, Collections.emptyList());
+            for (Tree t : nodes(entry.getKey(), row)) {
+                visit(any, t, row);
+                if(t.getType() != null){
+                    visit(byType.getOrDefault(t.getType().name, Collections.emptyList()), t, row);
+                }
+            }
+        }
+        visit(after, null, row);
+        Map<MetricCalculator, Long> nanos = new LinkedHashMap<>();
+        for (Registration registration : all) {
+            nanos.merge(registration.calculator, registration.nanos, Long::sum);
+        }
+        for (Map.Entry<MetricCalculator, Long> entry : nanos.entrySet()) {
+            addTime(entry.getKey(), entry.getValue());
+        }
+
+        for (MetricCalculator calculator : unregistered) {
+            long start = System.nanoTime();
+            calculator.calc(metrics, results, classifier, fileData);
+            addTime(calculator, System.nanoTime() - start);
+        }
+    }
+
+    static void visit(List<Registration> registrations, Tree t, Row row){
+        for (Registration registration : registrations) {
+            long start = System.nanoTime();
+            registration.visitor.visit(t, row);
+            registration.nanos += System.nanoTime() - start;
+        }
+    }
+
+    static Iterable<Tree> nodes(Kind kind, Row row){
+        switch(kind){
+            case SRC_TREE: return row.results.src.getRoot().preOrder();
+            case LINE_SRC: return row.fileData.treesInRangeOfLine;
+            case DELETED_SRC: return row.classifier.getDeletedSrcs();
+            case UPDATED_SRC: return row.classifier.getUpdatedSrcs();
+            case UPDATED_DST: return row.classifier.getUpdatedDsts();
+            case MOVED_SRC: return row.classifier.getMovedSrcs();
+            default: return row.classifier.getInsertedDsts();
+        }
+    }
+
+    /**
+     * calc of a calculator that registers visitors, for running it on its own
+     */
+    public static void calcAlone(MetricCalculator calculator, Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
+        new MetricDispatcher(Collections.singletonList(calculator)).run(metrics, results, classifier, fileData);
+    }
+
+    /**
+     * Milliseconds spent in each calculator so far, slowest first
+     */
+    public static void logTimings(){
+        Map<Long, List<String>> byTime = new TreeMap<>(Collections.reverseOrder());
+        for (Map.Entry<String, LongAdder> entry : NANOS.entrySet()) {
+            byTime.computeIfAbsent(entry.getValue().sum(), k -> new ArrayList<>()).add(entry.getKey());
+        }
+        for (Map.Entry<Long, List<String>> entry : byTime.entrySet()) {
+            for (String calculator : entry.getValue()) {
+                MetricRunner.logAll("calculator " + calculator + " " + (entry.getKey() / 1000000) + "ms");
+            }
+        }
+    }
+}
@@ -95,48 +95,43 @@ public class StringAssignment extends MetricCalculator{
     
 
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData){
-        // System.out.println("SRC---------------------------------------------------:\n" + results.src);
-        // System.out.println("DST---------------------------------------------------:\n" + results.dst);
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
 
+    public boolean register(MetricDispatcher dispatcher){
         //get all strings in src, check if that string was part of any direct assignment inserted in dst
         //if so we have magic string refactoring
         //this does not get any strings that are made from str(object) calls
         //due python ducktyping we can't derive final assigned var type in compiletime.
         //this justs checks if node type == String
 
-
-        //get plain string typed things in src
-        Set<String> stringsInSrc = new HashSet<>();
-        for(Tree t: results.src.getRoot().preOrder()){
-            if(AstUtils.isTreeType(t, AstUtils.STRING)){
-                stringsInSrc.add(t.getLabel());
-            }
-        }
-        int magicStringsReplaced = 0;
-        for(Tree t: classifier.getInsertedDsts()){
-            if(fileData.checkIfInFunctionScope(t)) {
+        //get plain string typed things in src, the src tree is traversed before the inserted dsts
+        dispatcher.on(this, MetricDispatcher.Kind.SRC_TREE, (t, row) -> {
+            stringsInSrc(row).add(t.getLabel());
+        }, AstUtils.STRING);
+        dispatcher.on(this, MetricDispatcher.Kind.INSERTED_DST, (t, row) -> {
+            if(row.fileData.checkIfInFunctionScope(t)) {
                 // only a = "str". nothing more complicated than that is not possible since
                 // python does not have copile time type info
                 // you could produce strings via str() calls but strings like that are not
                 // necessarily indicators of
-                if (AstUtils.isTreeType(t, AstUtils.EXPR_STMT) &&
-                        t.getChildren().size() == 3 &&
+                if (t.getChildren().size() == 3 &&
                         (AstUtils.isTreeType(t.getChild(1), AstUtils.OPERATOR)
                                 && AstUtils.hasLabel(t.getChild(1), AstUtils.EQUALS))
                         &&
                         AstUtils.isTreeType(t.getChild(2), AstUtils.STRING)) {
-                    Tree asignedVar = t.getChild(0);
-                    Tree operator = t.getChild(1);
                     Tree assignmentVal = t.getChild(2);
-                    // System.out.println(asignedVar + " " + operator+" "+assignmentVal);
-                    if (stringsInSrc.contains(assignmentVal.getLabel())) {
-                        // System.out.println("magic string replace " + assignmentVal );
-                        magicStringsReplaced++;
+                    if (stringsInSrc(row).contains(assignmentVal.getLabel())) {
+                        row.add("magicStringsReplaced");
                     }
                 }
             }
-        }
-        metrics.put("magicStringsReplaced", magicStringsReplaced);
+        }, AstUtils.EXPR_STMT);
+        return true;
+    }
+
+    static Set<String> stringsInSrc(MetricDispatcher.Row row){
+        return row.state("stringsInSrc", HashSet::new);
     }
     public void putHeader(List<String> headers){
         headers.add("magicStringsReplaced");
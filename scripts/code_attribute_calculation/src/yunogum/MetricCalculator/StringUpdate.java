@@ -92,29 +92,19 @@ public class StringUpdate extends MetricCalculator{
     }
 
     public  void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
-        // System.out.println("SRC---------------------------------------------------:\n" + results.src);
-        // System.out.println("DST---------------------------------------------------:\n" + results.dst);
+        MetricDispatcher.calcAlone(this, metrics, results, classifier, fileData);
+    }
 
-        //get all strings in src, check if that string was part of any direct assignment inserted in dst
-        //if so we have magic string refactoring
+    public boolean register(MetricDispatcher dispatcher){
         //this does not get any strings that are made from str(object) calls
         //due python ducktyping we can't derive final assigned var type in compiletime.
         //this justs checks if node type == String
-
-
-        //get plain string typed things in src
-
-
-        int stringsUpdated = 0;
-        for(Tree t : classifier.getUpdatedSrcs()){
-            // System.out.println(t);
-            // System.out.println("updated: " + results.mappings.getDstForSrc(t));
-            if(AstUtils.isTreeType(t, AstUtils.STRING) && fileData.checkIfInFunctionScope(t)){
-                // System.out.println("stringUpdated");
-                stringsUpdated++;
+        dispatcher.on(this, MetricDispatcher.Kind.UPDATED_SRC, (t, row) -> {
+            if(row.fileData.checkIfInFunctionScope(t)){
+                row.add("stringsUpdated");
             }
-        }
-        metrics.put("stringsUpdated", stringsUpdated);
+        }, AstUtils.STRING);
+        return true;
     }
     public  void putHeader(List<String> headers){
         headers.add("stringsUpdated");
@@ -24,15 +24,29 @@ public abstract class UniversalMetrics extends MetricCalculator{
     public  int filterRange(Iterable<Tree> iter, PythonFileData fileData, boolean isSrc){
         int count = 0;
         for (Tree t : iter) {
-            if( (isSrc && !fileData.isSrcNodeInExtendedRange(t) && fileData.checkIfInFunctionScope((t))) ||
-                (!isSrc && !fileData.isDstNodeInExtendedRange(t) )){
-                continue;
+            if(inRange(t, fileData, isSrc)){
+                count++;
             }
-            count++;
         }
         return count;
     }
 
+    public boolean inRange(Tree t, PythonFileData fileData, boolean isSrc){
+        return !((isSrc && !fileData.isSrcNodeInExtendedRange(t) && fileData.checkIfInFunctionScope((t))) ||
+                (!isSrc && !fileData.isDstNodeInExtendedRange(t) ));
+    }
+
+    /**
+     * Counts the nodes of kind that are in range into metric
+     */
+    public void countInRange(MetricDispatcher dispatcher, MetricDispatcher.Kind kind, String metric, boolean isSrc){
+        dispatcher.on(this, kind, (t, row) -> {
+            if(inRange(t, row.fileData, isSrc)){
+                row.add(metric);
+            }
+        });
+    }
+
     public void calc(Map<String, Integer> metrics, Diff results, TreeClassifier classifier, PythonFileData fileData) {
         // MetricRunner.dlog("SRC---------------------------------------------------:\n" + results.src);
         // MetricRunner.dlog("DST---------------------------------------------------:\n" + results.dst);
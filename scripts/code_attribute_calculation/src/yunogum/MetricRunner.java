@@ -8,6 +8,7 @@ import java.io.Reader;
 import java.nio.file.Path;
 import java.nio.file.Paths;
 import java.util.ArrayList;
+import java.util.Arrays;
 import java.util.Hashtable;
 import java.util.LinkedHashMap;
 import java.util.List;
@@ -33,6 +34,7 @@ import yunogum.MetricCalculator.InsertedElseMetrics;
 import yunogum.MetricCalculator.InsertedIfMetrics;
 import yunogum.MetricCalculator.LineMetric;
 import yunogum.MetricCalculator.MetricCalculator;
+import yunogum.MetricCalculator.MetricDispatcher;
 import yunogum.MetricCalculator.StringAssignment;
 import yunogum.MetricCalculator.StringUpdate;
 
@@ -45,6 +47,10 @@ public class MetricRunner {
     public static final boolean PRINT_TO_FILE =true;
     public static final boolean USE_FUNCTION_SCOPE =true;
     public static final int LINE_RANGE =10;
+    //per row stage timings to <csv path>_profile.jsonl, see Profiler
+    public static final boolean PROFILE =false;
+    //parse with long-lived pythonparser workers(ParserPool), one per thread
+    public static final boolean PARSER_POOL =true;
     public static PrintStream ps;
 
     public static void dlog(String s){
@@ -67,9 +73,13 @@ public class MetricRunner {
     }
     public static void main(String[] args) {
         Run.initClients();
-        String testPath = "data/data_new";
+        //args: csv path without .csv, number of worker threads, then
+        //"incremental" to reuse the feature table and/or "resume" to continue after the rows already in the output
+        String testPath = args.length > 0 ? args[0] : "data/data_new";
+        int threads = args.length > 1 ? Integer.parseInt(args[1]) : Runtime.getRuntime().availableProcessors();
+        List<String> flags = Arrays.asList(args).subList(Math.min(args.length, 2), args.length);
         initialize();
-        calcMetricsForCSV(testPath);
+        calcMetricsForCSV(testPath, threads, flags.contains("incremental"), flags.contains("resume"));
     }
     public  static void initialize() {
         if(PRINT_TO_FILE){
@@ -83,9 +93,7 @@ public class MetricRunner {
         }
     }
 
-    private static void calcMetricsForCSV(String csvPath) {
-        String csv = csvPath+".csv";
-
+    public static List<MetricCalculator> createCalculators() {
         List<MetricCalculator> metricCalculators = new ArrayList<>();
         metricCalculators.add(new AnyInsertedMetrics());
         metricCalculators.add(new AnyDeletedMetrics());
@@ -99,158 +107,211 @@ public class MetricRunner {
         metricCalculators.add(new StringUpdate());
         metricCalculators.add(new StringAssignment());
         metricCalculators.add(new AllMetricsCalculator());
+        return metricCalculators;
+    }
+
+    /**
+     * folderName, the headers of every calculator, then the file columns ending with error
+     */
+    public static List<String> createHeaders(List<MetricCalculator> metricCalculators) {
+        ArrayList<String> headers = new ArrayList<>();
+        headers.add("folderName");
+        for (MetricCalculator calculator : metricCalculators) {
+            calculator.putHeader(headers);
+        }
+        headers.add("hasOldFile");
+        headers.add("hasNewFile");
+        headers.add("numOldFiles");
+        headers.add("numNewFiles");
+        headers.add("isDupe");
+        headers.add("error");
+        return headers;
+    }
+
+    private static void calcMetricsForCSV(String csvPath, int threads, boolean incremental, boolean resume) {
+        String csv = csvPath+".csv";
+        String output = csvPath+ "_metrics" + (USE_FUNCTION_SCOPE? "functionscope": "")+".csv";
+        File featureTableFile = new File(csvPath + "_features.csv");
+        File profileFile = new File(csvPath + "_profile.jsonl");
+
+        List<MetricCalculator> metricCalculators = createCalculators();
+        List<String> headers = createHeaders(metricCalculators);
 
-        // Registry.Factory<? extends Client> client;
         try (
             BufferedReader reader = new BufferedReader(new FileReader(new File(csv)));
             CSVReader csvReader = new CSVReader(reader);
-            CSVWriter writer = new CSVWriter(new FileWriter(csvPath+ "_metrics" + (USE_FUNCTION_SCOPE? "functionscope": "")+".csv"))
         ) {
+            BlobStore blobStore = new BlobStore(BlobStore.DEFAULT_ROOT);
+            ParserPool parserPool = PARSER_POOL ? startParserPool(threads) : null;
+            DiffCache diffCache = new DiffCache(blobStore, parserPool != null ? parserPool.generator() : null);
+            FeatureTable featureTable = incremental ? new FeatureTable(featureTableFile) : null;
+            Profiler profiler = PROFILE ? new Profiler(profileFile) : null;
+            //rows are read, computed and written as they go
+            StreamingRunner runner = new StreamingRunner(output, threads);
+            int rows = runner.run(new File(csv), csvReader, headers.toArray(new String[0]), blobStore,
+                (row, r) -> calcRow(row, r + 1, blobStore, diffCache, featureTable, profiler, metricCalculators, headers),
+                DEBUG ? 20 : -1, resume);
+            logAll(rows + " rows");
+            MetricDispatcher.logTimings();
+            if(parserPool != null){
+                parserPool.close();
+            }
+            if(profiler != null){
+                profiler.close();
+            }
+            if(featureTable != null){
+                featureTable.close();
+            }
+        }catch(Exception e){
+            logAll("csv error" + e);
+            e.printStackTrace();
+        }
+    }
+
+    static ParserPool startParserPool(int threads){
+        try{
+            return new ParserPool(threads);
+        }catch(IOException e){
+            logAll("no parser workers, running pythonparser per file " + e);
+            return null;
+        }
+    }
+
+    /**
+     * Metrics of one input row(r is its row number in the csv, for the log). Calculators keep no state so rows can run on any thread.
+     * With a feature table only the calculators without an up to date record run, and their results are appended to it.
+     * Errors that follow from the blobs(the file checks and syntax errors) are stored with them, a row that failed on
+     * I/O(a parser worker, reading the DiffCache, ...) stores no error and is computed again by the next run.
+     * With a profiler the row's stage timings and node counts are written to it.
+     */
+    static String[] calcRow(String[] row, int r, BlobStore blobStore, DiffCache diffCache, FeatureTable featureTable, Profiler profiler, List<MetricCalculator> metricCalculators, List<String> headers) {
+        int postMetricsHeaderStartIndex = headers.indexOf("hasOldFile");
+        dlog("row: " + (r));
+        String folderName = row[1];//1st col is the one with commentid which is the folder name
+        RowProfile profile = profiler != null ? RowProfile.start(r, folderName) : null;
+        dlog("FolderName : " + folderName);
+
+        File[] oldFiles = blobStore.listFiles(folderName, BlobStore.OLD);
+        log("oldFiles " + (oldFiles == null? "null":"notnull"));
+        File oldFile = oldFiles != null && oldFiles.length > 0? oldFiles[0]: null;
 
 
-            List<String[]> rows = csvReader.readAll();
+        File[] newFiles = blobStore.listFiles(folderName, BlobStore.NEW);
+        log("newFiles " + (newFiles == null? "null":"notnull"));
+        File newFile = newFiles != null && newFiles.length > 0? newFiles[0]: null;
 
-            ArrayList<String> headers = new ArrayList<>();
-            headers.add("folderName");
-            
-            for (MetricCalculator calculator : metricCalculators) {
-                calculator.putHeader(headers);
+        boolean hasOldFile = oldFile != null;
+        boolean hasNewFile = newFile != null;
+        boolean isDupe = hasOldFile && hasNewFile && blobStore.isSameContent(oldFile, newFile);
+        int numOldFiles = oldFiles != null ? oldFiles.length : 0;
+        int numNewFiles = newFiles != null  ? newFiles.length: 0;
+        String error = null;
+        //error is the same for every run on these blobs
+        boolean storeError = true;
+
+        Map<String, Integer> metrics = new LinkedHashMap<>();
+        String[] metricRow = new String[headers.size()];
+        String[] key = featureTable == null ? null : FeatureTable.keyFields(folderName, row[6], blobStore, oldFiles, newFiles);
+        List<MetricCalculator> staleCalculators = featureTable == null ? metricCalculators : featureTable.stale(key, metricCalculators, metrics);
+        if(featureTable != null && featureTable.hasFiles(key)){
+            error = featureTable.error(key);
+        }
+        try{
+            if(numOldFiles > 1 || numNewFiles > 1)
+                throw new IOException("num oldFiles" + numOldFiles + " numNewFiles " + numNewFiles );
+            if(!hasOldFile && !hasNewFile)
+                throw new  IOException("not hasOldFile not hasNewFile" );
+            if(!hasOldFile && hasNewFile){
+                //this should not be exception though fix later.
+                throw new  IOException("not has hasOldFile but hasNewFile");
+            }
+            if(hasOldFile && !hasNewFile){
+                newFile = oldFile;
             }
+            //IOExceptions after the file checks are failures of this run
+            storeError = false;
 
-            
-            int postMetricsHeaderStartIndex = headers.size();
-            headers.add("hasOldFile");
-            headers.add("hasNewFile");
-            headers.add("numOldFiles");
-            headers.add("numNewFiles");
-            headers.add("isDupe");
-            headers.add("error");
-
-            // String[] headers = metrics.keySet().toArray(new String[0]);
-            writer.writeNext(headers.toArray(new String[0]));
-            boolean isColumnLabelRow = true;//1st row is column labels
-            int r = 0;
-
-            // if(DEBUG){
-            //     r = 44;
-            // }
-            logAll(rows.size()+ "");
-            for (;r< rows.size();r++) {
-                if(isColumnLabelRow){
-                    isColumnLabelRow = false;
-                    continue;
-                }
-                String[] row = rows.get(r);
-                if(DEBUG && r > 20){
-                    logAll("BREAK");
-                    break;
-                }
-                logAll("row: " + (r));
-                String folderName = row[1];//1st col is the one with commentid which is the folder name
-                System.out.println("FolderName : " + folderName);
-                
-                File oldFolder = new File("Data New/"+folderName +"/Old");
-                File[] oldFiles = oldFolder.listFiles();
-                log("oldFiles " + (oldFiles == null? "null":"notnull"));
-                File oldFile = oldFiles != null && oldFiles.length > 0? oldFiles[0]: null;
-
-                File newFolder = new File("Data New/"+folderName +"/New");
-
-                File[] newFiles = newFolder.listFiles();
-                log("newFiles " + (newFiles == null? "null":"notnull"));
-                File newFile = newFiles != null && newFiles.length > 0? newFiles[0]: null;
-                
-                boolean hasOldFile = oldFile != null;
-                boolean hasNewFile = newFile != null;
-                boolean isDupe = hasOldFile && hasNewFile && FileUtils.contentEquals(oldFile, newFile);
-                int numOldFiles = oldFiles != null ? oldFiles.length : 0;
-                int numNewFiles = newFiles != null  ? newFiles.length: 0;
-                String error = null;
-
-                Map<String, Integer> metrics = new LinkedHashMap<>();
-                String[] metricRow = new String[headers.size()];
-                try{
-                    if(numOldFiles > 1 || numNewFiles > 1)
-                        throw new IOException("num oldFiles" + numOldFiles + " numNewFiles " + numNewFiles );
-                    if(!hasOldFile && !hasNewFile)
-                        throw new  IOException("not hasOldFile not hasNewFile" );
-                    if(!hasOldFile && hasNewFile){
-                        //this should not be exception though fix later.
-                        throw new  IOException("not has hasOldFile but hasNewFile");
-                    }
-                    if(hasOldFile && !hasNewFile){
-                        newFile = oldFile;
-                    }
-
-
-                    String srcFile = oldFile.getPath();
-                    String dstFile = newFile.getPath();
-                    int lineNo = (int)((float) Float.valueOf(row[6]));
-                    
-                      
-                    Diff results = Diff.compute(srcFile, dstFile);
-                    // TreeClassifier classifier = results.createRootNodesClassifier();//we'll miss a lot of changes if we just get root ndoes that changed
-                    TreeClassifier classifier = results.createAllNodeClassifier();
-                    PythonFileData fileData = PythonFileData.parseFile(srcFile,dstFile, lineNo, results, classifier);
-  
-                    
-                    logAll(fileData.toString());
-
-                    for (MetricCalculator calculator : metricCalculators) {
-                        calculator.calc(metrics,results, classifier, fileData);
-                    }
-                    
-
-                    //#TODO use this as a metric 
-                    metrics.put("hasOldFile", hasOldFile ? 1 : 0);
-                    metrics.put("hasNewFile", hasNewFile ? 1 : 0);
-
-                    metrics.put("numOldFiles",numOldFiles);
-                    metrics.put("numNewFiles",numNewFiles);
-                    metrics.put("isDupe", isDupe? 1: 0);
-                }catch(SyntaxException se){
-
-                    metrics.put("hasOldFile", hasOldFile ? 1 : 0);
-                    metrics.put("hasNewFile", hasNewFile ? 1 : 0);
-
-                    metrics.put("numOldFiles",numOldFiles);
-                    metrics.put("numNewFiles",numNewFiles);
-                    metrics.put("isDupe", isDupe? 1: 0);
-                    error = "syntax";
-                    System.out.println(error);
-                }catch(IOException ioe){
-                    System.out.println(ioe);
-                    metrics.put("hasOldFile", hasOldFile ? 1 : 0);
-                    metrics.put("hasNewFile", hasNewFile ? 1 : 0);
-
-                    metrics.put("numOldFiles",numOldFiles);
-                    metrics.put("numNewFiles",numNewFiles);
-                    metrics.put("isDupe", isDupe? 1: 0);
-                    error = ioe.toString();
-                }
 
-                metricRow[0] = folderName;
-                for(int i = 1; i < headers.size();i++){
-                    metricRow[i] = Integer.toString(metrics.getOrDefault(headers.get(i), 0));
-                    // System.out.print(headers.get(i) +  metricRow[i]);
-                }
-                // System.out.println("");
-                
-                if(error != null){
-                    for (int i = 1; i < postMetricsHeaderStartIndex -1; i++) {
-                        metricRow[i] = Integer.toString(-1);
-                    }
+            if(error != null || staleCalculators.isEmpty()){
+                throw new CachedRowException();
+            }
+
+            String srcFile = oldFile.getPath();
+            String dstFile = newFile.getPath();
+            int lineNo = (int)((float) Float.valueOf(row[6]));
+
+
+            //parsed trees and mappings are cached per (old blob, new blob) pair
+            DiffCache.Entry diffEntry = diffCache.get(oldFile, newFile);
+            Diff results = diffEntry.diff;
+            // TreeClassifier classifier = results.createRootNodesClassifier();//we'll miss a lot of changes if we just get root ndoes that changed
+            TreeClassifier classifier = diffEntry.classifier;
+            if(PROFILE){
+                RowProfile.count("srcNodes", results.src.getRoot().getMetrics().size);
+                RowProfile.count("dstNodes", results.dst.getRoot().getMetrics().size);
+                RowProfile.count("mappings", results.mappings.size());
+                RowProfile.count("actions", results.editScript.size());
+                RowProfile.count("insertedDsts", classifier.getInsertedDsts().size());
+                RowProfile.count("deletedSrcs", classifier.getDeletedSrcs().size());
+                RowProfile.count("updatedSrcs", classifier.getUpdatedSrcs().size());
+                RowProfile.count("movedSrcs", classifier.getMovedSrcs().size());
+            }
+            long start = System.nanoTime();
+            PythonFileData fileData = PythonFileData.parseFile(srcFile,dstFile, lineNo, results, classifier);
+            RowProfile.time("parseFile", start);
+
+
+            //toString only runs when DEBUG is on
+            dlog(fileData);
+
+            //one traversal of each node set for all the calculators
+            new MetricDispatcher(staleCalculators).run(metrics, results, classifier, fileData);
+            if(featureTable != null){
+                for (MetricCalculator calculator : staleCalculators) {
+                    featureTable.put(key, calculator, metrics);
                 }
-                metricRow[metricRow.length -1] = error;
-                writer.writeNext(metricRow);
+            }
+        }catch(CachedRowException ce){
+            log("from feature table " + folderName);
+        }catch(SyntaxException se){
+            error = "syntax";
+            storeError = true;
+            dlog(error);
+        }catch(IOException ioe){
+            dlog(ioe);
+            error = ioe.toString();
+        }
+        if(featureTable != null && (error == null || storeError)){
+            featureTable.putFiles(key, error);
+        }
+        if(profile != null){
+            profiler.write(profile.finish(error));
+        }
+        //#TODO use this as a metric
+        metrics.put("hasOldFile", hasOldFile ? 1 : 0);
+        metrics.put("hasNewFile", hasNewFile ? 1 : 0);
+
+        metrics.put("numOldFiles",numOldFiles);
+        metrics.put("numNewFiles",numNewFiles);
+        metrics.put("isDupe", isDupe? 1: 0);
+
+        metricRow[0] = folderName;
+        for(int i = 1; i < headers.size();i++){
+            metricRow[i] = Integer.toString(metrics.getOrDefault(headers.get(i), 0));
+        }
 
-                // if(DEBUG && isDupe){
-                //     break;
-                // }
+        if(error != null){
+            for (int i = 1; i < postMetricsHeaderStartIndex -1; i++) {
+                metricRow[i] = Integer.toString(-1);
             }
-        }catch(Exception e){
-            logAll("csv error" + e);
-            e.printStackTrace();
         }
+        metricRow[metricRow.length -1] = error;
+        return metricRow;
+    }
+
+    /**
+     * Every value of the row is already in the feature table
+     */
+    static class CachedRowException extends Exception {
     }
 }
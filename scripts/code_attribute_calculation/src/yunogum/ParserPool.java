@@ -0,0 +1,168 @@
+package yunogum;
+
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.ByteArrayOutputStream;
+import java.io.IOException;
+import java.io.InputStream;
+import java.io.OutputStream;
+import java.io.Reader;
+import java.io.StringReader;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.concurrent.BlockingQueue;
+import java.util.concurrent.LinkedBlockingQueue;
+
+import com.github.gumtreediff.gen.SyntaxException;
+import com.github.gumtreediff.gen.TreeGenerator;
+import com.github.gumtreediff.gen.python.PythonTreeGenerator;
+
+/**
+ * Pool of long-lived pythonparser processes(pythonparser_worker.py) instead of one pythonparser process per file.
+ * A worker gets the source over its stdin and answers with pythonparser's xml, which PythonTreeGenerator turns into
+ * a tree as usual, so the trees are the same as GumTree's. A worker that dies is stopped and its slot goes back to
+ * the pool, the next file that takes the slot starts a new process in it. A restart that fails fails that file only,
+ * so the pool never loses a slot.
+ */
+public class ParserPool implements AutoCloseable {
+    public static final String WORKER_SCRIPT = System.getProperty("gt.pp.worker", "pythonparser_worker.py");
+    public static final String PYTHON = System.getProperty("gt.pp.python", "python3");
+    public static final String PYTHONPARSER = System.getProperty("gt.pp.path", "pythonparser");
+
+    static class Worker {
+        Process process;
+        OutputStream in;
+        InputStream out;
+
+        /**
+         * Starts the process of an empty slot
+         */
+        void start() throws IOException {
+            ProcessBuilder builder = new ProcessBuilder(PYTHON, WORKER_SCRIPT, PYTHONPARSER);
+            builder.redirectError(ProcessBuilder.Redirect.INHERIT);
+            process = builder.start();
+            in = new BufferedOutputStream(process.getOutputStream());
+            out = new BufferedInputStream(process.getInputStream());
+        }
+
+        String readLine() throws IOException {
+            ByteArrayOutputStream line = new ByteArrayOutputStream();
+            int b;
+            while ((b = out.read()) != '\n') {
+                if(b < 0){
+                    throw new IOException("parser worker exited");
+                }
+                line.write(b);
+            }
+            return line.toString("UTF-8");
+        }
+
+        /**
+         * pythonparser's output for source, null if pythonparser failed on it
+         */
+        String parse(String source) throws IOException {
+            byte[] request = source.getBytes(StandardCharsets.UTF_8);
+            in.write((request.length + "\n").getBytes(StandardCharsets.UTF_8));
+            in.write(request);
+            in.flush();
+
+            String[] header = readLine().split(" ");
+            byte[] body = new byte[Integer.parseInt(header[1])];
+            int read = 0;
+            while (read < body.length) {
+                int n = out.read(body, read, body.length - read);
+                if(n < 0){
+                    throw new IOException("parser worker exited");
+                }
+                read += n;
+            }
+            String response = new String(body, StandardCharsets.UTF_8);
+            if(header[0].equals("error")){
+                MetricRunner.dlog("pythonparser failed " + response);
+                return null;
+            }
+            return response;
+        }
+
+        void close(){
+            if(process != null){
+                process.destroy();
+                process = null;
+            }
+        }
+    }
+
+    BlockingQueue<Worker> idle = new LinkedBlockingQueue<>();
+    List<Worker> workers = new ArrayList<>();
+
+    public ParserPool(int size) throws IOException {
+        try{
+            for (int i = 0; i < Math.max(1, size); i++) {
+                Worker worker = new Worker();
+                workers.add(worker);
+                worker.start();
+                idle.add(worker);
+            }
+        }catch(IOException e){
+            close();
+            throw e;
+        }
+    }
+
+    /**
+     * pythonparser's output for source, null if it does not parse
+     */
+    public String parse(String source) throws IOException {
+        Worker worker;
+        try{
+            worker = idle.take();
+        }catch(InterruptedException e){
+            Thread.currentThread().interrupt();
+            throw new IOException("interrupted waiting for a parser worker");
+        }
+        try{
+            if(worker.process == null){
+                worker.start();
+            }
+            return worker.parse(source);
+        }catch(IOException | RuntimeException e){
+            //the worker's stream is out of step, it died or did not start, the next file restarts it
+            worker.close();
+            throw new IOException("parser worker failed " + e, e);
+        }finally{
+            idle.add(worker);
+        }
+    }
+
+    /**
+     * PythonTreeGenerator that gets pythonparser's output from the pool
+     */
+    public TreeGenerator generator(){
+        return new PythonTreeGenerator(){
+            @Override
+            public String readStandardOutput(Reader r) throws IOException {
+                StringBuilder source = new StringBuilder();
+                char[] buffer = new char[8192];
+                int n;
+                while ((n = r.read(buffer)) >= 0) {
+                    source.append(buffer, 0, n);
+                }
+                String output = parse(source.toString());
+                if(output == null){
+                    throw new SyntaxException(this, new StringReader(source.toString()), null);
+                }
+                return output;
+            }
+        };
+    }
+
+    @Override
+    public void close(){
+        synchronized (workers) {
+            for (Worker worker : workers) {
+                worker.close();
+            }
+        }
+    }
+}
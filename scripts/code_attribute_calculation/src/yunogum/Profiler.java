@@ -0,0 +1,114 @@
+package yunogum;
+
+import java.io.File;
+import java.io.FileWriter;
+import java.io.IOException;
+import java.io.PrintWriter;
+import java.util.ArrayList;
+import java.util.Comparator;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Locale;
+import java.util.Map;
+import java.util.PriorityQueue;
+
+/**
+ * Per row stage timings of a MetricRunner run.
+ * Every finished row is appended to a jsonl file(one RowProfile.toJson per line) as it completes, and the summary
+ * ranks the slowest rows and the stages by their total time over the run. Only the running totals of the stages and
+ * the SLOWEST_ROWS slowest rows are kept in memory, the other rows are only in the jsonl file.
+ */
+public class Profiler {
+    public static final int SLOWEST_ROWS = 20;
+
+    File file;
+    PrintWriter writer;
+    //stage -> total nanoseconds and number of rows
+    Map<String, long[]> totals = new HashMap<>();
+    //the slowest rows so far, fastest of them first
+    PriorityQueue<RowProfile> slowest = new PriorityQueue<>(Comparator.comparingLong((RowProfile p) -> p.totalNanos));
+    int rows;
+    long rowTotal;
+    long start = System.nanoTime();
+
+    public Profiler(File file) throws IOException {
+        this.file = file;
+        this.writer = new PrintWriter(new FileWriter(file));
+    }
+
+    public synchronized void write(RowProfile profile){
+        rows++;
+        rowTotal += profile.totalNanos;
+        for (Map.Entry<String, Long> stage : profile.stages.entrySet()) {
+            long[] total = totals.computeIfAbsent(stage.getKey(), k -> new long[2]);
+            total[0] += stage.getValue();
+            total[1]++;
+        }
+        slowest.add(profile);
+        if(slowest.size() > SLOWEST_ROWS){
+            slowest.poll();
+        }
+        writer.println(profile.toJson());
+        writer.flush();
+    }
+
+    /**
+     * Stages by total time over all rows, slowest first, with their row count
+     */
+    Map<String, long[]> stageTotals(){
+        List<Map.Entry<String, long[]>> ranked = new ArrayList<>(totals.entrySet());
+        ranked.sort(Comparator.comparingLong((Map.Entry<String, long[]> e) -> -e.getValue()[0]));
+        Map<String, long[]> sorted = new LinkedHashMap<>();
+        for (Map.Entry<String, long[]> entry : ranked) {
+            sorted.put(entry.getKey(), entry.getValue());
+        }
+        return sorted;
+    }
+
+    public synchronized List<String> summary(){
+        List<String> lines = new ArrayList<>();
+        long wall = System.nanoTime() - start;
+        lines.add("rows " + rows + " wall " + RowProfile.millis(wall) + "ms row time " + RowProfile.millis(rowTotal) + "ms");
+
+        lines.add("stages by total time:");
+        for (Map.Entry<String, long[]> stage : stageTotals().entrySet()) {
+            long nanos = stage.getValue()[0];
+            lines.add(String.format(Locale.ROOT, "  %-40s %12sms %5.1f%% of row time, %d rows", stage.getKey(), RowProfile.millis(nanos),
+                rowTotal > 0 ? 100.0 * nanos / rowTotal : 0.0, stage.getValue()[1]));
+        }
+
+        List<RowProfile> ranked = new ArrayList<>(slowest);
+        ranked.sort(Comparator.comparingLong((RowProfile p) -> -p.totalNanos));
+        lines.add("slowest rows:");
+        for (RowProfile profile : ranked) {
+            String slowestStage = null;
+            long slowestNanos = -1;
+            for (Map.Entry<String, Long> stage : profile.stages.entrySet()) {
+                if(stage.getValue() > slowestNanos){
+                    slowestStage = stage.getKey();
+                    slowestNanos = stage.getValue();
+                }
+            }
+            lines.add(String.format(Locale.ROOT, "  row %d %s %sms, mostly %s %sms, nodes %d/%d", profile.row, profile.commentId,
+                RowProfile.millis(profile.totalNanos), slowestStage, RowProfile.millis(Math.max(slowestNanos, 0)),
+                profile.counts.getOrDefault("srcNodes", 0), profile.counts.getOrDefault("dstNodes", 0)));
+        }
+        return lines;
+    }
+
+    /**
+     * Closes the jsonl file, logs the summary and writes it next to it(.summary.txt)
+     */
+    public synchronized void close() throws IOException {
+        writer.close();
+        List<String> lines = summary();
+        String summaryPath = file.getPath().replaceAll("\\.jsonl$", "") + ".summary.txt";
+        try(PrintWriter summaryWriter = new PrintWriter(new FileWriter(summaryPath))){
+            for (String line : lines) {
+                MetricRunner.logAll(line);
+                summaryWriter.println(line);
+            }
+        }
+    }
+}
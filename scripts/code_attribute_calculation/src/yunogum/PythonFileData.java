@@ -47,6 +47,9 @@ public class PythonFileData {
     public TreeClassifier classifier;
     private int extendedRangeStartLineNo;
     private int extendedRangeEndLineNo;
+    RangeIndex rangeIndex;
+    int[] dstParentsInExtendedRange;
+    int[] dstParentsInLineRange;
     
     /**
      * Get list of trees spanning range. Does not contain subtrees of a tree that is within range. Only the
@@ -342,38 +345,8 @@ public class PythonFileData {
     }
 
     static List<Integer> countCharsUpToEachLine(String filePath,int lineNo){
-        
-        List<Integer> results = new ArrayList<>();
-
-        try(BufferedReader br = new BufferedReader(new FileReader(filePath)))
-        {
-            String line = null; 
-
-            int runningCount = 0;
-            results.add(runningCount);
-            int l = 0;
-            while ((line = br.readLine()) != null)  
-            {  
-                //we are  reading lines, not the entire file char by char
-                //this means that we ignore the additional \n character
-                //this'll break if newlien is two characters 
-                //but it's not for the files I've looked at.
-                
-                //let's pray that's the case because otherwise we'll need to go thrugh the file char by char and detect newline manually
-                runningCount +=  line.length() + 1;
-                l++;
-                // if(++l == lineNo){
-                    // System.out.println("LineNo: " + l + " : " + line+ " len add: " + (line.length() + 1) + " total " + runningCount);
-
-                // }
-                results.add(runningCount);//the last value is the count of cahrs in file
-                //maybe need to compensate for 
-            }
-            
-        }catch(Exception e){
-
-        }
-        return results;
+        //the same blob backs many comments, so the counts come from its persisted line index
+        return LineIndex.charCountUpToEachLine(filePath);
     }
 
 
@@ -416,6 +389,11 @@ public class PythonFileData {
         this.diff = diff;
         this.classifier = classifier;
         
+        //one pass answers the dst range queries of every node, the insertion mapping below already needs them
+        this.rangeIndex = RangeIndex.of(diff);
+        this.dstParentsInExtendedRange = IGNORE_RANGE
+            ? rangeIndex.firstMappedParentsInRange(Integer.MIN_VALUE, Integer.MAX_VALUE)
+            : rangeIndex.firstMappedParentsInRange(extendedNodeRangeStart, extendedNodeRangeEnd);
         this.dstTreeToSrcInsertActionMap = mapDstTreeToSrcInsertionActions(diff);
 
         // extendedRangeStartLineNo = 1;
@@ -585,22 +563,7 @@ public class PythonFileData {
     boolean isDstNodeInLineRange(Tree dstNode){
         if(IGNORE_RANGE)
             return true;
-        Tree mappedSrcNode = diff.mappings.getSrcForDst(dstNode);
-        if(mappedSrcNode != null){
-            if(isSrcNodeInLineRange(mappedSrcNode)){
-                return true;
-            }else if(isSrcNodeFullyOutsideLineRange(mappedSrcNode)){
-                return false;
-            }else{//#TODO overlap edges of range edgecase. For now return false
-                return false;
-            }
-        }else{
-            if(dstNode.getParent() == null){
-                return false;
-            }else{
-                return isDstNodeInLineRange(dstNode.getParent());
-            }
-        }
+        return getDstNodeParentOverlappingLineRange(dstNode, diff) != null;
     }
 
     /**
@@ -610,22 +573,12 @@ public class PythonFileData {
      * @return SAID PARENT IN DST TREE, null if outside range or overlap but not contain range  
      */
     public Tree getDstNodeParentOverlappingLineRange(Tree dstNode,Diff diff){
-        Tree mappedSrcNode = diff.mappings.getSrcForDst(dstNode);
-        if(mappedSrcNode != null){
-            if(isSrcNodeInLineRange(mappedSrcNode)){
-                return dstNode;
-            }else if(isSrcNodeFullyOutsideLineRange(mappedSrcNode)){
-                return null;
-            }else{//#TODO overlap edges of range edgecase. For now return false
-                return null;
-            }
-        }else{
-            if(dstNode.getParent() == null){
-                return null;
-            }else{
-                return getDstNodeParentOverlappingLineRange(dstNode.getParent(), diff);
-            }
+        if(dstParentsInLineRange == null){
+            dstParentsInLineRange = IGNORE_RANGE
+                ? rangeIndex.firstMappedParentsInRange(Integer.MIN_VALUE, Integer.MAX_VALUE)
+                : rangeIndex.firstMappedParentsInRange(lineOuterNodeStart, lineOuterNodeEnd);
         }
+        return rangeIndex.parentInRange(dstParentsInLineRange, dstNode);
     }
 
         /**
@@ -635,23 +588,7 @@ public class PythonFileData {
      * @return SAID PARENT IN DST TREE, null if outside range or overlap but not contain range 
      */
     public Tree getDstNodeParentOverlappingExtendedRange(Tree dstNode){
-        Tree mappedSrcNode = diff.mappings.getSrcForDst(dstNode);
-        // MetricRunner.dlog("getparent overlap " + dstNode + " x " + mappedSrcNode); 
-        if(mappedSrcNode != null){
-            if(isSrcNodeInExtendedRange(mappedSrcNode)){
-                return dstNode;
-            }else if(isSrcNodeFullyOutsideExtendedRange(mappedSrcNode)){
-                return null;
-            }else{//#TODO overlap edges of range edgecase. For now return false
-                return null;
-            }
-        }else{
-            if(dstNode.getParent() == null){
-                return null;
-            }else{
-                return getDstNodeParentOverlappingExtendedRange(dstNode.getParent());
-            }
-        }
+        return rangeIndex.parentInRange(dstParentsInExtendedRange, dstNode);
     }
 
     public boolean isInsertedNodeInExtendedRange(Tree insertedDstNode){
@@ -677,22 +614,7 @@ public class PythonFileData {
     public boolean isDstNodeInExtendedRange(Tree dstNode){
         if(IGNORE_RANGE)
             return true;
-        Tree mappedSrcNode = diff.mappings.getSrcForDst(dstNode);
-        if(mappedSrcNode != null){
-            if(isSrcNodeInExtendedRange(mappedSrcNode)){
-                return true;
-            }else if(isSrcNodeFullyOutsideExtendedRange(mappedSrcNode)){
-                return false;
-            }else{//#TODO overlap edges of range edgecase. For now return false
-                return false;
-            }
-        }else{
-            if(dstNode.getParent() == null){
-                return false;
-            }else{
-                return isDstNodeInExtendedRange(dstNode.getParent());
-            }
-        }
+        return getDstNodeParentOverlappingExtendedRange(dstNode) != null;
     }
 
     String describeContainerFunction(){
@@ -0,0 +1,81 @@
+package yunogum;
+
+import java.util.ArrayList;
+import java.util.Collections;
+import java.util.IdentityHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.WeakHashMap;
+
+import com.github.gumtreediff.actions.Diff;
+import com.github.gumtreediff.tree.Tree;
+
+/**
+ * Flat pre-order arrays of a diff's dst tree: the parent of every node and the position of the src node it maps to.
+ * Built once per Diff(a cached diff is shared by all the comments on its blob pair). The "first mapped parent in range"
+ * walks of PythonFileData become one pass over the arrays per range, every node's answer is then a lookup.
+ */
+public class RangeIndex {
+    static Map<Diff, RangeIndex> indices = Collections.synchronizedMap(new WeakHashMap<>());
+
+    public static RangeIndex of(Diff diff){
+        return indices.computeIfAbsent(diff, RangeIndex::new);
+    }
+
+    List<Tree> dstNodes = new ArrayList<>();
+    Map<Tree, Integer> dstOrder = new IdentityHashMap<>();
+    int[] parent;
+    boolean[] mapped;
+    int[] srcPos;
+    int[] srcEndPos;
+
+    RangeIndex(Diff diff){
+        for (Tree t : diff.dst.getRoot().preOrder()) {
+            dstOrder.put(t, dstNodes.size());
+            dstNodes.add(t);
+        }
+        int size = dstNodes.size();
+        parent = new int[size];
+        mapped = new boolean[size];
+        srcPos = new int[size];
+        srcEndPos = new int[size];
+        for (int i = 0; i < size; i++) {
+            Tree t = dstNodes.get(i);
+            Integer parentIndex = t.getParent() == null ? null : dstOrder.get(t.getParent());
+            parent[i] = parentIndex == null ? -1 : parentIndex;
+            Tree src = diff.mappings.getSrcForDst(t);
+            if(src != null){
+                mapped[i] = true;
+                srcPos[i] = src.getPos();
+                srcEndPos[i] = src.getEndPos();
+            }
+        }
+    }
+
+    /**
+     * For every dst node(by pre-order index) the index of its first mapped ancestor(or itself), if the src node that one
+     * maps to lies within [start, end], else -1. Parents come before their children in pre-order so one pass is enough.
+     */
+    public int[] firstMappedParentsInRange(int start, int end){
+        int[] results = new int[dstNodes.size()];
+        for (int i = 0; i < results.length; i++) {
+            if(mapped[i]){
+                results[i] = srcPos[i] >= start && srcEndPos[i] <= end ? i : -1;
+            }else{
+                results[i] = parent[i] < 0 ? -1 : results[parent[i]];
+            }
+        }
+        return results;
+    }
+
+    /**
+     * Lookup in the result of firstMappedParentsInRange, null for nodes outside the dst tree
+     */
+    public Tree parentInRange(int[] parentsInRange, Tree dstNode){
+        Integer i = dstOrder.get(dstNode);
+        if(i == null || parentsInRange[i] < 0){
+            return null;
+        }
+        return dstNodes.get(parentsInRange[i]);
+    }
+}
@@ -0,0 +1,111 @@
+package yunogum;
+
+import java.util.LinkedHashMap;
+import java.util.Locale;
+import java.util.Map;
+
+/**
+ * Time spent in each stage of one row and the node counts of its diff.
+ * The row's worker thread holds it as the current profile, so DiffCache and the calculators can add their stages
+ * without it being passed around. Stages with the same name add up.
+ */
+public class RowProfile {
+    static final ThreadLocal<RowProfile> CURRENT = new ThreadLocal<>();
+
+    public final int row;
+    public final String commentId;
+    public String error;
+    long start = System.nanoTime();
+    public long totalNanos;
+    //stage -> nanoseconds, in the order the stages ran
+    public final Map<String, Long> stages = new LinkedHashMap<>();
+    public final Map<String, Integer> counts = new LinkedHashMap<>();
+
+    RowProfile(int row, String commentId){
+        this.row = row;
+        this.commentId = commentId;
+    }
+
+    /**
+     * Starts the profile of a row on this thread
+     */
+    public static RowProfile start(int row, String commentId){
+        RowProfile profile = new RowProfile(row, commentId);
+        CURRENT.set(profile);
+        return profile;
+    }
+
+    public RowProfile finish(String error){
+        this.error = error;
+        totalNanos = System.nanoTime() - start;
+        CURRENT.remove();
+        return this;
+    }
+
+    /**
+     * Adds the time since startNanos(System.nanoTime()) to stage of the current row, if a row is profiled
+     */
+    public static void time(String stage, long startNanos){
+        add(stage, System.nanoTime() - startNanos);
+    }
+
+    public static void add(String stage, long nanos){
+        RowProfile profile = CURRENT.get();
+        if(profile != null){
+            profile.stages.merge(stage, nanos, Long::sum);
+        }
+    }
+
+    public static void count(String name, int count){
+        RowProfile profile = CURRENT.get();
+        if(profile != null){
+            profile.counts.merge(name, count, Integer::sum);
+        }
+    }
+
+    static String millis(long nanos){
+        //json and the summary need a . as decimal separator whatever the default locale
+        return String.format(Locale.ROOT, "%.3f", nanos / 1e6);
+    }
+
+    static String quote(String s){
+        if(s == null){
+            return "null";
+        }
+        StringBuilder quoted = new StringBuilder("\"");
+        for (char c : s.toCharArray()) {
+            if(c == '"' || c == '\\'){
+                quoted.append('\\').append(c);
+            }else if(c < 0x20){
+                quoted.append(String.format("\\u%04x", (int) c));
+            }else{
+                quoted.append(c);
+            }
+        }
+        return quoted.append('"').toString();
+    }
+
+    /**
+     * One json object: row, comment_id, error, total_ms, stages_ms and counts
+     */
+    public String toJson(){
+        StringBuilder json = new StringBuilder();
+        json.append("{\"row\": ").append(row)
+            .append(", \"comment_id\": ").append(quote(commentId))
+            .append(", \"error\": ").append(quote(error))
+            .append(", \"total_ms\": ").append(millis(totalNanos))
+            .append(", \"stages_ms\": {");
+        String separator = "";
+        for (Map.Entry<String, Long> stage : stages.entrySet()) {
+            json.append(separator).append(quote(stage.getKey())).append(": ").append(millis(stage.getValue()));
+            separator = ", ";
+        }
+        json.append("}, \"counts\": {");
+        separator = "";
+        for (Map.Entry<String, Integer> count : counts.entrySet()) {
+            json.append(separator).append(quote(count.getKey())).append(": ").append(count.getValue());
+            separator = ", ";
+        }
+        return json.append("}}").toString();
+    }
+}
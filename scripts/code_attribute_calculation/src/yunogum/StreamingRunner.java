@@ -0,0 +1,257 @@
+package yunogum;
+
+import java.io.File;
+import java.io.FileReader;
+import java.io.FileWriter;
+import java.io.IOException;
+import java.io.RandomAccessFile;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.concurrent.PriorityBlockingQueue;
+import java.util.concurrent.Semaphore;
+import java.util.concurrent.ThreadPoolExecutor;
+import java.util.concurrent.TimeUnit;
+
+import com.opencsv.CSVReader;
+import com.opencsv.CSVWriter;
+
+/**
+ * Runs the rows of an input csv on a pool of worker threads while reading it, and writes the results in input order.
+ * At most window rows are read ahead of the last written one, so memory does not grow with the input. Of the rows
+ * read, the workers take the one with the biggest old and new blobs first, so a big snapshot does not start last.
+ * Every row is flushed as it is written, the output is always the header and the results of a prefix of the input,
+ * and a run with resume continues after the rows already in it. The input's path, size and modification time are
+ * recorded next to the output(.input), a resume from another input is refused.
+ */
+public class StreamingRunner {
+    public static final int ROWS_PER_THREAD = 8;
+
+    public interface RowTask {
+        String[] calc(String[] row, int index) throws Exception;
+    }
+
+    class Job implements Runnable, Comparable<Job> {
+        String[] row;
+        int index;
+        long cost;
+
+        Job(String[] row, int index, long cost){
+            this.row = row;
+            this.index = index;
+            this.cost = cost;
+        }
+
+        public void run(){
+            try{
+                if(failure == null){
+                    write(index, task.calc(row, index));
+                }
+            }catch(Throwable e){
+                //Errors too(a StackOverflowError on a deep tree, an OutOfMemoryError), anything left uncaught
+                //here leaves the reader waiting for a row that is never written
+                failure = e;
+                //the rows after this one are never written, do not leave the reader waiting for them
+                semaphore.release(window);
+            }
+        }
+
+        public int compareTo(Job other){
+            //most expensive first, ties in row order
+            return cost != other.cost ? Long.compare(other.cost, cost) : Integer.compare(index, other.index);
+        }
+    }
+
+    String output;
+    int threads;
+    int window;
+    RowTask task;
+    Semaphore semaphore;
+    CSVWriter writer;
+    //results that finished before an earlier row
+    Map<Integer, String[]> pending = new HashMap<>();
+    int nextIndex;
+    volatile Throwable failure;
+
+    public StreamingRunner(String output, int threads){
+        this.output = output;
+        this.threads = Math.max(1, threads);
+        this.window = this.threads * ROWS_PER_THREAD;
+    }
+
+    /**
+     * Bytes of the old and new snapshots of a row, the diff cost grows with them
+     */
+    static long cost(String[] row, BlobStore blobStore){
+        long size = 0;
+        for (String side : new String[]{BlobStore.OLD, BlobStore.NEW}) {
+            File[] files = blobStore.listFiles(row[1], side);
+            if(files != null){
+                for (File file : files) {
+                    size += file.length();
+                }
+            }
+        }
+        return size;
+    }
+
+    //row that does not parse, it ends the complete rows
+    static final String[] MALFORMED = new String[0];
+
+    /**
+     * Next row of reader, null at the end, MALFORMED if the rest does not parse(a row cut short by a crash)
+     */
+    static String[] readRow(CSVReader reader){
+        try{
+            return reader.readNext();
+        }catch(Exception e){
+            MetricRunner.logAll("output ends with a malformed row " + e);
+            return MALFORMED;
+        }
+    }
+
+    static boolean endsWithNewline(File file) throws IOException {
+        try(RandomAccessFile f = new RandomAccessFile(file, "r")){
+            if(f.length() == 0){
+                return false;
+            }
+            f.seek(f.length() - 1);
+            return f.read() == '\n';
+        }
+    }
+
+    /**
+     * Number of complete rows after the header in output, the output is rewritten without anything after them.
+     * 0 if there is no output or its header differs.
+     */
+    static int completeRows(File outputFile, String[] header) throws IOException {
+        if(!outputFile.exists()){
+            return 0;
+        }
+        File tmpFile = new File(outputFile.getPath() + ".tmp");
+        //every row is written with its line end, without one the last row was cut short even if it parses
+        boolean lastRowComplete = endsWithNewline(outputFile);
+        int rows = 0;
+        boolean sameHeader = false;
+        try(CSVReader reader = new CSVReader(new FileReader(outputFile));
+            CSVWriter tmpWriter = new CSVWriter(new FileWriter(tmpFile))){
+            String[] row = readRow(reader);
+            sameHeader = row != null && String.join(",", row).equals(String.join(",", header));
+            if(!sameHeader){
+                MetricRunner.logAll("other columns in " + outputFile + ", starting over");
+            }else{
+                tmpWriter.writeNext(row);
+                //a crash can only cut the last row short, a row is kept once the one after it is read
+                row = readRow(reader);
+                while (row != null && row.length == header.length) {
+                    String[] next = readRow(reader);
+                    if(next == null && !lastRowComplete){
+                        MetricRunner.logAll("output ends with a row cut short, dropping it");
+                        break;
+                    }
+                    tmpWriter.writeNext(row);
+                    rows++;
+                    row = next;
+                }
+            }
+        }
+        if(!sameHeader){
+            tmpFile.delete();
+            return 0;
+        }
+        if(!tmpFile.renameTo(outputFile)){
+            throw new IOException("could not rewrite " + outputFile);
+        }
+        return rows;
+    }
+
+    /**
+     * Path, size and modification time of the input
+     */
+    static String fingerprint(File input){
+        return input.getAbsolutePath() + "\t" + input.length() + "\t" + input.lastModified();
+    }
+
+    /**
+     * Throws if the output was not written from this input, unless there is no output yet
+     */
+    void checkInput(File input, File outputFile, File inputFile) throws IOException {
+        if(!outputFile.exists()){
+            return;
+        }
+        String recorded = inputFile.exists() ? new String(Files.readAllBytes(inputFile.toPath()), StandardCharsets.UTF_8).trim() : null;
+        if(!fingerprint(input).equals(recorded)){
+            throw new IOException("can not resume " + output + ", it was written from "
+                + (recorded == null ? "an unknown input" : recorded) + " not " + fingerprint(input) + ", run without resume");
+        }
+    }
+
+    /**
+     * Writes header and task's result for every data row of reader(reading input, after its header row) to the output,
+     * in row order. maxRows limits the data rows, -1 for all of them. With resume the rows already in the output are
+     * skipped.
+     * Returns the number of rows computed in this run.
+     */
+    public int run(File input, CSVReader reader, String[] header, BlobStore blobStore, RowTask task, int maxRows, boolean resume)
+            throws IOException, InterruptedException {
+        this.task = task;
+        File outputFile = new File(output);
+        File inputFile = new File(output + ".input");
+        if(resume){
+            checkInput(input, outputFile, inputFile);
+        }
+        int done = resume ? completeRows(outputFile, header) : 0;
+        if(done == 0){
+            Files.write(inputFile.toPath(), (fingerprint(input) + "\n").getBytes(StandardCharsets.UTF_8));
+        }
+        writer = new CSVWriter(new FileWriter(outputFile, done > 0));
+        if(done == 0){
+            writer.writeNext(header);
+            writer.flush();
+        }else{
+            MetricRunner.logAll("resuming after row " + done);
+        }
+        nextIndex = done;
+        semaphore = new Semaphore(window);
+
+        ThreadPoolExecutor pool = new ThreadPoolExecutor(threads, threads, 0L, TimeUnit.MILLISECONDS, new PriorityBlockingQueue<>());
+        int index = 0;
+        try{
+            String[] row = reader.readNext();//1st row is column labels
+            while (failure == null && (maxRows < 0 || index < maxRows) && (row = reader.readNext()) != null) {
+                if(index >= done){
+                    semaphore.acquire();
+                    pool.execute(new Job(row, index, cost(row, blobStore)));
+                }
+                index++;
+            }
+        }catch(IOException e){
+            throw e;
+        }catch(Exception e){
+            throw new IOException("bad input row " + (index + 1) + " " + e);
+        }finally{
+            pool.shutdown();
+            pool.awaitTermination(Long.MAX_VALUE, TimeUnit.MILLISECONDS);
+            writer.close();
+        }
+        if(failure != null){
+            throw new IOException("row failed " + failure, failure);
+        }
+        //the rows written in this run, a row is written once it is computed
+        return nextIndex - done;
+    }
+
+    /**
+     * Writes the result of row index, and every finished row after it, once all the rows before it are written
+     */
+    synchronized void write(int index, String[] result) throws IOException {
+        pending.put(index, result);
+        while (pending.containsKey(nextIndex)) {
+            writer.writeNext(pending.remove(nextIndex));
+            writer.flush();
+            nextIndex++;
+            semaphore.release();
+        }
+    }
+}
@@ -0,0 +1 @@
+"""Helpers shared by the comment classification notebook and its command line tools."""
@@ -0,0 +1,155 @@
+"""Length bucketed batches with per batch padding.
+
+Token arrays stay right padded to their maximum length on disk, and the
+attention masks give each row's real length. A batch groups rows of similar
+length and is only padded to its own longest row. The encoder and the LSTMs
+then no longer run over hundreds of pad positions for a one sentence comment.
+
+A split (fold, validation set, ...) is given as the row indices into the full
+inputs, which may be memory mapped. Batches gather their rows straight from
+there, so no per split copy of the inputs is made. bucketed_dataset serves
+the batches through tf.data, built in the background while the model trains.
+"""
+import numpy as np
+import tensorflow as tf
+
+MASK_SUFFIX = 'attention_mask'
+# per token inputs padded along with their mask
+SEQUENCE_SUFFIXES = ('input_ids', 'hidden_states')
+# rows are shuffled, then sorted by length within pools of this many batches
+BUCKET_POOL_BATCHES = 50
+
+
+def sequence_inputs(inputs):
+    """Mask key -> keys of the per token inputs it masks, for every sequence in an input dict."""
+    groups = dict()
+    for key in inputs:
+        if key.endswith(MASK_SUFFIX):
+            prefix = key[:-len(MASK_SUFFIX)]
+            groups[key] = [prefix + suffix for suffix in SEQUENCE_SUFFIXES if prefix + suffix in inputs]
+    return groups
+
+
+def num_rows(inputs):
+    return len(next(iter(inputs.values())))
+
+
+def sequence_lengths(inputs):
+    """Length of the longest tokenized input of each row."""
+    lengths = np.zeros(num_rows(inputs), dtype=np.int64)
+    for mask_key in sequence_inputs(inputs):
+        lengths = np.maximum(lengths, np.asarray(inputs[mask_key]).sum(axis=1))
+    return lengths
+
+
+def bucket_batches(lengths, batch_size, shuffle=False, seed=None):
+    """Row indices of each batch, rows of similar length end up together."""
+    if not shuffle:
+        order = np.argsort(lengths, kind='stable')
+        return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(lengths))
+    pool_size = batch_size * BUCKET_POOL_BATCHES
+    batches = []
+    for pool_start in range(0, len(order), pool_size):
+        pool = order[pool_start:pool_start + pool_size]
+        pool = pool[np.argsort(lengths[pool], kind='stable')]
+        batches.extend(pool[start:start + batch_size] for start in range(0, len(pool), batch_size))
+    rng.shuffle(batches)
+    return batches
+
+
+def pad_batch(inputs, rows):
+    """Slice rows out of the input dict, padding tokenized inputs only to the longest row of the batch."""
+    batch = dict()
+    for mask_key, sequence_keys in sequence_inputs(inputs).items():
+        masks = np.asarray(inputs[mask_key][rows])
+        width = max(1, int(masks.sum(axis=1).max()))
+        batch[mask_key] = masks[:, :width]
+        for key in sequence_keys:
+            batch[key] = np.asarray(inputs[key][rows])[:, :width]
+    for key in inputs:
+        if key not in batch:
+            batch[key] = np.asarray(inputs[key][rows])
+    return batch
+
+
+class BucketedSequence(tf.keras.utils.Sequence):
+    """Batches of the given rows of inputs and labels, all rows when rows is None."""
+
+    def __init__(self, inputs, labels=None, batch_size=8, shuffle=False, seed=None, rows=None):
+        self.inputs = inputs
+        self.labels = labels
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.rows = np.arange(num_rows(inputs)) if rows is None else np.asarray(rows, dtype=np.int64)
+        self.lengths = sequence_lengths(inputs)[self.rows]
+        self.batches = bucket_batches(self.lengths, batch_size, shuffle, seed)
+
+    @property
+    def order(self):
+        """Position in rows of each output of predict(), in batch order."""
+        return np.concatenate(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __getitem__(self, i):
+        rows = self.rows[self.batches[i]]
+        batch = pad_batch(self.inputs, rows)
+        if self.labels is None:
+            return batch
+        return batch, self.labels[rows]
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.epoch += 1
+            seed = None if self.seed is None else self.seed + self.epoch
+            self.batches = bucket_batches(self.lengths, self.batch_size, True, seed)
+
+
+def sequence_dataset(sequence):
+    """tf.data pipeline over the batches of a BucketedSequence, prefetched in the background.
+
+    Every pass over the dataset is one epoch, reshuffled like Sequence.on_epoch_end.
+    """
+    def batches():
+        for i in range(len(sequence)):
+            yield sequence[i]
+        sequence.on_epoch_end()
+
+    def spec(key, values):
+        shape = (None,) + values.shape[1:]
+        if key in widths:
+            # batch widths differ, see pad_batch
+            shape = (None, None) + values.shape[2:]
+        return tf.TensorSpec(shape=shape, dtype=values.dtype, name=key)
+
+    groups = sequence_inputs(sequence.inputs)
+    widths = set(groups).union(*groups.values())
+    first = sequence[0]
+    inputs = first if sequence.labels is None else first[0]
+    signature = {key: spec(key, values) for key, values in inputs.items()}
+    if sequence.labels is not None:
+        signature = (signature, spec(None, np.asarray(first[1])))
+
+    dataset = tf.data.Dataset.from_generator(batches, output_signature=signature)
+    dataset = dataset.apply(tf.data.experimental.assert_cardinality(len(sequence)))
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def bucketed_dataset(inputs, labels=None, batch_size=8, shuffle=False, seed=None, rows=None):
+    """sequence_dataset of a BucketedSequence, e.g. for model.fit(bucketed_dataset(inputs, y, 4, True, SEED, train_rows))."""
+    return sequence_dataset(BucketedSequence(inputs, labels, batch_size, shuffle, seed, rows))
+
+
+def predict_bucketed(model, inputs, batch_size=8, rows=None):
+    """model.predict over length bucketed batches of rows (all rows when None), returned in the order of rows."""
+    sequence = BucketedSequence(inputs, batch_size=batch_size, rows=rows)
+    predictions = model.predict(sequence_dataset(sequence))
+    ordered = np.empty_like(predictions)
+    ordered[sequence.order] = predictions
+    return ordered
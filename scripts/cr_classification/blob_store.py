@@ -0,0 +1,130 @@
+"""Content addressed store for the 'Data New' source snapshots.
+
+Most of the Old/New snapshots are copies of the same few Nova files, so every
+unique file is kept once under objects/ (named by the sha1 of its content) and
+manifest.csv maps comment_id and side (Old/New) to the blob ids.
+
+Build the store from the published layout with:
+
+    python -m cr_classification.blob_store build "Data New" blobs
+"""
+import argparse
+import csv
+import hashlib
+import os
+import shutil
+import sys
+
+OLD = 'Old'
+NEW = 'New'
+SIDES = (OLD, NEW)
+
+MANIFEST_FILE = 'manifest.csv'
+OBJECTS_DIR = 'objects'
+MANIFEST_HEADER = ['comment_id', 'side', 'file_name', 'blob_id']
+
+
+def hash_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def blob_relative_path(blob_id, file_name):
+    # keep the extension, gumtree picks the parser from it
+    extension = os.path.splitext(file_name)[1]
+    return os.path.join(OBJECTS_DIR, blob_id[:2], blob_id + extension)
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = root
+        # comment_id -> side -> [(file_name, blob_id)]
+        self.entries = dict()
+        with open(os.path.join(root, MANIFEST_FILE), newline='') as f:
+            for row in csv.DictReader(f):
+                sides = self.entries.setdefault(row['comment_id'], dict())
+                sides.setdefault(row['side'], []).append((row['file_name'], row['blob_id']))
+
+    def __contains__(self, comment_id):
+        return comment_id in self.entries
+
+    def files(self, comment_id, side):
+        """(file_name, blob_id) pairs of a snapshot side, None if the side has no files."""
+        return self.entries.get(comment_id, dict()).get(side)
+
+    def blob_ids(self, comment_id, side):
+        files = self.files(comment_id, side)
+        return [blob_id for _, blob_id in files] if files else []
+
+    def blob_path(self, blob_id, file_name):
+        return os.path.join(self.root, blob_relative_path(blob_id, file_name))
+
+    def paths(self, comment_id, side):
+        """Blob paths of a snapshot side in place of listdir() on 'Data New/<comment_id>/<side>'."""
+        files = self.files(comment_id, side)
+        if files is None:
+            return None
+        return [self.blob_path(blob_id, file_name) for file_name, blob_id in files]
+
+    def unique_blobs(self):
+        blobs = dict()
+        for sides in self.entries.values():
+            for files in sides.values():
+                for file_name, blob_id in files:
+                    blobs.setdefault(blob_id, self.blob_path(blob_id, file_name))
+        return blobs
+
+
+def build(data_folder, root, move=False):
+    """Copy every snapshot of data_folder into the store and write the manifest.
+
+    With move the original files are removed once they are in the store.
+    """
+    rows = []
+    stored = set()
+    for comment_id in sorted(os.listdir(data_folder)):
+        for side in SIDES:
+            side_folder = os.path.join(data_folder, comment_id, side)
+            if not os.path.isdir(side_folder):
+                continue
+            for file_name in sorted(os.listdir(side_folder)):
+                source = os.path.join(side_folder, file_name)
+                blob_id = hash_file(source)
+                target = os.path.join(root, blob_relative_path(blob_id, file_name))
+                if target not in stored and not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    shutil.copyfile(source, target)
+                stored.add(target)
+                if move:
+                    os.remove(source)
+                rows.append([comment_id, side, file_name, blob_id])
+
+    os.makedirs(root, exist_ok=True)
+    manifest_tmp = os.path.join(root, MANIFEST_FILE + '.tmp')
+    with open(manifest_tmp, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(MANIFEST_HEADER)
+        writer.writerows(rows)
+    os.replace(manifest_tmp, os.path.join(root, MANIFEST_FILE))
+    return len(rows), len(stored)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='build the store from the Data New layout')
+    build_parser.add_argument('data_folder')
+    build_parser.add_argument('root')
+    build_parser.add_argument('--move', action='store_true', help='remove the original files after storing them')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        num_files, num_blobs = build(args.data_folder, args.root, move=args.move)
+        print("stored", num_files, "files as", num_blobs, "blobs")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
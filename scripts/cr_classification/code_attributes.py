@@ -0,0 +1,1075 @@
+"""Code attributes of MetricRunner computed in process, without Java.
+
+MetricRunner parses the Old and New snapshot of every comment with the
+external pythonparser, diffs them with GumTree and counts the changed nodes
+around the commented line. This module does the same with parso:
+
+    tree     parso's tree without the leaves pythonparser drops (keywords,
+             newlines, brackets, dots, colons), labels on the leaves and
+             character positions, a syntax error where parso has to recover
+    diff     GumTree's classic matcher: greedy top-down matching of identical
+             subtrees of MIN_HEIGHT and more, greedy bottom-up matching of
+             containers with a dice of MIN_DICE and the Zhang-Shasha last
+             chance match, then the updated/moved/inserted nodes of the
+             Chawathe edit script
+    metrics  the calculators of MetricRunner (UniversalMetrics, the if/else
+             metrics, LineMetric, StringUpdate, StringAssignment,
+             AllMetricsCalculator) and locMetrics, with the same window of
+             LINE_RANGE lines around the comment, the same function scope
+             and range checks and the same -1 rows on errors
+
+GumTree breaks ties between equally good mappings in its hash map order, so a
+few rows still differ from code_attributes.csv in a column. parity reports the
+share of equal rows column by column and fails when one is below TOLERANCE:
+
+    python -m cr_classification.code_attributes extract blobs comments.csv code_attributes_py.csv
+    python -m cr_classification.code_attributes parity blobs labeled_dataset.xlsx code_attributes.csv
+"""
+import argparse
+import bisect
+import collections
+import csv
+import json
+import os
+import re
+import struct
+import sys
+
+from cr_classification.blob_store import NEW, OLD, BlobStore
+
+# MetricRunner.LINE_RANGE and USE_FUNCTION_SCOPE
+LINE_RANGE = 10
+USE_FUNCTION_SCOPE = True
+
+METRIC_COLUMNS = [
+    'anyInserted', 'anyDeleted', 'getMovedSrcs', 'UpdatedSrcs',
+    'insertedIfConditions', 'deletedIfStmts', 'elseInserted', 'elseDeleted',
+    'AnythingInLineMoved', 'AnythingInLineUpdated', 'AnythingInLineDeleted', 'AnythingMovedIntoLine',
+    'AnythingInsertedIntoLine', 'EntireLineMoved', 'EntireLineDeleted',
+    'stringsUpdated', 'magicStringsReplaced',
+    'MovedBlocksInIfConditions', 'AddedOrUpdatedComments', 'InsertedAssertConditions', 'InsertedTryCatch',
+    'UpdatedValueAssignments', 'RemovedTryCatch', 'UpdatedFuncArguments',
+]
+FILE_COLUMNS = ['hasOldFile', 'hasNewFile', 'numOldFiles', 'numNewFiles', 'isDupe']
+COLUMNS = ['folderName'] + METRIC_COLUMNS + FILE_COLUMNS + ['error']
+# locMetrics is not registered in MetricRunner, its columns are only written on request
+LOC_COLUMNS = ['srclocs', 'locDelta']
+
+# GumTree's defaults
+MIN_HEIGHT = 2
+MIN_DICE = 0.5
+# ClassicGumtree's bu_minsize, the Zhang-Shasha last chance match needs a subtree smaller than this
+MAX_SIZE = 1000
+# least share of rows parity needs equal to MetricRunner's in every column
+TOLERANCE = 0.9
+
+COMMENT_FIELDS = ('comment_id', 'folderName')
+LINE_FIELDS = ('line_number', 'line')
+
+SUITE = 'suite'
+IF_STMT = 'if_stmt'
+STRING = 'string'
+
+# pythonparser leaves these parso leaves out of the tree
+SKIP_TYPES = {'keyword', 'newline', 'endmarker'}
+SKIP_OPERATORS = {'.', '(', ')', '[', ']', ':', ';'}
+# parso recovers from a syntax error with these, pythonparser fails on them
+ERROR_TYPES = {'error_node', 'error_leaf'}
+
+
+class Node:
+    __slots__ = ('type', 'label', 'pos', 'end_pos', 'children', 'parent', 'hash', 'height', 'size', 'pre', 'post')
+
+    def __init__(self, type, label, pos, end_pos, children=()):
+        self.type = type
+        self.label = label
+        self.pos = pos
+        self.end_pos = end_pos
+        self.children = [child for child in children if child is not None]
+        self.parent = None
+        for child in self.children:
+            child.parent = self
+
+    def pre_order(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def post_order(self):
+        stack = [(self, False)]
+        while stack:
+            node, visited = stack.pop()
+            if visited or not node.children:
+                yield node
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node.children))
+
+    def descendants(self):
+        nodes = self.pre_order()
+        next(nodes)
+        return nodes
+
+    def is_descendant_of(self, node):
+        """node is a proper ancestor, needs prepare()."""
+        return node.pre < self.pre < node.pre + node.size
+
+    def __repr__(self):
+        return '%s%s [%d,%d]' % (self.type, '' if self.label is None else ': ' + self.label, self.pos, self.end_pos)
+
+
+def char_count_up_to_each_line(text):
+    """Same layout as LineIndex: 0, then the count of chars up to the end of each line, a newline counted as one char."""
+    counts = [0]
+    for line in re.split(r'\r\n|\r|\n', text):
+        counts.append(counts[-1] + len(line) + 1)
+    if text.endswith(('\n', '\r')):
+        # readLine() gives no last empty line
+        counts.pop()
+    return counts
+
+
+def build_tree(text):
+    """pythonparser's tree of a source text, positions are char offsets into the text.
+
+    pythonparser is parso's tree without the SKIP_TYPES leaves and the SKIP_OPERATORS, with a label on the leaves
+    only. Raises SyntaxError where parso had to recover from an error.
+    """
+    import parso
+    starts = [0]
+    for line in parso.split_lines(text, keepends=True):
+        starts.append(starts[-1] + len(line))
+    converted = dict()
+    stack = [(parso.parse(text), False)]
+    root = None
+    while stack:
+        node, visited = stack.pop()
+        children = getattr(node, 'children', None)
+        if children and not visited:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        if node.type in ERROR_TYPES:
+            line, column = node.start_pos
+            raise SyntaxError("parso could not parse line %d column %d" % (line, column))
+        if node.type in SKIP_TYPES or (node.type == 'operator' and node.value in SKIP_OPERATORS):
+            continue
+        pos = starts[node.start_pos[0] - 1] + node.start_pos[1]
+        end_pos = starts[node.end_pos[0] - 1] + node.end_pos[1]
+        if children is None:
+            root = Node(node.type, node.value, pos, end_pos)
+        else:
+            root = Node(node.type, None, pos, end_pos, [converted.pop(id(child), None) for child in children])
+        converted[id(node)] = root
+    return root
+
+
+def parse_file(path):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    return build_tree(text), char_count_up_to_each_line(text)
+
+
+def prepare(root):
+    """Post-order nodes of root with their subtree hash, height, size and pre/post-order index set."""
+    nodes = list(root.post_order())
+    for i, node in enumerate(nodes):
+        node.hash = hash((node.type, node.label, tuple(child.hash for child in node.children)))
+        node.height = 1 + max((child.height for child in node.children), default=0)
+        node.size = 1 + sum(child.size for child in node.children)
+        node.post = i
+    for i, node in enumerate(root.pre_order()):
+        node.pre = i
+    return nodes
+
+
+class Diff:
+    """GumTree's classic matcher on the src and dst trees and the classification of their nodes.
+
+    GreedySubtreeMatcher then GreedyBottomUpMatcher with its Zhang-Shasha last chance match, and the
+    Chawathe script of the mappings, as Diff.compute and createAllNodeClassifier give them.
+    """
+
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+        self.src_nodes = prepare(src)
+        self.dst_nodes = prepare(dst)
+        self.src_to_dst = dict()
+        self.dst_to_src = dict()
+        # tree distances of the Zhang-Shasha runs, the nested containers of a file share most of them
+        self.tree_distances = dict()
+        self.match_top_down()
+        self.match_bottom_up()
+        self.classify()
+
+    def add(self, s, d):
+        self.src_to_dst[s] = d
+        self.dst_to_src[d] = s
+
+    def add_isomorphic(self, s, d):
+        for s_node, d_node in zip(s.pre_order(), d.pre_order()):
+            self.add(s_node, d_node)
+
+    def common_descendants(self, s, d):
+        return sum(1 for node in s.descendants()
+                   if node in self.src_to_dst and self.src_to_dst[node].is_descendant_of(d))
+
+    def dice(self, s, d):
+        total = (s.size - 1) + (d.size - 1)
+        return 2.0 * self.common_descendants(s, d) / total if total else 0.0
+
+    # matching
+
+    def match_top_down(self):
+        """GreedySubtreeMatcher: identical subtrees of at least MIN_HEIGHT, the highest first."""
+        src_queue = dict()
+        dst_queue = dict()
+
+        def push(queue, node):
+            if node.height >= MIN_HEIGHT:
+                queue.setdefault(node.height, []).append(node)
+
+        def pop(queue):
+            return queue.pop(max(queue))
+
+        def open_nodes(queue, nodes):
+            for node in nodes:
+                for child in node.children:
+                    push(queue, child)
+
+        push(src_queue, self.src)
+        push(dst_queue, self.dst)
+        src_candidates = dict()
+        dst_candidates = dict()
+        while src_queue and dst_queue:
+            if max(src_queue) != max(dst_queue):
+                queue = src_queue if max(src_queue) > max(dst_queue) else dst_queue
+                open_nodes(queue, pop(queue))
+                continue
+            src_nodes = pop(src_queue)
+            dst_nodes = pop(dst_queue)
+            dst_by_hash = dict()
+            for d in dst_nodes:
+                dst_by_hash.setdefault(d.hash, []).append(d)
+            for s in src_nodes:
+                for d in dst_by_hash.get(s.hash, ()):
+                    src_candidates.setdefault(s, []).append(d)
+                    dst_candidates.setdefault(d, []).append(s)
+            open_nodes(src_queue, [s for s in src_nodes if s not in src_candidates])
+            open_nodes(dst_queue, [d for d in dst_nodes if d not in dst_candidates])
+
+        ambiguous = []
+        seen = set()
+        for s, dsts in src_candidates.items():
+            if len(dsts) == 1 and len(dst_candidates[dsts[0]]) == 1:
+                self.add_isomorphic(s, dsts[0])
+            elif s not in seen:
+                srcs = dst_candidates[dsts[0]]
+                ambiguous.extend((a, b) for a in srcs for b in dsts)
+                seen.update(srcs)
+        # identical subtrees with several candidates, the best placed pair first
+        ambiguous.sort(key=self.mapping_rank)
+        src_ignored = set()
+        dst_ignored = set()
+        for s, d in ambiguous:
+            if s not in src_ignored and d not in dst_ignored:
+                self.add_isomorphic(s, d)
+                src_ignored.update(s.pre_order())
+                dst_ignored.update(d.pre_order())
+
+    def mapping_rank(self, pair):
+        """MappingComparators.FullMappingComparator as a sort key."""
+        s, d = pair
+        siblings = self.dice(s.parent, d.parent) if s.parent is not None and d.parent is not None else 0.0
+        src_parents = [node.type for node in ancestors(s)]
+        dst_parents = [node.type for node in ancestors(d)]
+        total = len(src_parents) + len(dst_parents)
+        parents = 2.0 * len(lcs(src_parents, dst_parents)) / total if total else 0.0
+        position = sum((a - b) ** 2 for a, b in zip(position_in_parents(s), position_in_parents(d))) ** 0.5
+        text = abs(s.pos - d.pos) + abs(s.end_pos - d.end_pos)
+        return -siblings, -parents, position, text, abs(s.post - d.post)
+
+    def match_bottom_up(self):
+        """GreedyBottomUpMatcher: containers by the dice of their matched descendants, then a last chance match."""
+        for s in self.src_nodes:
+            if s is self.src:
+                self.add(s, self.dst)
+                self.last_chance_match(s, self.dst)
+                break
+            if s in self.src_to_dst or not s.children:
+                continue
+            best = None
+            best_dice = -1.0
+            for d in self.container_candidates(s):
+                dice = self.dice(s, d)
+                if dice > best_dice and dice >= MIN_DICE:
+                    best, best_dice = d, dice
+            if best is not None:
+                self.last_chance_match(s, best)
+                self.add(s, best)
+
+    def container_candidates(self, s):
+        """Unmatched dst nodes of the type of s above the matches of its descendants, not the root."""
+        candidates = []
+        seen = set()
+        for node in s.descendants():
+            d = self.src_to_dst.get(node)
+            while d is not None and d.parent is not None:
+                d = d.parent
+                if d in seen:
+                    break
+                seen.add(d)
+                if d.type == s.type and d not in self.dst_to_src and d.parent is not None:
+                    candidates.append(d)
+        return candidates
+
+    def last_chance_match(self, s, d):
+        """Zhang-Shasha mappings of the pair's subtrees between unmatched nodes of the same type."""
+        if s.size < MAX_SIZE or d.size < MAX_SIZE:
+            for s_node, d_node in zhang_shasha(s, d, self.tree_distances):
+                if s_node.type == d_node.type and s_node not in self.src_to_dst and d_node not in self.dst_to_src:
+                    self.add(s_node, d_node)
+
+    # classification
+
+    def classify(self):
+        """deleted/updated/moved src nodes and inserted/updated dst nodes, like TreeClassifier's all node classifier."""
+        script = EditScript(self)
+        self.deleted_srcs = [s for s in self.src.pre_order() if s not in self.src_to_dst]
+        self.inserted_dsts = [d for d in self.dst.pre_order() if d not in self.dst_to_src]
+        self.updated_srcs = [s for s in self.src.pre_order() if s in script.updated]
+        self.updated_dsts = [self.src_to_dst[s] for s in self.updated_srcs]
+        moved = set()
+        for s in script.moved:
+            moved.update(s.pre_order())
+        self.moved_srcs = [s for s in self.src.pre_order() if s in moved]
+        self.deleted_set = set(self.deleted_srcs)
+        self.updated_set = set(self.updated_srcs)
+        self.moved_set = set(self.moved_srcs)
+        self.inserted_set = set(self.inserted_dsts)
+        self.inserts = script.inserts
+
+    def insert_actions(self):
+        """(dst node, given parent, position) of the Insert and TreeInsert actions of the Chawathe script.
+
+        The given parent is the src node the dst parent is matched to, or the dst parent itself when that
+        was inserted too, as ActionGenerator reports it.
+        """
+        fully_inserted = set()
+        for d in self.dst_nodes:
+            if d in self.inserted_set and all(c in fully_inserted for c in d.children):
+                fully_inserted.add(d)
+        return [(d, parent, position) for d, parent, position in self.inserts if d.parent not in fully_inserted]
+
+
+class ScriptNode:
+    """A node of the src copy that ChawatheScriptGenerator edits into dst."""
+    __slots__ = ('original', 'label', 'children', 'parent')
+
+    def __init__(self, original, label):
+        self.original = original
+        self.label = label
+        self.children = []
+        self.parent = None
+
+
+class EditScript:
+    """ChawatheScriptGenerator: the updated and moved src nodes and the insertions that turn src into dst."""
+
+    def __init__(self, diff):
+        copies = dict()
+        for s in diff.src_nodes:
+            copy = copies[s] = ScriptNode(s, s.label)
+            copy.children = [copies[child] for child in s.children]
+            for child in copy.children:
+                child.parent = copy
+        self.src_to_dst = {copies[s]: d for s, d in diff.src_to_dst.items()}
+        self.dst_to_src = {d: copies[s] for s, d in diff.src_to_dst.items()}
+        src_root = ScriptNode(None, None)
+        src_root.children = [copies[diff.src]]
+        copies[diff.src].parent = src_root
+        self.src_in_order = set()
+        self.dst_in_order = set()
+        self.updated = set()
+        self.moved = []
+        # (dst node, src node or inserted dst parent, position)
+        self.inserts = []
+
+        queue = collections.deque([diff.dst])
+        while queue:
+            x = queue.popleft()
+            queue.extend(x.children)
+            z = src_root if x is diff.dst else self.dst_to_src[x.parent]
+            if x not in self.dst_to_src:
+                k = self.find_position(x)
+                w = ScriptNode(x, x.label)
+                self.inserts.append((x, z.original, k))
+                self.src_to_dst[w] = x
+                self.dst_to_src[x] = w
+                w.parent = z
+                z.children.insert(k, w)
+            else:
+                w = self.dst_to_src[x]
+                if x is not diff.dst:
+                    v = w.parent
+                    if w.label != x.label:
+                        self.updated.add(w.original)
+                        w.label = x.label
+                    if z is not v:
+                        k = self.find_position(x)
+                        self.moved.append(w.original)
+                        v.children.remove(w)
+                        w.parent = z
+                        z.children.insert(k, w)
+            self.src_in_order.add(w)
+            self.dst_in_order.add(x)
+            self.align_children(w, x)
+
+    def align_children(self, w, x):
+        self.src_in_order.difference_update(w.children)
+        self.dst_in_order.difference_update(x.children)
+        x_children = set(x.children)
+        w_children = set(w.children)
+        s1 = [c for c in w.children if self.src_to_dst.get(c) in x_children]
+        s2 = [c for c in x.children if self.dst_to_src.get(c) in w_children]
+        in_order = set()
+        for i, j in lcs([self.src_to_dst[a] for a in s1], s2):
+            self.src_in_order.add(s1[i])
+            self.dst_in_order.add(s2[j])
+            in_order.add(s1[i])
+        for b in s2:
+            for a in s1:
+                if self.src_to_dst[a] is b and a not in in_order:
+                    a.parent.children.remove(a)
+                    k = self.find_position(b)
+                    self.moved.append(a.original)
+                    w.children.insert(k, a)
+                    a.parent = w
+                    self.src_in_order.add(a)
+                    self.dst_in_order.add(b)
+
+    def find_position(self, x):
+        siblings = x.parent.children
+        for c in siblings:
+            if c in self.dst_in_order:
+                if c is x:
+                    return 0
+                break
+        v = None
+        for c in siblings[:siblings.index(x)]:
+            if c in self.dst_in_order:
+                v = c
+        if v is None:
+            return 0
+        u = self.dst_to_src[v]
+        return u.parent.children.index(u) + 1
+
+
+def ancestors(node):
+    node = node.parent
+    while node is not None:
+        yield node
+        node = node.parent
+
+
+def position_in_parents(node):
+    """Relative position of node and of each of its ancestors among its siblings, from node up."""
+    positions = []
+    while node.parent is not None:
+        positions.append(node.parent.children.index(node) / len(node.parent.children))
+        node = node.parent
+    return positions
+
+
+def lcs(a, b):
+    """Index pairs of a longest common subsequence of a and b."""
+    if not a or not b:
+        return []
+    lengths = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a) - 1, -1, -1):
+        for j in range(len(b) - 1, -1, -1):
+            lengths[i][j] = lengths[i + 1][j + 1] + 1 if a[i] == b[j] else max(lengths[i + 1][j], lengths[i][j + 1])
+    pairs = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] == b[j]:
+            pairs.append((i, j))
+            i += 1
+            j += 1
+        elif lengths[i + 1][j] >= lengths[i][j + 1]:
+            i += 1
+        else:
+            j += 1
+    return pairs
+
+
+def qgrams(label):
+    padded = '##' + label + '##'
+    return collections.Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def update_cost(s, d, profiles, costs):
+    """ZsMatcher's update cost, 1 - the q-gram similarity of the labels (compared in float, like simmetrics)."""
+    if s.type != d.type:
+        return sys.float_info.max
+    if not s.label or not d.label:
+        return 1.0
+    key = (s.label, d.label)
+    cost = costs.get(key)
+    if cost is None:
+        for label in key:
+            if label not in profiles:
+                profiles[label] = qgrams(label)
+        a, b = profiles[s.label], profiles[d.label]
+        total = sum(a.values()) + sum(b.values())
+        distance = sum(abs(a[gram] - b[gram]) for gram in a.keys() | b.keys())
+        similarity = struct.unpack('f', struct.pack('f', (total - distance) / total))[0]
+        cost = costs[key] = 1.0 - similarity
+    return cost
+
+
+class ZsTree:
+    """Post-order numbering (from 1) of a tree with the leftmost leaf of every node and the keyroots."""
+
+    def __init__(self, root):
+        self.nodes = [None] + list(root.post_order())
+        self.count = len(self.nodes) - 1
+        self.lld = [0] * (self.count + 1)
+        for i in range(1, self.count + 1):
+            node = self.nodes[i]
+            # the leftmost leaf is the first node of the subtree in post-order
+            self.lld[i] = i - node.size + 1
+        seen = set()
+        self.keyroots = []
+        for i in range(self.count, 0, -1):
+            if self.lld[i] not in seen:
+                self.keyroots.append(i)
+                seen.add(self.lld[i])
+        self.keyroots.reverse()
+
+    def path(self, i):
+        """i and the nodes below it down to its leftmost leaf, in post-order"""
+        return [k for k in range(self.lld[i], i + 1) if self.lld[k] == self.lld[i]]
+
+
+def zhang_shasha(src, dst, tree_distances):
+    """ZsMatcher: the mappings of the Zhang-Shasha edit script of src into dst, in GumTree's backtracking order.
+
+    tree_distances keeps the distances of every keyroot pair by their nodes, they only depend on the two subtrees.
+    """
+    zs_src = ZsTree(src)
+    zs_dst = ZsTree(dst)
+    src_lld = zs_src.lld
+    dst_lld = zs_dst.lld
+    n = zs_src.count
+    m = zs_dst.count
+    tree = [[0.0] * (m + 1) for _ in range(n + 1)]
+    forest = [[0.0] * (m + 1) for _ in range(n + 1)]
+    profiles = dict()
+    costs = dict()
+
+    def forest_dist(i, j):
+        li = src_lld[i]
+        lj = dst_lld[j]
+        top = forest[li - 1]
+        top[lj - 1] = 0.0
+        value = 0.0
+        for dj in range(lj, j + 1):
+            value += 1.0
+            top[dj] = value
+        columns = range(lj, j + 1)
+        value = 0.0
+        for di in range(li, i + 1):
+            value += 1.0
+            row = forest[di]
+            previous = forest[di - 1]
+            row[lj - 1] = value
+            left = value
+            ldi = src_lld[di]
+            tree_row = tree[di]
+            base = forest[ldi - 1]
+            s = zs_src.nodes[di]
+            for dj in columns:
+                best = previous[dj] + 1.0
+                cost = left + 1.0
+                if cost < best:
+                    best = cost
+                ldj = dst_lld[dj]
+                if ldi == li and ldj == lj:
+                    cost = previous[dj - 1] + update_cost(s, zs_dst.nodes[dj], profiles, costs)
+                    if cost < best:
+                        best = cost
+                    tree_row[dj] = best
+                else:
+                    cost = base[ldj - 1] + tree_row[dj]
+                    if cost < best:
+                        best = cost
+                row[dj] = best
+                left = best
+
+    src_paths = {i: zs_src.path(i) for i in zs_src.keyroots}
+    dst_paths = {j: zs_dst.path(j) for j in zs_dst.keyroots}
+    for i in zs_src.keyroots:
+        for j in zs_dst.keyroots:
+            key = (zs_src.nodes[i], zs_dst.nodes[j])
+            distances = tree_distances.get(key)
+            # the roots' forest distances are walked back below
+            if distances is None or (i == n and j == m):
+                forest_dist(i, j)
+                tree_distances[key] = [[tree[di][dj] for dj in dst_paths[j]] for di in src_paths[i]]
+            else:
+                for di, values in zip(src_paths[i], distances):
+                    tree_row = tree[di]
+                    for dj, value in zip(dst_paths[j], values):
+                        tree_row[dj] = value
+
+    mappings = []
+    pairs = [(n, m)]
+    root_pair = True
+    while pairs:
+        last_row, last_col = pairs.pop()
+        if not root_pair:
+            forest_dist(last_row, last_col)
+        root_pair = False
+        first_row = src_lld[last_row] - 1
+        first_col = dst_lld[last_col] - 1
+        row, col = last_row, last_col
+        while row > first_row or col > first_col:
+            if row > first_row and forest[row - 1][col] + 1.0 == forest[row][col]:
+                row -= 1
+            elif col > first_col and forest[row][col - 1] + 1.0 == forest[row][col]:
+                col -= 1
+            elif src_lld[row] - 1 == first_row and dst_lld[col] - 1 == first_col:
+                mappings.append((zs_src.nodes[row], zs_dst.nodes[col]))
+                row -= 1
+                col -= 1
+            else:
+                pairs.append((row, col))
+                row = src_lld[row] - 1
+                col = dst_lld[col] - 1
+    return mappings
+
+
+def fetch_trees_spanning_range(results, root, start, end):
+    """PythonFileData.fetchTreesSpanningRange: the outermost trees of root within [start, end]."""
+    if root.pos >= start and root.end_pos <= end:
+        results.append(root)
+        return
+    contains_range = root.pos <= start and root.end_pos >= end
+    contains_start = root.pos <= start < root.end_pos
+    contains_end = root.pos <= end < root.end_pos
+    if contains_range or contains_start or contains_end:
+        for child in root.children:
+            fetch_trees_spanning_range(results, child, start, end)
+    if contains_start:
+        if not results or results[0].pos > start:
+            results.insert(0, root)
+        elif results[0].pos < root.pos:
+            results[0] = root
+    if contains_end:
+        if not results or results[-1].end_pos < end:
+            results.append(root)
+        elif results[-1].end_pos > root.end_pos:
+            results[-1] = root
+
+
+def line_end_char_pos(line_no, counts):
+    if not counts:
+        return 0
+    if line_no >= len(counts):
+        return counts[-1]
+    return counts[line_no]
+
+
+def line_start_char_pos(line_no, counts):
+    if not counts or line_no <= 0:
+        return 0
+    if line_no >= len(counts):
+        return counts[-1]
+    return max(counts[line_no - 1], 0)
+
+
+def parent_function(node):
+    while node is not None:
+        if node.type == 'funcdef':
+            return node
+        node = node.parent
+    return None
+
+
+class FileData:
+    """PythonFileData: the window around the commented line and the range checks of the calculators."""
+
+    def __init__(self, diff, line_no, src_counts, dst_counts):
+        self.diff = diff
+        self.src_counts = src_counts
+        self.dst_counts = dst_counts
+        total_lines = len(src_counts) - 1 if src_counts else 0
+        self.line_char_start = line_start_char_pos(line_no, src_counts)
+        self.line_char_end = line_end_char_pos(line_no, src_counts)
+        start_line = 0 if line_no <= LINE_RANGE else line_no - LINE_RANGE
+        end_line = min(start_line + LINE_RANGE * 2, total_lines)
+        range_start = line_start_char_pos(start_line, src_counts)
+        range_end = line_end_char_pos(end_line, src_counts)
+
+        self.range_trees = []
+        fetch_trees_spanning_range(self.range_trees, diff.src, range_start, range_end)
+        self.line_trees = []
+        fetch_trees_spanning_range(self.line_trees, diff.src, self.line_char_start, self.line_char_end)
+        # without trees on the line MetricRunner ends up with no container function
+        self.container_function = parent_function(self.line_trees[0]) if self.line_trees else None
+
+        self.range_start = self.range_trees[0].pos if self.range_trees else range_start
+        self.range_end = self.range_trees[-1].end_pos if self.range_trees else range_end
+        self.insertions = self.map_insertions()
+
+    def in_function_scope(self, node):
+        if not USE_FUNCTION_SCOPE:
+            return True
+        function = self.container_function
+        return function is None or (function.pos <= node.pos and function.end_pos <= node.end_pos)
+
+    def src_in_range(self, node):
+        return node.pos >= self.range_start and node.end_pos <= self.range_end
+
+    def src_outside_range(self, node):
+        return node.end_pos <= self.range_start or node.pos >= self.range_end
+
+    def dst_parent_in_range(self, node):
+        """First dst ancestor (or node itself) matched to a src node, if that src node is in the range."""
+        while node is not None:
+            s = self.diff.dst_to_src.get(node)
+            if s is not None:
+                return node if self.src_in_range(s) else None
+            node = node.parent
+        return None
+
+    def dst_in_range(self, node):
+        return self.dst_parent_in_range(node) is not None
+
+    def map_insertions(self):
+        """dst node -> (src parent, insertion position in src) of the insertions within the range."""
+        diff = self.diff
+        insertions = dict()
+        for d, parent, index in diff.insert_actions():
+            src_parent = None
+            if parent in diff.src_to_dst:
+                src_parent = parent
+            else:
+                mapped = self.dst_parent_in_range(parent)
+                if mapped is not None:
+                    src_parent = diff.dst_to_src[mapped]
+                    index = next((i for i, child in enumerate(mapped.children)
+                                  if child.pos <= d.pos and d.end_pos <= child.end_pos), -1)
+            if src_parent is None or index < 0:
+                continue
+            pos = child_insertion_pos(src_parent, index)
+            if self.range_start <= pos <= self.range_end:
+                insertions[d] = (src_parent, pos)
+        containers = list(insertions.items())
+        for d in diff.inserted_dsts:
+            for container, insertion in containers:
+                if d.pos >= container.pos and d.end_pos <= container.end_pos:
+                    insertions[d] = insertion
+        return insertions
+
+    def inserted_in_range(self, node):
+        return node in self.insertions
+
+
+def child_insertion_pos(parent, index):
+    if not parent.children:
+        return parent.pos
+    if index >= len(parent.children):
+        return parent.children[-1].end_pos
+    return parent.children[index].pos
+
+
+def count_range(nodes, data, is_src):
+    count = 0
+    for node in nodes:
+        if is_src and not data.src_in_range(node) and data.in_function_scope(node):
+            continue
+        if not is_src and not data.dst_in_range(node):
+            continue
+        count += 1
+    return count
+
+
+def line_metrics(diff, data):
+    metrics = dict.fromkeys(['AnythingInLineMoved', 'AnythingInLineUpdated', 'AnythingInLineDeleted',
+                             'AnythingMovedIntoLine', 'AnythingInsertedIntoLine'], 0)
+    entire_line_deleted = True
+    for tree in data.line_trees:
+        in_line = tree.pos >= data.line_char_start and tree.end_pos <= data.line_char_end
+        if tree in diff.deleted_set:
+            metrics['AnythingInLineDeleted'] += in_line
+        elif in_line:
+            entire_line_deleted = False
+        if tree in diff.updated_set:
+            metrics['AnythingInLineUpdated'] += in_line
+        if tree in diff.moved_set:
+            metrics['AnythingInLineMoved'] += in_line
+    for d in diff.inserted_dsts:
+        insertion = data.insertions.get(d)
+        # the comparisons of LineMetric, both against the line's bounds
+        if insertion is not None and insertion[1] <= data.line_char_start and insertion[1] <= data.line_char_end:
+            metrics['AnythingInsertedIntoLine'] += 1
+    line_parent_moved = False
+    for tree in diff.moved_srcs:
+        if tree.pos <= data.line_char_start and tree.end_pos >= data.line_char_end:
+            line_parent_moved = True
+        if data.line_char_start <= tree.pos and tree.end_pos <= data.line_char_end:
+            metrics['AnythingMovedIntoLine'] += 1
+    metrics['EntireLineMoved'] = int(line_parent_moved)
+    metrics['EntireLineDeleted'] = int(entire_line_deleted and metrics['AnythingInLineDeleted'] > 0)
+    return metrics
+
+
+def is_string_assignment(node):
+    children = node.children
+    return (node.type == 'expr_stmt' and len(children) == 3 and children[1].type == 'operator'
+            and children[1].label == '=' and children[2].type == STRING)
+
+
+def count_else(nodes, data):
+    count = 0
+    for node in nodes:
+        if node.type == SUITE and node.parent is not None and node.parent.type == IF_STMT:
+            if not data.src_in_range(node) and not data.in_function_scope(node):
+                continue
+            count += 1
+    return count
+
+
+def loc_of_tree(node, counts, data):
+    if not data.in_function_scope(node):
+        return 0
+    return bisect.bisect_left(counts, node.end_pos) - bisect.bisect_left(counts, node.pos)
+
+
+def compute_metrics(diff, data, loc=False):
+    """The metric columns of a diff around the commented line, in MetricRunner's order."""
+    metrics = {
+        'anyInserted': count_range(diff.inserted_dsts, data, False),
+        'anyDeleted': count_range(diff.deleted_srcs, data, True),
+        'getMovedSrcs': count_range(diff.moved_srcs, data, True),
+        'UpdatedSrcs': count_range(diff.updated_srcs, data, True),
+    }
+    metrics['insertedIfConditions'] = sum(
+        1 for d in diff.inserted_dsts
+        if d.type == IF_STMT and data.inserted_in_range(d) and data.in_function_scope(data.insertions[d][0]))
+    metrics['deletedIfStmts'] = sum(
+        1 for s in diff.deleted_srcs if s.type == IF_STMT and data.src_in_range(s) and data.in_function_scope(s))
+    # InsertedElseMetrics.calc is empty
+    metrics['elseInserted'] = 0
+    metrics['elseDeleted'] = count_else(diff.deleted_srcs, data)
+    metrics.update(line_metrics(diff, data))
+    metrics['stringsUpdated'] = sum(1 for s in diff.updated_srcs if s.type == STRING and data.in_function_scope(s))
+
+    strings_in_src = {s.label for s in diff.src_nodes if s.type == STRING}
+    metrics['magicStringsReplaced'] = sum(
+        1 for d in diff.inserted_dsts
+        if data.in_function_scope(d) and is_string_assignment(d) and d.children[2].label in strings_in_src)
+
+    # AllMetricsCalculator looks the children of the dst if_stmt up in the moved src nodes, which never holds
+    metrics['MovedBlocksInIfConditions'] = 0
+    metrics['AddedOrUpdatedComments'] = (
+        sum(1 for s in diff.updated_srcs if s.type == STRING and data.src_in_range(s) and data.in_function_scope(s))
+        + sum(1 for d in diff.inserted_dsts if d.type == STRING and data.dst_in_range(d)))
+    metrics['InsertedAssertConditions'] = sum(
+        1 for d in diff.inserted_dsts if d.type == 'assert_stmt' and data.dst_in_range(d))
+    metrics['InsertedTryCatch'] = sum(
+        1 for d in diff.inserted_dsts if d.type in ('try_stmt', 'except_clause') and data.dst_in_range(d))
+    metrics['UpdatedValueAssignments'] = sum(
+        1 for d in diff.updated_dsts if d.type in (STRING, 'number') and data.dst_in_range(d))
+    metrics['RemovedTryCatch'] = sum(
+        1 for s in diff.deleted_srcs
+        if (s.type == 'try_stmt' and data.src_in_range(s) and data.in_function_scope(s)) or s.type == 'except_clause')
+    metrics['UpdatedFuncArguments'] = (
+        sum(1 for s in diff.deleted_srcs if s.type == 'param' and data.src_in_range(s) and data.in_function_scope(s))
+        + sum(1 for d in diff.inserted_dsts if d.type == 'param' and data.dst_in_range(d)))
+
+    if loc:
+        metrics.update(loc_metrics(diff, data))
+    return metrics
+
+
+def loc_metrics(diff, data):
+    """locMetrics: lines spanned by the in scope trees of the line, and lines inserted minus lines deleted."""
+    start = end = -1
+    for tree in data.line_trees:
+        if data.in_function_scope(tree):
+            start = tree.pos if start < 0 else min(tree.pos, start)
+            # locMetrics takes the max of the start positions
+            end = tree.end_pos if end < 0 else max(tree.pos, end)
+    srclocs = bisect.bisect_left(data.src_counts, end) - bisect.bisect_left(data.src_counts, start)
+    loc_delta = (sum(loc_of_tree(d, data.dst_counts, data) for d in diff.inserted_dsts)
+                 - sum(loc_of_tree(s, data.src_counts, data) for s in diff.deleted_srcs))
+    return {'srclocs': srclocs, 'locDelta': loc_delta}
+
+
+def extract(old_path, new_path, line_no, loc=False):
+    """Metric columns of a comment on line_no of old_path, changed into new_path."""
+    src, src_counts = parse_file(old_path)
+    dst, dst_counts = parse_file(new_path)
+    diff = Diff(src, dst)
+    return compute_metrics(diff, FileData(diff, line_no, src_counts, dst_counts), loc)
+
+
+def extract_comment(store, comment_id, line_no, loc=False):
+    """A code attribute row of a comment in the blob store, with MetricRunner's file checks and error rows."""
+    old_paths = store.paths(comment_id, OLD) or []
+    new_paths = store.paths(comment_id, NEW) or []
+    old_ids = store.blob_ids(comment_id, OLD)
+    new_ids = store.blob_ids(comment_id, NEW)
+    row = {
+        'folderName': comment_id,
+        'hasOldFile': int(bool(old_paths)),
+        'hasNewFile': int(bool(new_paths)),
+        'numOldFiles': len(old_paths),
+        'numNewFiles': len(new_paths),
+        'isDupe': int(bool(old_ids and new_ids and old_ids[0] == new_ids[0])),
+        'error': '',
+    }
+    columns = METRIC_COLUMNS + (LOC_COLUMNS if loc else [])
+    try:
+        if len(old_paths) > 1 or len(new_paths) > 1:
+            raise IOError("num oldFiles%d numNewFiles %d" % (len(old_paths), len(new_paths)))
+        if not old_paths:
+            raise IOError("not hasOldFile but hasNewFile" if new_paths else "not hasOldFile not hasNewFile")
+        new_path = new_paths[0] if new_paths else old_paths[0]
+        row.update(extract(old_paths[0], new_path, int(float(line_no)), loc))
+    except SyntaxError:
+        # the parse errors pythonparser reports as a SyntaxException
+        row['error'] = 'syntax'
+    except IOError as e:
+        row['error'] = str(e)
+    if row['error']:
+        # MetricRunner leaves the last metric column out of the -1 fill
+        row.update(dict.fromkeys(METRIC_COLUMNS[:-1], -1))
+        row[METRIC_COLUMNS[-1]] = 0
+        row.update(dict.fromkeys(LOC_COLUMNS if loc else [], -1))
+    return {column: row.get(column, 0) for column in COLUMNS[:1] + columns + FILE_COLUMNS + ['error']}
+
+
+def read_comments(path):
+    """(comment_id, line_number) of every row of a CSV/JSONL of records or of the labeled dataset .xlsx."""
+    if path.endswith('.xlsx'):
+        import pandas as pd
+        records = pd.read_excel(path).to_dict('records')
+    elif path.endswith(('.jsonl', '.json')):
+        with open(path, encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, newline='', encoding='utf-8') as f:
+            records = list(csv.DictReader(f))
+    for i, record in enumerate(records):
+        comment_id = next((record[name] for name in COMMENT_FIELDS if record.get(name) is not None), None)
+        line_no = next((record[name] for name in LINE_FIELDS if record.get(name) not in (None, '')), None)
+        if comment_id is None or line_no is None:
+            raise ValueError("record %d has no comment_id or line_number" % i)
+        yield str(comment_id), line_no
+
+
+def write_attributes(store_root, comments_path, output, loc=False, limit=None):
+    store = BlobStore(store_root)
+    fieldnames = None
+    tmp = output + '.tmp'
+    count = 0
+    with open(tmp, 'w', newline='') as f:
+        for comment_id, line_no in read_comments(comments_path):
+            if limit is not None and count >= limit:
+                break
+            row = extract_comment(store, comment_id, line_no, loc)
+            if fieldnames is None:
+                fieldnames = list(row)
+                writer = csv.DictWriter(f, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
+                writer.writeheader()
+            writer.writerow(row)
+            count += 1
+    os.replace(tmp, output)
+    return count
+
+
+def parity(store_root, comments_path, expected_path, limit=None, tolerance=TOLERANCE):
+    """Per column share of rows equal to the expected code attribute CSV, their correlation and the columns below tolerance.
+
+    A row whose error disagrees with the expected one counts as unequal in every column.
+    """
+    with open(expected_path, newline='') as f:
+        expected = {row['folderName']: row for row in csv.DictReader(f)}
+    store = BlobStore(store_root)
+    pairs = {column: [] for column in METRIC_COLUMNS}
+    errors = 0
+    rows = 0
+    for comment_id, line_no in read_comments(comments_path):
+        if comment_id not in expected:
+            continue
+        if limit is not None and rows >= limit:
+            break
+        rows += 1
+        row = extract_comment(store, comment_id, line_no)
+        if bool(row['error']) != bool(expected[comment_id]['error']):
+            errors += 1
+            continue
+        for column in METRIC_COLUMNS:
+            pairs[column].append((float(row[column]), float(expected[comment_id][column])))
+    report = {"rows": rows, "error_mismatches": errors, "columns": dict(), "below_tolerance": []}
+    for column, values in pairs.items():
+        equal = round(sum(a == b for a, b in values) / rows, 4) if rows else None
+        report["columns"][column] = {"equal": equal, "correlation": correlation(values)}
+        if equal is not None and equal < tolerance:
+            report["below_tolerance"].append(column)
+    return report
+
+
+def correlation(pairs):
+    n = len(pairs)
+    if n < 2:
+        return None
+    mean_a = sum(a for a, _ in pairs) / n
+    mean_b = sum(b for _, b in pairs) / n
+    cov = sum((a - mean_a) * (b - mean_b) for a, b in pairs)
+    var_a = sum((a - mean_a) ** 2 for a, _ in pairs)
+    var_b = sum((b - mean_b) ** 2 for _, b in pairs)
+    if var_a == 0 or var_b == 0:
+        return None
+    return round(cov / (var_a * var_b) ** 0.5, 4)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    extract_parser = commands.add_parser('extract', help='write the code attribute CSV of the comments')
+    extract_parser.add_argument('store', help='blob store of the Old/New snapshots')
+    extract_parser.add_argument('comments', help='.csv/.jsonl/.xlsx with comment_id and line_number')
+    extract_parser.add_argument('output')
+    extract_parser.add_argument('--loc', action='store_true', help='add the srclocs and locDelta columns')
+    extract_parser.add_argument('--limit', type=int)
+    parity_parser = commands.add_parser('parity', help='compare with a code attribute CSV of MetricRunner')
+    parity_parser.add_argument('store')
+    parity_parser.add_argument('comments')
+    parity_parser.add_argument('expected', help='code_attributes.csv')
+    parity_parser.add_argument('--limit', type=int)
+    parity_parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                               help='fail when a column has a smaller share of equal rows (default %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'extract':
+        print("wrote", write_attributes(args.store, args.comments, args.output, args.loc, args.limit), "rows")
+    elif args.command == 'parity':
+        report = parity(args.store, args.comments, args.expected, args.limit, args.tolerance)
+        print("rows", report["rows"], "error mismatches", report["error_mismatches"])
+        for column, result in report["columns"].items():
+            print("%-28s equal %-8s correlation %s" % (column, result["equal"], result["correlation"]))
+        if report["below_tolerance"]:
+            print("below tolerance %s:" % args.tolerance, ", ".join(report["below_tolerance"]), file=sys.stderr)
+            return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Code context around a commented line.
+
+Each blob gets a persistent line index (<blob>.lines, the byte offset where
+every line starts plus the file size) so the context window is sliced out of
+an mmap of the blob instead of reading the whole file for every comment.
+
+Build the indexes of every blob in the store up front with:
+
+    python -m cr_classification.code_context index blobs
+"""
+import argparse
+import mmap
+import os
+import sys
+from array import array
+
+from cr_classification.blob_store import BlobStore
+
+INDEX_SUFFIX = '.lines'
+
+# lines[line_no - CONTEXT_BEFORE:line_no + CONTEXT_AFTER] of the file, the window codes.pkl was built with
+CONTEXT_BEFORE = 4
+CONTEXT_AFTER = 5
+
+
+def _to_little_endian(offsets):
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    return offsets
+
+
+def build_line_offsets(path):
+    offsets = array('q', [0])
+    size = os.path.getsize(path)
+    if size == 0:
+        return offsets
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        pos = data.find(b'\n')
+        while pos >= 0:
+            offsets.append(pos + 1)
+            pos = data.find(b'\n', pos + 1)
+    # last line without a trailing newline is still a line
+    if offsets[-1] != size:
+        offsets.append(size)
+    return offsets
+
+
+class LineIndex:
+    def __init__(self, path, offsets):
+        self.path = path
+        self.offsets = offsets
+
+    @classmethod
+    def load(cls, path):
+        """Load the persisted index of path, building it on first use."""
+        index_path = path + INDEX_SUFFIX
+        offsets = array('q')
+        try:
+            with open(index_path, 'rb') as f:
+                offsets.frombytes(f.read())
+            _to_little_endian(offsets)
+        except FileNotFoundError:
+            offsets = build_line_offsets(path)
+            index_tmp = index_path + '.tmp'
+            with open(index_tmp, 'wb') as f:
+                _to_little_endian(array('q', offsets)).tofile(f)
+            os.replace(index_tmp, index_path)
+        return cls(path, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def read_lines(self, start, end):
+        """Same as open(path).readlines()[start:end] without reading the rest of the file."""
+        # slice semantics (negative start included) so contexts match the ones in codes.pkl
+        start, end, _ = slice(start, end).indices(len(self))
+        if start >= end:
+            return []
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return [data[self.offsets[i]:self.offsets[i + 1]].decode('utf-8') for i in range(start, end)]
+
+
+_line_indexes = dict()
+
+
+def get_line_index(path):
+    line_index = _line_indexes.get(path)
+    if line_index is None:
+        line_index = _line_indexes[path] = LineIndex.load(path)
+    return line_index
+
+
+def read_code_lines(path, line_no, before=CONTEXT_BEFORE, after=CONTEXT_AFTER):
+    return get_line_index(path).read_lines(line_no - before, line_no + after)
+
+
+def build_indexes(store):
+    paths = store.unique_blobs().values()
+    for path in paths:
+        get_line_index(path)
+    return len(paths)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    index_parser = commands.add_parser('index', help='build the line index of every blob in the store')
+    index_parser.add_argument('root')
+    args = parser.parse_args(argv)
+
+    if args.command == 'index':
+        print("indexed", build_indexes(BlobStore(args.root)), "blobs")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Keyed cache of the code context around each comment, replacing codes.pkl.
+
+There is one entry per (comment_id, line_number, window), and each entry
+records the blob ids it was sliced from. New comments only compute their own
+entries. An entry whose blobs no longer match the store is stale and gets
+recomputed instead of being reused.
+"""
+import sqlite3
+
+from cr_classification.blob_store import NEW, OLD
+from cr_classification.code_context import CONTEXT_AFTER, CONTEXT_BEFORE, read_code_lines
+
+# bump when the way contexts are built changes, older caches are dropped
+SCHEMA_VERSION = 1
+
+
+def window_spec(before=CONTEXT_BEFORE, after=CONTEXT_AFTER):
+    return '%d:%d' % (before, after)
+
+
+def read_context(store, comment_id, side, line_no, before=CONTEXT_BEFORE, after=CONTEXT_AFTER):
+    """Context of every file of a snapshot side.
+
+    A side without files gives an empty context, as its empty folder did when codes.pkl was built.
+    """
+    code = ""
+    for path in store.paths(comment_id, side) or []:
+        code_lines = read_code_lines(path, line_no, before, after)
+        code = code + "\n".join(code_lines)
+    return code
+
+
+class ContextCache:
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        if row is None or int(row[0]) != SCHEMA_VERSION:
+            self.db.execute("DROP TABLE IF EXISTS contexts")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+        self.db.execute("""CREATE TABLE IF NOT EXISTS contexts (
+            comment_id TEXT, line_number INTEGER, window TEXT,
+            old_blobs TEXT, new_blobs TEXT, old_code TEXT, new_code TEXT,
+            PRIMARY KEY (comment_id, line_number, window))""")
+        self.db.commit()
+        self.stats = dict(hits=0, computed=0, stale=0)
+
+    def close(self):
+        self.db.close()
+
+    def get_codes(self, store, comment_ids, line_numbers, before=CONTEXT_BEFORE, after=CONTEXT_AFTER):
+        """(old_code, new_code) for every comment, computing only missing or stale entries."""
+        window = window_spec(before, after)
+        self.stats = dict(hits=0, computed=0, stale=0)
+        codes = []
+        for comment_id, line_no in zip(comment_ids, line_numbers):
+            line_no = int(line_no)
+            old_blobs = ','.join(store.blob_ids(comment_id, OLD))
+            new_blobs = ','.join(store.blob_ids(comment_id, NEW))
+            row = self.db.execute(
+                "SELECT old_blobs, new_blobs, old_code, new_code FROM contexts"
+                " WHERE comment_id = ? AND line_number = ? AND window = ?",
+                (comment_id, line_no, window)).fetchone()
+            if row is not None and row[0] == old_blobs and row[1] == new_blobs:
+                self.stats['hits'] += 1
+                codes.append((row[2], row[3]))
+                continue
+
+            self.stats['stale' if row is not None else 'computed'] += 1
+            old_code = read_context(store, comment_id, OLD, line_no, before, after)
+            new_code = read_context(store, comment_id, NEW, line_no, before, after)
+            self.db.execute("INSERT OR REPLACE INTO contexts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (comment_id, line_no, window, old_blobs, new_blobs, old_code, new_code))
+            codes.append((old_code, new_code))
+        self.db.commit()
+        return codes
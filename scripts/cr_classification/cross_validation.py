@@ -0,0 +1,330 @@
+"""Cross-validation folds run as independent jobs in a process pool.
+
+save_inputs writes the model inputs, labels and comment texts once as .npy
+files. Every fold job memory maps them, so the pages are shared between the
+workers instead of copied into each one. The training, validation and test
+rows of a fold are only index arrays into these files (see batching). A job
+builds and trains its own model and writes its results to the run folder as
+soon as it finishes:
+
+    fold-<n>.weights.h5         best weights (restored by EarlyStopping)
+    fold-<n>.probabilities.npy  predicted class probabilities of the test rows
+    fold-<n>.json               the job with its split indices, the training and
+                                validation indices, the classification report,
+                                the confusion matrix and the misclassified comments
+
+fold-<n>.json is written last and marks the fold as done. run_folds skips
+done folds whose job (split, settings and inputs) is unchanged, so a run that
+died in fold 8 only trains folds 8 to 10 again. reduce_fold_results then
+averages the folds like the notebook loop did.
+
+A job seeds python, numpy and TensorFlow with its own seed (the run's seed
+plus the fold number) before it builds its model, so a fold trains the same
+way whichever worker runs it, and a rerun that skips done folds trains the
+rest like the first run would have.
+
+Each worker gets threads_per_job CPU threads (TensorFlow intra/inter-op and
+OpenMP), so n_jobs * threads_per_job should not exceed the cores of the box.
+"""
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+# TensorFlow (also through the model and embedding_cache modules) is imported
+# inside the functions, so a worker only loads it after limit_threads has run
+
+INPUTS_DIR = 'inputs'
+LABELS_FILE = 'labels.npy'
+MESSAGES_FILE = 'messages.json'
+INPUTS_INFO_FILE = 'inputs.json'
+RAGGED_PARTS = ('values', 'offsets', 'rows')
+
+
+def generate_test_train_index( length, ratio, seed=None):
+    rand_array=np.arange(0,length,1)
+    train, test =train_test_split(rand_array,test_size=ratio, shuffle=True, random_state=seed )
+    train=np.sort(train)
+    test=np.sort(test)
+    return train, test
+
+
+def save_array(path, values):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, values)
+    os.replace(tmp_path, path)
+
+
+def inputs_digest(data_input, labels, messages):
+    from cr_classification.embedding_cache import RaggedEmbeddings
+    digest = hashlib.sha1()
+    for key in sorted(data_input):
+        values = data_input[key]
+        digest.update(key.encode('utf-8'))
+        if isinstance(values, RaggedEmbeddings):
+            # the hidden states follow from the tokens, their layout is enough to tell runs apart
+            arrays = (np.array(values.values.shape), values.offsets, values.unique_rows)
+        else:
+            arrays = (values,)
+        for array in arrays:
+            digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(np.ascontiguousarray(labels).tobytes())
+    digest.update(json.dumps([str(message) for message in messages]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def read_inputs_digest(folder):
+    try:
+        with open(os.path.join(folder, INPUTS_INFO_FILE)) as f:
+            return json.load(f)["digest"]
+    except FileNotFoundError:
+        return None
+
+
+def save_inputs(folder, data_input, labels, messages):
+    """Write the model input dict, the one hot labels and the comment texts for the fold jobs.
+
+    Nothing is rewritten when the folder already holds the same inputs. Returns their digest.
+    """
+    from cr_classification.embedding_cache import RaggedEmbeddings
+    digest = inputs_digest(data_input, labels, messages)
+    if read_inputs_digest(folder) == digest:
+        return digest
+
+    inputs_folder = os.path.join(folder, INPUTS_DIR)
+    os.makedirs(inputs_folder, exist_ok=True)
+    for key, values in data_input.items():
+        if isinstance(values, RaggedEmbeddings):
+            # the shared float16 values are stored once, rows only point into them
+            for part, array in zip(RAGGED_PARTS, (values.values, values.offsets, values.unique_rows)):
+                save_array(os.path.join(inputs_folder, '%s.%s.npy' % (key, part)), np.asarray(array))
+        else:
+            save_array(os.path.join(inputs_folder, key + '.npy'), np.asarray(values))
+    save_array(os.path.join(folder, LABELS_FILE), np.asarray(labels))
+    with open(os.path.join(folder, MESSAGES_FILE), 'w') as f:
+        json.dump([str(message) for message in messages], f)
+    with open(os.path.join(folder, INPUTS_INFO_FILE), 'w') as f:
+        json.dump({"digest": digest, "keys": sorted(data_input)}, f, indent=1)
+    return digest
+
+
+def load_inputs(folder):
+    """Memory mapped counterpart of save_inputs."""
+    from cr_classification.embedding_cache import RaggedEmbeddings
+    inputs_folder = os.path.join(folder, INPUTS_DIR)
+    data_input = dict()
+    for file_name in sorted(os.listdir(inputs_folder)):
+        if not file_name.endswith('.npy'):
+            continue
+        key = file_name[:-len('.npy')]
+        if key.endswith('.values'):
+            key = key[:-len('.values')]
+            parts = [np.load(os.path.join(inputs_folder, '%s.%s.npy' % (key, part)), mmap_mode='r')
+                     for part in RAGGED_PARTS]
+            data_input[key] = RaggedEmbeddings(parts[0], np.asarray(parts[1]), np.asarray(parts[2]))
+        elif not key.endswith(('.offsets', '.rows')):
+            data_input[key] = np.load(os.path.join(inputs_folder, file_name), mmap_mode='r')
+    labels = np.load(os.path.join(folder, LABELS_FILE))
+    with open(os.path.join(folder, MESSAGES_FILE)) as f:
+        messages = np.array(json.load(f), dtype=object)
+    return data_input, labels, messages
+
+
+def fold_path(folder, fold, kind='json'):
+    return os.path.join(folder, 'fold-%02d.%s' % (fold, kind))
+
+
+def make_fold_jobs(folder, splits, metric_count, frozen_encoder=False, shared_encoder=False,
+                   batch_size=4, epochs=4, patience=2, validation_ratio=0.1, seed=None):
+    """One job per (train_index, test_index) split, e.g. of KFold.split(), over the inputs saved in folder."""
+    digest = read_inputs_digest(folder)
+    jobs = []
+    for fold, (train_index, test_index) in enumerate(splits, start=1):
+        jobs.append({
+            "folder": folder,
+            "fold": fold,
+            "inputs": digest,
+            "train_index": [int(i) for i in train_index],
+            "test_index": [int(i) for i in test_index],
+            "metric_count": metric_count,
+            "frozen_encoder": frozen_encoder,
+            "shared_encoder": shared_encoder,
+            "batch_size": batch_size,
+            "epochs": epochs,
+            "patience": patience,
+            "validation_ratio": validation_ratio,
+            # the validation split of a fold does not depend on which worker runs it
+            "seed": None if seed is None else seed + fold,
+        })
+    return jobs
+
+
+def limit_threads(threads_per_job):
+    """Process pool initializer, runs before TensorFlow is imported in the worker."""
+    threads = str(threads_per_job)
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ[name] = threads
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads_per_job)
+    tf.config.threading.set_inter_op_parallelism_threads(threads_per_job)
+
+
+def seed_job(seed):
+    """Seed python, numpy and TensorFlow in the worker, the spawned process does not inherit the notebook's seeds."""
+    if seed is None:
+        return
+    import tensorflow as tf
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+
+def run_fold(job):
+    """Train and evaluate one fold, the result is written to its fold-<n>.json."""
+    import tensorflow as tf
+    from cr_classification.batching import bucketed_dataset, predict_bucketed
+    from cr_classification.evaluation import results_from_predictions
+    from cr_classification.model import get_bert_lstm_text_code, get_frozen_encoder_head
+
+    print("Fold: ", job["fold"])
+    # weight init and dropout of the fold, job["seed"] is the run's seed plus the fold number
+    seed_job(job["seed"])
+    data_input, y, messages = load_inputs(job["folder"])
+    train_index = np.array(job["train_index"], dtype=np.int64)
+    test_index = np.array(job["test_index"], dtype=np.int64)
+    test_output = y[test_index,]
+    test_message_comment = messages[test_index,]
+
+    # rows of the full inputs, the batches gather them lazily
+    training_index, validation_index = generate_test_train_index(len(train_index), job["validation_ratio"], job["seed"])
+    training_rows = train_index[training_index]
+    validation_rows = train_index[validation_index]
+
+    if job["frozen_encoder"]:
+        model = get_frozen_encoder_head(job["metric_count"])
+    else:
+        model = get_bert_lstm_text_code(job["metric_count"], shared_encoder=job["shared_encoder"])
+    callback = tf.keras.callbacks.EarlyStopping(
+        monitor="val_loss",
+        min_delta=0,
+        patience=job["patience"],
+        verbose=1,
+        mode="min",
+        baseline=None,
+        restore_best_weights=True,)
+
+    history = model.fit(bucketed_dataset(data_input, y, batch_size=job["batch_size"], shuffle=True, seed=job["seed"], rows=training_rows),
+                        epochs=job["epochs"],
+                        validation_data=bucketed_dataset(data_input, y, batch_size=job["batch_size"], rows=validation_rows),
+                        callbacks=[callback],
+                        verbose=2,
+                        )
+
+    folder, fold = job["folder"], job["fold"]
+    model.save_weights(fold_path(folder, fold, 'weights.h5'))
+    y_preds = predict_bucketed(model, data_input, batch_size = 8, rows=test_index)
+    save_array(fold_path(folder, fold, 'probabilities.npy'), y_preds)
+
+    res, confusion_mat, error = results_from_predictions(y_preds, test_output, test_message_comment)
+    result = {
+        "fold": fold,
+        "job": job,
+        "training_index": [int(i) for i in training_index],
+        "validation_index": [int(i) for i in validation_index],
+        "epochs_trained": len(history.epoch),
+        "report": res,
+        "confusion": np.asarray(confusion_mat).tolist(),
+        "errors": [[str(comment), int(true_class), int(predicted)] for comment, true_class, predicted in error],
+    }
+    path = fold_path(folder, fold)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(result, f, indent=1)
+    os.replace(path + '.tmp', path)
+    tf.keras.backend.clear_session()
+    return path
+
+
+def is_done(job):
+    """Whether the fold's result exists and was computed by this very job."""
+    try:
+        with open(fold_path(job["folder"], job["fold"])) as f:
+            return json.load(f)["job"] == job
+    except (FileNotFoundError, ValueError, KeyError):
+        return False
+
+
+def run_folds(jobs, n_jobs=1, threads_per_job=None):
+    """Run the fold jobs not done yet n_jobs at a time, each in a fresh process. Returns the result paths in fold order."""
+    pending = [job for job in jobs if not is_done(job)]
+    for job in jobs:
+        if job not in pending:
+            print("Fold: ", job["fold"], "done, skipped")
+    if not pending:
+        return [fold_path(job["folder"], job["fold"]) for job in jobs]
+
+    if threads_per_job is None:
+        threads_per_job = max(1, (os.cpu_count() or 1) // n_jobs)
+    # spawn: the workers must not inherit an already initialised TensorFlow runtime from the notebook
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=n_jobs, mp_context=context,
+                                                initializer=limit_threads, initargs=(threads_per_job,)) as pool:
+        list(pool.map(run_fold, pending))
+    return [fold_path(job["folder"], job["fold"]) for job in jobs]
+
+
+def result_folds(folder):
+    """Folds with a result in folder."""
+    folds = []
+    for name in os.listdir(folder):
+        stem = name[len('fold-'):-len('.json')]
+        if name.startswith('fold-') and name.endswith('.json') and stem.isdigit():
+            folds.append(int(stem))
+    return sorted(folds)
+
+
+def best_fold(folder, folds, average='macro avg', score='f1-score'):
+    """Fold with the highest test score, e.g. to bundle its weights for predict."""
+    def fold_score(fold):
+        with open(fold_path(folder, fold)) as f:
+            return json.load(f)["report"][average][score]
+    return max(folds, key=fold_score)
+
+
+def reduce_fold_results(folder, folds=None):
+    """Averaged per class precision, recall, f-score and accuracy, summed confusion matrix and per fold errors."""
+    from cr_classification.model import NUM_CLASSES
+    if folds is None:
+        folds = result_folds(folder)
+    paths = [fold_path(folder, fold) for fold in folds]
+
+    precision = [0.0] * NUM_CLASSES
+    recall = [0.0] * NUM_CLASSES
+    f_score = [0.0] * NUM_CLASSES
+    accuracy = 0.0
+    confusion = np.zeros((NUM_CLASSES, NUM_CLASSES), dtype=np.int64)
+    error_output = []
+    for path in paths:
+        with open(path) as f:
+            result = json.load(f)
+        res = result["report"]
+        for label in range(NUM_CLASSES):
+            # a class absent from a fold counts as 0, as in classification_report
+            scores = res.get(str(label), {})
+            precision[label] += scores.get('precision', 0.0)
+            recall[label] += scores.get('recall', 0.0)
+            f_score[label] += scores.get('f1-score', 0.0)
+        accuracy += res['accuracy']
+        confusion += np.array(result["confusion"], dtype=np.int64)
+        error_output.append(result["errors"])
+
+    count = max(1, len(paths))
+    return ([x / count for x in precision], [x / count for x in recall], [x / count for x in f_score],
+            accuracy / count, confusion, error_output)
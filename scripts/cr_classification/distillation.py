@@ -0,0 +1,201 @@
+"""Small student model distilled from the cross-validation teachers.
+
+The student reads the same CodeBERT token ids and metric vector as the
+teacher, but replaces each CodeBERT encoder + LSTM branch with a small
+embedding and a few 1D convolutions with a masked max pool. It has a few
+million weights instead of two 125M parameter encoders.
+
+Its targets are the teacher's soft labels: the student of a fold is
+trained on the probabilities the teacher of the same fold (fold-NN.weights.h5)
+predicts for that fold's training rows. The held-out rows of the fold are
+never labeled by a teacher, so nothing of them reaches the student. The soft
+labels are softened by a temperature and mixed with the true labels. The
+student is trained and tested on the teacher's folds, so the per class F1
+gap is measured on the same held-out rows.
+
+    python -m cr_classification.distillation train cv_results --alpha 0.7 --temperature 2
+    python -m cr_classification.distillation benchmark cv_results --fold 1 --threads 8
+"""
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.optimizers.legacy import Adam
+
+from cr_classification.batching import bucketed_dataset, predict_bucketed
+from cr_classification.cross_validation import fold_path, load_inputs, result_folds
+from cr_classification.model import NUM_CLASSES
+
+# vocabulary of the codebert-base tokenizer
+VOCAB_SIZE = 50265
+STUDENT_NAME = 'student'
+
+
+def get_student_model(metric_count, vocab_size=VOCAB_SIZE, embedding_dim=128, filters=128,
+                      kernel_sizes=(3, 5), learning_rate=1e-3):
+    """CNN over the comment_ and code_ tokens plus the metrics, inputs named like get_bert_lstm_text_code's."""
+    inputs = []
+    branches = []
+    for prefix in ("comment_", "code_"):
+        input_ids_dummy = tf.keras.layers.Input(shape=(None,), name=(prefix+'input_ids'), dtype='int64')
+        mask_dummy = tf.keras.layers.Input(shape=(None,), name=(prefix+'attention_mask'), dtype='int64')
+        inputs.extend([input_ids_dummy, mask_dummy])
+        x = tf.keras.layers.Embedding(vocab_size, embedding_dim, name=prefix+'embedding')(input_ids_dummy)
+        for kernel_size in kernel_sizes:
+            x = tf.keras.layers.Conv1D(filters, kernel_size, padding='same', activation='relu')(x)
+        # pad positions can not win the max pool
+        x = tf.keras.layers.Lambda(lambda t: t[0] - 1e9 * (1.0 - tf.cast(t[1], t[0].dtype))[:, :, None],
+                                   name=prefix+'mask_padding')([x, mask_dummy])
+        branches.append(tf.keras.layers.GlobalMaxPooling1D()(x))
+
+    float_metrics_input_dummy = tf.keras.layers.Input(shape=(metric_count,), name='metric',dtype='float64')
+    inputs.append(float_metrics_input_dummy)
+    x = tf.keras.layers.Concatenate()(branches + [tf.cast(float_metrics_input_dummy, tf.float32)])
+    x = tf.keras.layers.Dropout(0.3)(x)
+    y = tf.keras.layers.Dense(NUM_CLASSES, activation='softmax', name='outputs')(x)
+
+    model = tf.keras.Model(inputs=inputs, outputs=y)
+    model.compile(loss=tf.keras.losses.CategoricalCrossentropy(),
+                  optimizer=Adam(learning_rate=learning_rate),
+                  metrics=[tf.keras.metrics.CategoricalAccuracy()])
+    return model
+
+
+def soften(probabilities, temperature):
+    """Softmax of the teacher's logits divided by temperature, computed from its probabilities."""
+    logits = np.log(np.clip(probabilities, 1e-8, 1.0)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    softened = np.exp(logits)
+    return softened / softened.sum(axis=1, keepdims=True)
+
+
+def teacher_soft_labels(cv_folder, fold, job, data_input, rows, batch_size=32):
+    """Probabilities the teacher of a fold predicts for rows, which must be among its training rows."""
+    from cr_classification.model import get_bert_lstm_text_code
+    if np.isin(rows, job["test_index"]).any():
+        raise ValueError("the teacher of fold %d did not train on every row it would label" % fold)
+    model = get_bert_lstm_text_code(job["metric_count"], shared_encoder=job["shared_encoder"])
+    model.load_weights(fold_path(cv_folder, fold, 'weights.h5'))
+    probabilities = predict_bucketed(model, data_input, batch_size=batch_size, rows=rows)
+    tf.keras.backend.clear_session()
+    return probabilities
+
+
+def train_student_fold(cv_folder, fold, alpha=0.7, temperature=2.0, epochs=10, batch_size=32, patience=2):
+    """Train the student on a fold's training rows, test it on the fold's held-out rows."""
+    from cr_classification.evaluation import results_from_predictions
+    with open(fold_path(cv_folder, fold)) as f:
+        result = json.load(f)
+    job = result["job"]
+    if job["frozen_encoder"]:
+        raise ValueError("fold %d trained a frozen encoder head, the student needs the token ids" % fold)
+
+    data_input, y, messages = load_inputs(cv_folder)
+    train_index = np.array(job["train_index"], dtype=np.int64)
+    test_rows = np.array(job["test_index"], dtype=np.int64)
+    training_rows = train_index[result["training_index"]]
+    validation_rows = train_index[result["validation_index"]]
+
+    # only the rows the fold's teacher trained on get soft labels, the test rows keep their true ones
+    soft = soften(teacher_soft_labels(cv_folder, fold, job, data_input, train_index, batch_size), temperature)
+    targets = y.astype(np.float64)
+    targets[train_index] = alpha * soft + (1 - alpha) * y[train_index]
+
+    model = get_student_model(job["metric_count"])
+    callback = tf.keras.callbacks.EarlyStopping(monitor="val_loss", patience=patience, mode="min", restore_best_weights=True)
+    model.fit(bucketed_dataset(data_input, targets, batch_size=batch_size, shuffle=True, seed=job["seed"], rows=training_rows),
+              epochs=epochs,
+              validation_data=bucketed_dataset(data_input, targets, batch_size=batch_size, rows=validation_rows),
+              callbacks=[callback],
+              verbose=2)
+    model.save_weights(fold_path(cv_folder, fold, STUDENT_NAME + '.weights.h5'))
+
+    probabilities = predict_bucketed(model, data_input, batch_size=batch_size, rows=test_rows)
+    report, confusion, _ = results_from_predictions(probabilities, y[test_rows], messages[test_rows])
+    student = {"fold": fold, "report": report, "confusion": np.asarray(confusion).tolist()}
+    with open(fold_path(cv_folder, fold, STUDENT_NAME + '.json'), 'w') as f:
+        json.dump(student, f, indent=1)
+    tf.keras.backend.clear_session()
+    return student
+
+
+def f1_gap(cv_folder, folds):
+    """Per class F1 of teacher and student averaged over the folds, and the gap between them."""
+    labels = [str(c) for c in range(NUM_CLASSES)] + ['macro avg', 'weighted avg']
+    sums = {label: [0.0, 0.0] for label in labels}
+    for fold in folds:
+        with open(fold_path(cv_folder, fold)) as f:
+            teacher = json.load(f)["report"]
+        with open(fold_path(cv_folder, fold, STUDENT_NAME + '.json')) as f:
+            student = json.load(f)["report"]
+        for label in labels:
+            sums[label][0] += teacher.get(label, {}).get('f1-score', 0.0)
+            sums[label][1] += student.get(label, {}).get('f1-score', 0.0)
+    gap = dict()
+    for label, (teacher_f1, student_f1) in sums.items():
+        teacher_f1, student_f1 = teacher_f1 / len(folds), student_f1 / len(folds)
+        gap[label] = {"teacher": round(teacher_f1, 4), "student": round(student_f1, 4),
+                      "gap": round(teacher_f1 - student_f1, 4)}
+    return gap
+
+
+def benchmark(cv_folder, fold, batch_size=32, rows=512):
+    """CPU rows per second of the teacher and the student of a fold over (up to) rows held-out rows."""
+    from cr_classification.model import get_bert_lstm_text_code
+    with open(fold_path(cv_folder, fold)) as f:
+        job = json.load(f)["job"]
+    data_input, _, _ = load_inputs(cv_folder)
+    test_rows = np.array(job["test_index"][:rows], dtype=np.int64)
+
+    results = dict()
+    for name in ('teacher', STUDENT_NAME):
+        tf.keras.backend.clear_session()
+        if name == 'teacher':
+            model = get_bert_lstm_text_code(job["metric_count"], shared_encoder=job["shared_encoder"])
+            model.load_weights(fold_path(cv_folder, fold, 'weights.h5'))
+        else:
+            model = get_student_model(job["metric_count"])
+            model.load_weights(fold_path(cv_folder, fold, STUDENT_NAME + '.weights.h5'))
+        # first batch traces the graph
+        predict_bucketed(model, data_input, batch_size=batch_size, rows=test_rows[:batch_size])
+        start = time.perf_counter()
+        predict_bucketed(model, data_input, batch_size=batch_size, rows=test_rows)
+        results[name] = {"rows_per_second": round(len(test_rows) / (time.perf_counter() - start), 2),
+                         "weights": int(sum(np.prod(w.shape) for w in model.weights))}
+    results["speedup"] = round(results[STUDENT_NAME]["rows_per_second"] / results["teacher"]["rows_per_second"], 2)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    train_parser = commands.add_parser('train', help='train a student on every fold and report the F1 gap')
+    train_parser.add_argument('cv_folder')
+    train_parser.add_argument('--alpha', type=float, default=0.7, help='weight of the soft labels against the true ones')
+    train_parser.add_argument('--temperature', type=float, default=2.0)
+    train_parser.add_argument('--epochs', type=int, default=10)
+    train_parser.add_argument('--batch-size', type=int, default=32)
+    benchmark_parser = commands.add_parser('benchmark', help='CPU throughput of the teacher and the student of a fold')
+    benchmark_parser.add_argument('cv_folder')
+    benchmark_parser.add_argument('--fold', type=int, default=1)
+    benchmark_parser.add_argument('--threads', type=int)
+    benchmark_parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        folds = result_folds(args.cv_folder)
+        for fold in folds:
+            print("Fold: ", fold)
+            train_student_fold(args.cv_folder, fold, args.alpha, args.temperature, args.epochs, args.batch_size)
+        print(json.dumps(f1_gap(args.cv_folder, folds), indent=1))
+    elif args.command == 'benchmark':
+        from cr_classification.export import configure_cpu
+        configure_cpu(args.threads)
+        print(json.dumps(benchmark(args.cv_folder, args.fold, args.batch_size), indent=1))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
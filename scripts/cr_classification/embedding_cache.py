@@ -0,0 +1,128 @@
+"""Frozen encoder mode: CodeBERT runs once and only the heads are trained.
+
+The hidden states of every tokenized input are stored as float16 in memory
+mapped .npy files. Each unique token sequence is stored once, ragged: the
+rows of all sequences are concatenated and offsets say where each one
+starts. Folds, hyperparameter sweeps and metric ablations then train the
+LSTM/dense head of model.get_frozen_encoder_head on these features instead of
+fine-tuning CodeBERT again.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from cr_classification.batching import bucket_batches
+from cr_classification.model import CODEBERT
+
+EMBEDDING_BATCH_SIZE = 16
+
+
+class RaggedEmbeddings:
+    """Per row hidden states, indexing gives a lazy view and np.asarray() pads to the longest row."""
+
+    def __init__(self, values, offsets, unique_rows):
+        self.values = values
+        self.offsets = offsets
+        self.unique_rows = unique_rows
+
+    def __len__(self):
+        return len(self.unique_rows)
+
+    def __getitem__(self, rows):
+        return RaggedEmbeddings(self.values, self.offsets, self.unique_rows[rows])
+
+    def __array__(self, dtype=None):
+        starts = self.offsets[self.unique_rows]
+        lengths = self.offsets[self.unique_rows + 1] - starts
+        padded = np.zeros((len(self), max(1, int(lengths.max(initial=0))), self.values.shape[1]),
+                          dtype=dtype or self.values.dtype)
+        for i, (start, length) in enumerate(zip(starts, lengths)):
+            padded[i, :length] = self.values[start:start + length]
+        return padded
+
+
+def unique_sequences(input_ids, attention_masks):
+    """Unique token sequences and the unique index of every row."""
+    lengths = np.asarray(attention_masks).sum(axis=1)
+    index = dict()
+    unique_rows = np.zeros(len(lengths), dtype=np.int64)
+    first_rows = []
+    for row, length in enumerate(lengths):
+        key = np.asarray(input_ids[row, :length]).tobytes()
+        if key not in index:
+            index[key] = len(first_rows)
+            first_rows.append(row)
+        unique_rows[row] = index[key]
+    return np.array(first_rows, dtype=np.int64), lengths, unique_rows
+
+
+class EmbeddingCache:
+    def __init__(self, root, encoder_name=CODEBERT):
+        self.root = root
+        self.encoder_name = encoder_name
+        self.encoder = None
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name, kind):
+        return os.path.join(self.root, '%s.%s' % (name, kind))
+
+    def get_encoder(self):
+        if self.encoder is None:
+            from transformers import TFAutoModel
+            self.encoder = TFAutoModel.from_pretrained(self.encoder_name)
+        return self.encoder
+
+    def hidden_states(self, name, input_ids, attention_masks, pooled=False, batch_size=EMBEDDING_BATCH_SIZE):
+        """Hidden states of every row, computed on first use and reused while the tokens are unchanged.
+
+        pooled gives the (rows, hidden) array of the first (<s>) token instead of the RaggedEmbeddings of all tokens.
+        """
+        digest = hashlib.sha1()
+        digest.update(np.ascontiguousarray(input_ids).tobytes())
+        digest.update(np.ascontiguousarray(attention_masks).tobytes())
+        info = {"encoder": self.encoder_name, "pooled": pooled, "tokens": digest.hexdigest()}
+
+        try:
+            with open(self.path(name, 'json')) as f:
+                cached = json.load(f) == info
+        except FileNotFoundError:
+            cached = False
+        if not cached:
+            self.compute(name, input_ids, attention_masks, pooled, batch_size)
+            with open(self.path(name, 'json'), 'w') as f:
+                json.dump(info, f, indent=1)
+
+        values = np.load(self.path(name, 'values.npy'), mmap_mode='r')
+        unique_rows = np.load(self.path(name, 'rows.npy'))
+        if pooled:
+            return values[unique_rows]
+        return RaggedEmbeddings(values, np.load(self.path(name, 'offsets.npy')), unique_rows)
+
+    def compute(self, name, input_ids, attention_masks, pooled, batch_size):
+        encoder = self.get_encoder()
+        first_rows, lengths, unique_rows = unique_sequences(input_ids, attention_masks)
+        unique_lengths = lengths[first_rows]
+        offsets = np.zeros(len(first_rows) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(unique_lengths)
+        hidden_size = encoder.config.hidden_size
+
+        values_tmp = self.path(name, 'values.tmp.npy')
+        shape = (len(first_rows), hidden_size) if pooled else (int(offsets[-1]), hidden_size)
+        values = np.lib.format.open_memmap(values_tmp, mode='w+', dtype=np.float16, shape=shape)
+        for batch in bucket_batches(unique_lengths, batch_size):
+            width = max(1, int(unique_lengths[batch].max()))
+            rows = first_rows[batch]
+            states = encoder(input_ids=np.asarray(input_ids[rows, :width], dtype=np.int64),
+                             attention_mask=np.asarray(attention_masks[rows, :width], dtype=np.int64))[0].numpy()
+            for i, unique in enumerate(batch):
+                if pooled:
+                    values[unique] = states[i, 0]
+                else:
+                    values[offsets[unique]:offsets[unique + 1]] = states[i, :unique_lengths[unique]]
+        values.flush()
+        del values
+        os.replace(values_tmp, self.path(name, 'values.npy'))
+        np.save(self.path(name, 'offsets.npy'), offsets)
+        np.save(self.path(name, 'rows.npy'), unique_rows)
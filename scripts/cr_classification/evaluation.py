@@ -0,0 +1,32 @@
+"""Classification reports of a trained model."""
+import tensorflow as tf
+from sklearn.metrics import classification_report, confusion_matrix
+
+from cr_classification.batching import predict_bucketed
+from cr_classification.model import NUM_CLASSES
+
+
+def results_with_misclassification(model, test_x, y_test, test_message_comment, batch_size = 8):
+    y_preds = predict_bucketed(model, test_x, batch_size = batch_size)
+    return results_from_predictions(y_preds, y_test, test_message_comment)
+
+
+def results_from_predictions(y_preds, y_test, test_message_comment):
+
+    retro_output=[]
+
+    true_class = tf.argmax( y_test, 1 )
+    predicted_class = tf.argmax( y_preds, 1 )
+
+    t_class=true_class.numpy()
+    pred_class=predicted_class.numpy()
+
+    for i in range(0,len(true_class)):
+        if(t_class[i]!=pred_class[i]):
+            retro_output.append([test_message_comment[i],t_class[i],pred_class[i]])
+
+    # all labels, so a fold missing a class still gives a full matrix to sum up
+    cm = confusion_matrix(true_class, predicted_class, labels=list(range(NUM_CLASSES)))
+    print(classification_report(true_class, predicted_class))
+
+    return classification_report(true_class, predicted_class, output_dict=True),cm,retro_output
@@ -0,0 +1,154 @@
+"""Export of a trained classifier to a TF SavedModel and a CPU runner for it.
+
+The SavedModel holds the whole get_bert_lstm_text_code graph (both CodeBERT
+branches, the LSTMs and the metric input) behind one serving signature that
+takes the token ids and masks of any length plus the metric vector. It runs
+without the transformers package and without rebuilding the model in Python.
+
+SavedModelRunner loads it for CPU inference with the grappler graph
+optimizations, oneDNN kernels and fixed intra/inter-op thread pools. Its
+predictions are checked against the Keras ones saved for each cross-validation
+fold (fold-NN.probabilities.npy) with:
+
+    python -m cr_classification.export saved-model model_bundle model_bundle/saved_model
+    python -m cr_classification.export --threads 8 parity cv_results
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+# oneDNN kernels for the dense matmuls, read when TensorFlow is imported
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+
+import tensorflow as tf
+
+from cr_classification.batching import BucketedSequence
+from cr_classification.cross_validation import fold_path, load_inputs, result_folds
+
+SIGNATURE = 'serving_default'
+GRAPH_OPTIMIZATIONS = {
+    'constant_folding': True,
+    'shape_optimization': True,
+    'remapping': True,
+    'arithmetic_optimization': True,
+    'dependency_optimization': True,
+    'loop_optimization': True,
+    'function_optimization': True,
+    'layout_optimizer': True,
+}
+# largest absolute probability difference accepted by the parity check
+PARITY_TOLERANCE = 1e-4
+
+
+def configure_cpu(threads=None, inter_op_threads=None, xla=False):
+    """Thread pools and graph optimizations, must run before TensorFlow executes its first op."""
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    tf.config.optimizer.set_experimental_options(GRAPH_OPTIMIZATIONS)
+    if xla:
+        tf.config.optimizer.set_jit('autoclustering')
+
+
+def export_saved_model(model, path):
+    """Save model with a serving signature over every input, sequence lengths left open."""
+    signature = [tf.TensorSpec(shape=model_input.shape, dtype=model_input.dtype, name=model_input.name)
+                 for model_input in model.inputs]
+
+    @tf.function(input_signature=signature)
+    def serve(*inputs):
+        return {'outputs': model(list(inputs), training=False)}
+
+    tf.saved_model.save(model, path, signatures={SIGNATURE: serve.get_concrete_function()})
+    return path
+
+
+def export_bundle(bundle_folder, path):
+    from cr_classification.predict import load_bundle
+    model, bundle = load_bundle(bundle_folder)
+    export_saved_model(model, path)
+    with open(os.path.join(path, 'bundle.json'), 'w') as f:
+        json.dump(bundle, f, indent=1)
+    return path
+
+
+class SavedModelRunner:
+    """Length bucketed inference through the serving signature of an exported model."""
+
+    def __init__(self, path):
+        self.model = tf.saved_model.load(path)
+        self.signature = self.model.signatures[SIGNATURE]
+        self.input_specs = self.signature.structured_input_signature[1]
+
+    def predict_batch(self, batch):
+        feed = {name: tf.constant(np.asarray(batch[name]), dtype=spec.dtype)
+                for name, spec in self.input_specs.items()}
+        return self.signature(**feed)['outputs'].numpy()
+
+    def predict(self, inputs, batch_size=8, rows=None):
+        """Same output as batching.predict_bucketed(model, inputs, batch_size, rows) of the Keras model."""
+        sequence = BucketedSequence(inputs, batch_size=batch_size, rows=rows)
+        predictions = np.concatenate([self.predict_batch(sequence[i]) for i in range(len(sequence))])
+        ordered = np.empty_like(predictions)
+        ordered[sequence.order] = predictions
+        return ordered
+
+
+def check_fold_parity(cv_folder, fold, tolerance=PARITY_TOLERANCE, batch_size=8):
+    """Export a fold's model and compare the runner's test set predictions to the saved Keras ones."""
+    from cr_classification.model import get_bert_lstm_text_code
+    with open(fold_path(cv_folder, fold)) as f:
+        job = json.load(f)["job"]
+    if job["frozen_encoder"]:
+        raise ValueError("fold %d trained a frozen encoder head, only full models are exported" % fold)
+
+    model = get_bert_lstm_text_code(job["metric_count"], shared_encoder=job["shared_encoder"])
+    model.load_weights(fold_path(cv_folder, fold, 'weights.h5'))
+    path = export_saved_model(model, fold_path(cv_folder, fold, 'saved_model'))
+    tf.keras.backend.clear_session()
+
+    data_input, _, _ = load_inputs(cv_folder)
+    expected = np.load(fold_path(cv_folder, fold, 'probabilities.npy'))
+    predicted = SavedModelRunner(path).predict(data_input, batch_size=batch_size, rows=job["test_index"])
+    max_difference = float(np.abs(predicted - expected).max())
+    return {
+        "fold": fold,
+        "rows": len(expected),
+        "max_abs_difference": max_difference,
+        "same_class": float(np.mean(predicted.argmax(axis=1) == expected.argmax(axis=1))),
+        "ok": max_difference <= tolerance,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, help='intra-op threads, all cores by default')
+    parser.add_argument('--inter-op-threads', type=int)
+    parser.add_argument('--xla', action='store_true', help='compile the graph with XLA')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('saved-model', help='export the model of a predict bundle')
+    export_parser.add_argument('bundle')
+    export_parser.add_argument('path')
+    parity_parser = commands.add_parser('parity', help='compare exported and Keras predictions on the held-out folds')
+    parity_parser.add_argument('cv_folder')
+    parity_parser.add_argument('--folds', type=int, nargs='*', help='all folds with results by default')
+    parity_parser.add_argument('--tolerance', type=float, default=PARITY_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    configure_cpu(args.threads, args.inter_op_threads, args.xla)
+    if args.command == 'saved-model':
+        print("exported to", export_bundle(args.bundle, args.path))
+    elif args.command == 'parity':
+        folds = args.folds or result_folds(args.cv_folder)
+        results = [check_fold_parity(args.cv_folder, fold, args.tolerance) for fold in folds]
+        for result in results:
+            print(result)
+        return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
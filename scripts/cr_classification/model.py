@@ -0,0 +1,152 @@
+"""CodeBERT + LSTM classifier over the review comment, the code around it and the code metrics.
+
+By default the comment and code branches each get their own CodeBERT encoder
+(the model of the paper). With shared_encoder=True a single encoder feeds
+both branches' LSTM heads. That halves the encoder weights, the optimizer
+state and the load time. Compare the two setups with:
+
+    python -m cr_classification.model benchmark --metric-count 28
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.optimizers.legacy import Adam
+from transformers import TFAutoModel
+
+CODEBERT = "microsoft/codebert-base"
+NUM_CLASSES = 5
+
+lstm_layer_1_name = 'lstm_layer_1'
+lstm_layer_2_name = "lstm_layer_2"
+bert_layer_name = 'tf_roberta_model'
+
+
+def single_bert_layer_hidden_state(prefix, codebert=None):
+    # sequence length is left open, every batch is padded to its own longest row
+    input_ids_dummy = tf.keras.layers.Input(shape=(None,), name=(prefix+'input_ids'), dtype='int64')
+    mask_dummy = tf.keras.layers.Input(shape=(None,), name=(prefix+'attention_mask'), dtype='int64')
+    if codebert is None:
+        codebert = TFAutoModel.from_pretrained(CODEBERT)
+
+    embeddings_dummy = codebert(input_ids= input_ids_dummy, attention_mask=mask_dummy)[0]
+
+    return input_ids_dummy,mask_dummy,codebert,embeddings_dummy
+
+
+def get_bert_lstm_text_code(metric_count, shared_encoder=False, learning_rate=1e-5):
+    # two input layers, we ensure layer name variables match to dictionary keys in TF dataset
+    comment_input_ids_dummy, comment_mask_dummy, comment_codebert, comment_embeddings_dummy = single_bert_layer_hidden_state("comment_")
+    old_code_input_ids_dummy, old_code_mask_dummy, old_code_codebert, old_code_embeddings_dummy = single_bert_layer_hidden_state(
+        "code_", comment_codebert if shared_encoder else None)
+
+    # masked so the LSTM state does not depend on how much padding the batch has
+    comment_x = tf.keras.layers.LSTM(50, dropout=0.3, recurrent_dropout=0.3, name=lstm_layer_1_name)(comment_embeddings_dummy, mask=tf.cast(comment_mask_dummy, tf.bool))
+    old_code_x = tf.keras.layers.LSTM(50, dropout=0.3, recurrent_dropout=0.3, name=lstm_layer_2_name)(old_code_embeddings_dummy, mask=tf.cast(old_code_mask_dummy, tf.bool))
+    all_lstm = tf.keras.layers.Concatenate()([comment_x, old_code_x])
+
+    float_metrics_input_dummy = tf.keras.layers.Input(shape=(metric_count,), name='metric',dtype='float64')
+
+    x_with_metrics = tf.keras.layers.Concatenate()([all_lstm, float_metrics_input_dummy])
+
+    y = tf.keras.layers.Dense(NUM_CLASSES, activation='softmax', name='outputs')(x_with_metrics)
+
+    # initialize model
+    model = tf.keras.Model(inputs=[ comment_input_ids_dummy, comment_mask_dummy,
+                                   old_code_input_ids_dummy, old_code_mask_dummy,
+                                    float_metrics_input_dummy], outputs=y)
+
+    loss = tf.keras.losses.CategoricalCrossentropy()
+    acc = tf.keras.metrics.CategoricalAccuracy()
+    adam_optimizer = Adam(learning_rate=learning_rate)
+    model.compile(loss=loss,optimizer=adam_optimizer,metrics=[acc])
+
+    return model
+
+
+def get_frozen_encoder_head(metric_count, hidden_size=768, pooled=False, learning_rate=1e-3):
+    """Head of get_bert_lstm_text_code over cached encoder outputs (see embedding_cache).
+
+    Takes the comment_/code_ hidden_states (with their attention_mask) or, when pooled, one vector per input.
+    """
+    inputs = []
+    branches = []
+    for prefix, lstm_name in (("comment_", lstm_layer_1_name), ("code_", lstm_layer_2_name)):
+        if pooled:
+            pooled_dummy = tf.keras.layers.Input(shape=(hidden_size,), name=(prefix+'pooled'), dtype='float32')
+            inputs.append(pooled_dummy)
+            branches.append(pooled_dummy)
+        else:
+            states_dummy = tf.keras.layers.Input(shape=(None, hidden_size), name=(prefix+'hidden_states'), dtype='float32')
+            mask_dummy = tf.keras.layers.Input(shape=(None,), name=(prefix+'attention_mask'), dtype='int64')
+            inputs.extend([states_dummy, mask_dummy])
+            branches.append(tf.keras.layers.LSTM(50, dropout=0.3, recurrent_dropout=0.3, name=lstm_name)(states_dummy, mask=tf.cast(mask_dummy, tf.bool)))
+
+    float_metrics_input_dummy = tf.keras.layers.Input(shape=(metric_count,), name='metric',dtype='float64')
+    inputs.append(float_metrics_input_dummy)
+    x_with_metrics = tf.keras.layers.Concatenate()(branches + [float_metrics_input_dummy])
+    y = tf.keras.layers.Dense(NUM_CLASSES, activation='softmax', name='outputs')(x_with_metrics)
+
+    model = tf.keras.Model(inputs=inputs, outputs=y)
+    model.compile(loss=tf.keras.losses.CategoricalCrossentropy(),
+                  optimizer=Adam(learning_rate=learning_rate),
+                  metrics=[tf.keras.metrics.CategoricalAccuracy()])
+    return model
+
+
+def dummy_batch(metric_count, batch_size, seq_len):
+    rng = np.random.default_rng(0)
+    batch = dict()
+    for prefix in ("comment_", "code_"):
+        batch[prefix + "input_ids"] = rng.integers(3, 1000, size=(batch_size, seq_len))
+        batch[prefix + "attention_mask"] = np.ones((batch_size, seq_len), dtype=np.int64)
+    batch["metric"] = rng.random((batch_size, metric_count))
+    labels = np.eye(NUM_CLASSES)[rng.integers(0, NUM_CLASSES, size=batch_size)]
+    return batch, labels
+
+
+def benchmark_encoder_setups(metric_count, batch_size=4, seq_len=128, steps=5):
+    """Load time, weights, optimizer state and train step time of the two tower and shared encoder models."""
+    results = []
+    batch, labels = dummy_batch(metric_count, batch_size, seq_len)
+    for shared_encoder in (False, True):
+        tf.keras.backend.clear_session()
+        start = time.perf_counter()
+        model = get_bert_lstm_text_code(metric_count, shared_encoder=shared_encoder)
+        load_seconds = time.perf_counter() - start
+
+        # first step builds the optimizer slots and traces the graph
+        model.train_on_batch(batch, labels)
+        start = time.perf_counter()
+        for _ in range(steps):
+            model.train_on_batch(batch, labels)
+        step_seconds = (time.perf_counter() - start) / steps
+
+        results.append({
+            "setup": "shared encoder" if shared_encoder else "two encoders",
+            "load_seconds": round(load_seconds, 2),
+            "weights": int(sum(np.prod(w.shape) for w in model.weights)),
+            "optimizer_state": int(sum(np.prod(w.shape) for w in model.optimizer.variables())),
+            "train_step_seconds": round(step_seconds, 3),
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    benchmark_parser = commands.add_parser('benchmark', help='compare the two tower and shared encoder models')
+    benchmark_parser.add_argument('--metric-count', type=int, required=True)
+    benchmark_parser.add_argument('--batch-size', type=int, default=4)
+    benchmark_parser.add_argument('--seq-len', type=int, default=128)
+    args = parser.parse_args(argv)
+
+    if args.command == 'benchmark':
+        for row in benchmark_encoder_setups(args.metric_count, args.batch_size, args.seq_len):
+            print(row)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
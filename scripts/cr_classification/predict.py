@@ -0,0 +1,246 @@
+"""Classify new review comments with a trained model.
+
+A model bundle is a folder holding the weights of a get_bert_lstm_text_code
+model and bundle.json: the metric columns in model order, the MinMaxScaler
+fitted on them, the token lengths and the comment_group of every output.
+Export one from the cross-validation results with save_bundle (see the
+notebook).
+
+Records are read from a CSV or JSONL file (by extension) with a message, the
+path of the commented file, its line_number and optionally a comment_id.
+The metric values are taken from the record's own columns, or else from the
+row of its comment_id in a code attribute CSV of MetricRunner (--metrics).
+A record missing any metric column is an error, the values are never filled
+in from another extractor than the one the model was trained on. Columns that
+MetricRunner does not write (cyclomatic_complexity and comment_loc come from
+the labeled dataset) have to be in the records themselves.
+Records are processed in chunks: code context, tokens and metric features
+are built for one chunk, classified, and the predicted comment_group with
+the probability of every group is written out before the next chunk is read.
+
+    python -m cr_classification.predict classify model_bundle comments.jsonl predictions.csv --root repo --metrics code_attributes.csv
+"""
+import argparse
+import csv
+import functools
+import itertools
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+
+from cr_classification.code_context import CONTEXT_AFTER, CONTEXT_BEFORE
+
+BUNDLE_FILE = 'bundle.json'
+WEIGHTS_FILE = 'weights.h5'
+CHUNK_SIZE = 1024
+# commented files are usually hit by many comments in a row
+FILE_CACHE_SIZE = 256
+
+MESSAGE_FIELDS = ('message', 'comment')
+FILE_FIELDS = ('file', 'file_name', 'path')
+LINE_FIELDS = ('line_number', 'line')
+METRICS_KEY = 'folderName'
+
+
+def save_bundle(folder, weights_path, metric_columns, scaler, class_names, shared_encoder=False,
+                comment_token_slots=512, code_token_slots=512):
+    """Bundle trained weights (e.g. a fold's fold-NN.weights.h5) with what predict needs to rebuild the inputs."""
+    from cr_classification.model import CODEBERT
+    os.makedirs(folder, exist_ok=True)
+    shutil.copyfile(weights_path, os.path.join(folder, WEIGHTS_FILE))
+    bundle = {
+        "encoder": CODEBERT,
+        "shared_encoder": shared_encoder,
+        "metric_columns": [str(column) for column in metric_columns],
+        # MinMaxScaler(clip=True).transform is x * scale + min clipped to [0, 1]
+        "scaler_min": [float(x) for x in scaler.min_],
+        "scaler_scale": [float(x) for x in scaler.scale_],
+        "class_names": [str(name) for name in class_names],
+        "comment_token_slots": comment_token_slots,
+        "code_token_slots": code_token_slots,
+    }
+    with open(os.path.join(folder, BUNDLE_FILE), 'w') as f:
+        json.dump(bundle, f, indent=1)
+
+
+def load_bundle(folder):
+    """The bundle's model with its weights loaded, and bundle.json."""
+    from cr_classification.model import get_bert_lstm_text_code
+    with open(os.path.join(folder, BUNDLE_FILE)) as f:
+        bundle = json.load(f)
+    model = get_bert_lstm_text_code(len(bundle["metric_columns"]), shared_encoder=bundle["shared_encoder"])
+    model.load_weights(os.path.join(folder, WEIGHTS_FILE))
+    return model, bundle
+
+
+def read_records(path):
+    """Records of a .jsonl/.json (one object per line) or CSV file, one at a time."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.json')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def read_metrics_file(path, metric_columns):
+    """comment_id -> metric values of a code attribute CSV, only the columns the model uses."""
+    metrics = dict()
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        absent = [column for column in metric_columns if column not in (reader.fieldnames or [])]
+        if absent:
+            print("%s has no column %s, the records have to carry them" % (path, ', '.join(absent)), file=sys.stderr)
+        for row in reader:
+            metrics[row[METRICS_KEY]] = tuple(row.get(column) for column in metric_columns)
+    return metrics
+
+
+def field(record, names, index):
+    for name in names:
+        value = record.get(name)
+        if value is not None:
+            return value
+    raise ValueError("record %d has none of the fields %s" % (index, ', '.join(names)))
+
+
+@functools.lru_cache(maxsize=FILE_CACHE_SIZE)
+def file_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return f.readlines()
+
+
+def file_context(path, line_no, before=CONTEXT_BEFORE, after=CONTEXT_AFTER):
+    """Context the model was trained with (see code_context.read_code_lines), empty for a missing file."""
+    if not path or not os.path.isfile(path):
+        return ""
+    return "\n".join(file_lines(path)[line_no - before:line_no + after])
+
+
+def metric_features(records, first_index, bundle, metrics_file):
+    columns = bundle["metric_columns"]
+    values = np.zeros((len(records), len(columns)), dtype=np.float64)
+    for i, record in enumerate(records):
+        row = [record.get(column) for column in columns]
+        fallback = None if metrics_file is None else metrics_file.get(str(record.get('comment_id')))
+        if fallback is not None:
+            row = [fallback[j] if value in (None, '') else value for j, value in enumerate(row)]
+        missing = [column for column, value in zip(columns, row) if value is None or value == '']
+        if missing:
+            raise ValueError("record %d has no value for the metrics %s, give them in the record or with --metrics"
+                             % (first_index + i, ', '.join(missing)))
+        values[i] = [float(value) for value in row]
+    scaled = values * np.array(bundle["scaler_scale"]) + np.array(bundle["scaler_min"])
+    return np.clip(scaled, 0.0, 1.0)
+
+
+def build_inputs(records, first_index, bundle, tokenizer, root, metrics_file):
+    from cr_classification.tokenization import tokenize_column
+    messages = []
+    codes = []
+    for i, record in enumerate(records):
+        index = first_index + i
+        messages.append(field(record, MESSAGE_FIELDS, index))
+        file_name = field(record, FILE_FIELDS, index)
+        codes.append(file_context(os.path.join(root, file_name) if file_name else file_name,
+                                  int(float(field(record, LINE_FIELDS, index)))))
+    comment_input_ids, comment_attention_masks = tokenize_column(tokenizer, messages, bundle["comment_token_slots"])
+    code_input_ids, code_attention_masks = tokenize_column(tokenizer, codes, bundle["code_token_slots"])
+    return {"comment_input_ids": comment_input_ids,
+            "comment_attention_mask": comment_attention_masks,
+            "code_input_ids": code_input_ids,
+            "code_attention_mask": code_attention_masks,
+            "metric": metric_features(records, first_index, bundle, metrics_file)}
+
+
+def open_writer(path, class_names):
+    """(write(row), close()) of a CSV or JSONL (by extension) output, '-' writes CSV to stdout."""
+    f = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+    close = (lambda: None) if path == '-' else f.close
+    if path.endswith('.jsonl'):
+        return (lambda row: f.write(json.dumps(row) + '\n')), close
+    fieldnames = ['record', 'comment_id', 'comment_group'] + ['prob_' + name for name in class_names]
+    writer = csv.DictWriter(f, fieldnames=fieldnames)
+    writer.writeheader()
+    return writer.writerow, close
+
+
+class Classifier:
+    """A loaded model bundle that classifies lists of records."""
+
+    def __init__(self, bundle_folder, root='.', metrics_path=None, batch_size=32):
+        from transformers import AutoTokenizer
+        self.model, self.bundle = load_bundle(bundle_folder)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.bundle["encoder"])
+        self.metrics_file = None if metrics_path is None else read_metrics_file(metrics_path, self.bundle["metric_columns"])
+        self.class_names = self.bundle["class_names"]
+        self.root = root
+        self.batch_size = batch_size
+
+    def predict(self, inputs):
+        from cr_classification.batching import num_rows, pad_batch, predict_bucketed
+        rows = num_rows(inputs)
+        if rows <= self.batch_size:
+            # a single batch skips setting up a predict() pipeline
+            return np.asarray(self.model.predict_on_batch(pad_batch(inputs, np.arange(rows))))
+        return predict_bucketed(self.model, inputs, batch_size=self.batch_size)
+
+    def classify_records(self, records, first_index=0):
+        """comment_group and the probability of every group, for each record."""
+        inputs = build_inputs(records, first_index, self.bundle, self.tokenizer, self.root, self.metrics_file)
+        results = []
+        for probs in self.predict(inputs):
+            result = {"comment_group": self.class_names[int(np.argmax(probs))]}
+            for name, prob in zip(self.class_names, probs):
+                result['prob_' + name] = round(float(prob), 6)
+            results.append(result)
+        return results
+
+
+def classify(bundle_folder, input_path, output_path, root='.', metrics_path=None,
+             chunk_size=CHUNK_SIZE, batch_size=32):
+    """Classify every record of input_path chunk by chunk, returns the number of records."""
+    classifier = Classifier(bundle_folder, root, metrics_path, batch_size)
+    write, close = open_writer(output_path, classifier.class_names)
+
+    records = read_records(input_path)
+    count = 0
+    try:
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            for i, (record, result) in enumerate(zip(chunk, classifier.classify_records(chunk, count))):
+                row = {"record": count + i, "comment_id": record.get("comment_id", "")}
+                row.update(result)
+                write(row)
+            count += len(chunk)
+            print("classified", count, "records", file=sys.stderr)
+    finally:
+        close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    classify_parser = commands.add_parser('classify', help='predict the comment_group of every record')
+    classify_parser.add_argument('bundle')
+    classify_parser.add_argument('input', help='.csv or .jsonl records')
+    classify_parser.add_argument('output', help='.csv or .jsonl predictions, - for stdout')
+    classify_parser.add_argument('--root', default='.', help='folder the file paths of the records are relative to')
+    classify_parser.add_argument('--metrics', help='code attribute CSV of MetricRunner, keyed by comment_id')
+    classify_parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    classify_parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args(argv)
+
+    if args.command == 'classify':
+        classify(args.bundle, args.input, args.output, args.root, args.metrics, args.chunk_size, args.batch_size)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Post-training int8 quantization of an exported classifier.
+
+The SavedModel of export is converted with the TFLite converter:
+
+    dynamic  int8 weights, activations quantized on the fly (no calibration)
+    static   int8 weights and activations, ranges calibrated on rows of the
+             labeled dataset drawn from the fold's training rows
+
+Ops without an int8 kernel fall back to TensorFlow ops. The report of a fold
+compares the per class F1 of the int8 model on the held-out rows with the
+float Keras model, computed like results_with_misclassification, next to the
+CPU throughput of the float SavedModel and of the int8 model:
+
+    python -m cr_classification.quantize report cv_results --fold 1 --mode static --threads 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from cr_classification.batching import BucketedSequence, pad_batch
+from cr_classification.cross_validation import fold_path, load_inputs
+from cr_classification.export import SIGNATURE, SavedModelRunner, configure_cpu, export_saved_model
+
+CALIBRATION_ROWS = 200
+MODES = ('dynamic', 'static')
+
+
+def calibration_batches(inputs, rows, input_specs):
+    """Representative dataset of single rows, each padded to its own length like at inference."""
+    for row in rows:
+        batch = pad_batch(inputs, np.array([row]))
+        yield {name: np.asarray(batch[name], dtype=spec.dtype.as_numpy_dtype) for name, spec in input_specs.items()}
+
+
+def convert(saved_model_path, output_path, mode='dynamic', inputs=None, calibration_rows=None):
+    """Write the int8 TFLite model of an exported SavedModel, static mode calibrates on inputs[calibration_rows]."""
+    import tensorflow as tf
+    if mode not in MODES:
+        raise ValueError("unknown quantization mode %s, expected one of %s" % (mode, ', '.join(MODES)))
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_path, signature_keys=[SIGNATURE])
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    # the LSTMs and parts of the encoders have no builtin int8 kernels
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8 if mode == 'static' else tf.lite.OpsSet.TFLITE_BUILTINS,
+                                           tf.lite.OpsSet.SELECT_TF_OPS]
+    if mode == 'static':
+        input_specs = tf.saved_model.load(saved_model_path).signatures[SIGNATURE].structured_input_signature[1]
+        converter.representative_dataset = lambda: calibration_batches(inputs, calibration_rows, input_specs)
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+    return output_path
+
+
+class TFLiteRunner:
+    """Length bucketed inference through the serving signature of a TFLite model."""
+
+    def __init__(self, path, threads=None):
+        import tensorflow as tf
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=threads)
+        self.runner = self.interpreter.get_signature_runner(SIGNATURE)
+        self.input_details = self.runner.get_input_details()
+
+    def predict_batch(self, batch):
+        # the signature runner resizes the inputs to the batch
+        feed = {name: np.asarray(batch[name], dtype=details['dtype']) for name, details in self.input_details.items()}
+        return self.runner(**feed)['outputs']
+
+    def predict(self, inputs, batch_size=8, rows=None):
+        sequence = BucketedSequence(inputs, batch_size=batch_size, rows=rows)
+        predictions = np.concatenate([self.predict_batch(sequence[i]) for i in range(len(sequence))])
+        ordered = np.empty_like(predictions)
+        ordered[sequence.order] = predictions
+        return ordered
+
+
+def timed_predict(runner, inputs, rows, batch_size):
+    start = time.perf_counter()
+    predictions = runner.predict(inputs, batch_size=batch_size, rows=rows)
+    return predictions, len(rows) / (time.perf_counter() - start)
+
+
+def fold_report(cv_folder, fold, mode='dynamic', calibration_size=CALIBRATION_ROWS, threads=None, batch_size=8, seed=0):
+    """Per class F1 of the float and int8 models on a fold's held-out rows, and their CPU throughput."""
+    from cr_classification.evaluation import results_from_predictions
+    from cr_classification.model import NUM_CLASSES, get_bert_lstm_text_code
+    with open(fold_path(cv_folder, fold)) as f:
+        result = json.load(f)
+    job = result["job"]
+    if job["frozen_encoder"]:
+        raise ValueError("fold %d trained a frozen encoder head, only full models are exported" % fold)
+
+    saved_model_path = fold_path(cv_folder, fold, 'saved_model')
+    if not os.path.isdir(saved_model_path):
+        model = get_bert_lstm_text_code(job["metric_count"], shared_encoder=job["shared_encoder"])
+        model.load_weights(fold_path(cv_folder, fold, 'weights.h5'))
+        export_saved_model(model, saved_model_path)
+
+    data_input, y, messages = load_inputs(cv_folder)
+    test_rows = np.array(job["test_index"], dtype=np.int64)
+    training_rows = np.array(job["train_index"], dtype=np.int64)[result["training_index"]]
+    calibration_rows = np.random.default_rng(seed).choice(training_rows, min(calibration_size, len(training_rows)), replace=False)
+
+    tflite_path = convert(saved_model_path, fold_path(cv_folder, fold, 'int8-%s.tflite' % mode), mode,
+                          data_input, np.sort(calibration_rows))
+
+    float_probabilities = np.load(fold_path(cv_folder, fold, 'probabilities.npy'))
+    _, float_throughput = timed_predict(SavedModelRunner(saved_model_path), data_input, test_rows, batch_size)
+    int8_probabilities, int8_throughput = timed_predict(TFLiteRunner(tflite_path, threads), data_input, test_rows, batch_size)
+
+    float_report, _, _ = results_from_predictions(float_probabilities, y[test_rows], messages[test_rows])
+    int8_report, _, _ = results_from_predictions(int8_probabilities, y[test_rows], messages[test_rows])
+    f1 = dict()
+    for label in [str(c) for c in range(NUM_CLASSES)] + ['macro avg', 'weighted avg']:
+        float_f1 = float_report.get(label, {}).get('f1-score', 0.0)
+        int8_f1 = int8_report.get(label, {}).get('f1-score', 0.0)
+        f1[label] = {"float": round(float_f1, 4), "int8": round(int8_f1, 4), "delta": round(int8_f1 - float_f1, 4)}
+    report = {
+        "fold": fold,
+        "mode": mode,
+        "calibration_rows": len(calibration_rows) if mode == 'static' else 0,
+        "model_bytes": {"float": sum(os.path.getsize(os.path.join(dirpath, name))
+                                     for dirpath, _, names in os.walk(saved_model_path) for name in names),
+                        "int8": os.path.getsize(tflite_path)},
+        "accuracy": {"float": float_report['accuracy'], "int8": int8_report['accuracy']},
+        "f1": f1,
+        "rows_per_second": {"float": round(float_throughput, 2), "int8": round(int8_throughput, 2),
+                            "speedup": round(int8_throughput / float_throughput, 2)},
+    }
+    with open(fold_path(cv_folder, fold, 'int8-%s.json' % mode), 'w') as f:
+        json.dump(report, f, indent=1)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    report_parser = commands.add_parser('report', help='quantize a fold and compare it with the float model')
+    report_parser.add_argument('cv_folder')
+    report_parser.add_argument('--fold', type=int, nargs='+', required=True)
+    report_parser.add_argument('--mode', choices=MODES, default='dynamic')
+    report_parser.add_argument('--calibration-size', type=int, default=CALIBRATION_ROWS)
+    report_parser.add_argument('--threads', type=int, help='CPU threads of both models, all cores by default')
+    args = parser.parse_args(argv)
+
+    configure_cpu(args.threads)
+    if args.command == 'report':
+        for fold in args.fold:
+            print(json.dumps(fold_report(args.cv_folder, fold, args.mode, args.calibration_size, args.threads), indent=1))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
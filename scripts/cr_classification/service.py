@@ -0,0 +1,224 @@
+"""Local scoring service that keeps a model bundle loaded.
+
+Requests are queued and a single worker thread classifies them in micro
+batches. A batch is closed once it holds max_batch_size records or its
+oldest request has waited max_latency_ms, whichever comes first.
+
+    python -m cr_classification.service serve model_bundle --port 8500
+    python -m cr_classification.service serve model_bundle --socket /tmp/cr_classification.sock
+
+POST /classify takes one record or a list of records as JSON, in the format
+of predict (message, file, line_number and the metric values, or a
+comment_id with --metrics to take them from), and answers
+with the comment_group and group probabilities of each. GET /metrics gives
+the request latency and batch size histograms, GET /health answers once the
+model is loaded.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MAX_BATCH_SIZE = 32
+MAX_LATENCY_MS = 20
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            i = 0
+            while i < len(self.bounds) and value > self.bounds[i]:
+                i += 1
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """Cumulative count of observations <= each bound, like Prometheus buckets."""
+        with self.lock:
+            buckets = []
+            total = 0
+            for bound, count in zip(list(self.bounds) + ['+Inf'], self.counts):
+                total += count
+                buckets.append([bound, total])
+            return {"buckets": buckets, "count": self.count, "sum": round(self.sum, 3)}
+
+
+class Request:
+    def __init__(self, records):
+        self.records = records
+        self.arrival = time.monotonic()
+        self.future = concurrent.futures.Future()
+
+
+class MicroBatcher:
+    """Feeds queued requests to classify(records) -> results in batches, from one worker thread."""
+
+    def __init__(self, classify, max_batch_size=MAX_BATCH_SIZE, max_latency_ms=MAX_LATENCY_MS):
+        self.classify = classify
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.queue = queue.Queue()
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.thread = threading.Thread(target=self.run, name='micro-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, records):
+        request = Request(records)
+        self.queue.put(request)
+        return request.future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        size = len(batch[0].records)
+        deadline = batch[0].arrival + self.max_latency
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.records)
+        return batch
+
+    def run(self):
+        while True:
+            self.run_batch(self.next_batch())
+
+    def run_batch(self, batch):
+        records = [record for request in batch for record in request.records]
+        try:
+            results = self.classify(records)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].future.set_exception(e)
+            else:
+                # one bad record must not fail the other requests of the batch
+                for request in batch:
+                    self.run_batch([request])
+            return
+        self.batch_sizes.observe(len(records))
+        start = 0
+        for request in batch:
+            request.future.set_result(results[start:start + len(request.records)])
+            start += len(request.records)
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    # set on the server: batcher and latencies
+    server_version = 'cr_classification'
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else str(self.server.server_address)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {"status": "ok"})
+        elif self.path == '/metrics':
+            self.send_json(200, {"latency_ms": self.server.latencies.snapshot(),
+                                 "batch_size": self.server.batcher.batch_sizes.snapshot()})
+        else:
+            self.send_json(404, {"error": "unknown path " + self.path})
+
+    def do_POST(self):
+        if self.path != '/classify':
+            self.send_json(404, {"error": "unknown path " + self.path})
+            return
+        start = time.monotonic()
+        try:
+            self.send_json(*self.classify())
+        finally:
+            # failed requests are timed too
+            self.server.latencies.observe((time.monotonic() - start) * 1000)
+
+    def classify(self):
+        """Status and body of the answer to a /classify request."""
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            records = body if isinstance(body, list) else [body]
+            if not all(isinstance(record, dict) for record in records):
+                raise ValueError("expected a record object or a list of record objects")
+            if not records:
+                # nothing to batch, an empty batch has no row to pad from
+                return 200, []
+            results = self.server.batcher.submit(records).result()
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": str(e)}
+        return 200, results if isinstance(body, list) else results[0]
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(batcher, port=8500, host='127.0.0.1', socket_path=None):
+    if socket_path is None:
+        server = ThreadingHTTPServer((host, port), ScoringHandler)
+    else:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ScoringHandler)
+    server.batcher = batcher
+    server.latencies = Histogram(LATENCY_BUCKETS_MS)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='serve a model bundle over HTTP or a unix socket')
+    serve_parser.add_argument('bundle')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8500)
+    serve_parser.add_argument('--socket', help='listen on this unix socket instead of host:port')
+    serve_parser.add_argument('--root', default='.', help='folder the file paths of the records are relative to')
+    serve_parser.add_argument('--metrics', help='code attribute CSV of MetricRunner, keyed by comment_id')
+    serve_parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE)
+    serve_parser.add_argument('--max-latency-ms', type=float, default=MAX_LATENCY_MS)
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        from cr_classification.predict import Classifier
+        classifier = Classifier(args.bundle, args.root, args.metrics, batch_size=args.max_batch_size)
+        batcher = MicroBatcher(classifier.classify_records, args.max_batch_size, args.max_latency_ms)
+        server = make_server(batcher, args.port, args.host, args.socket)
+        print("serving on", args.socket or '%s:%d' % (args.host, args.port), file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""On disk cache of tokenized texts.
+
+Every tokenizer configuration (name, version, max length, truncation and
+padding policy) gets its own folder. Token ids and attention masks are kept
+in .npy chunks that are memory mapped on load, and index.sqlite maps the
+sha1 of a text to its chunk and row. A rerun only tokenizes texts it has not
+seen. Identical snippets shared by many comments are tokenized once.
+Chunk numbers come from the index, under its write lock, so several caches
+(or processes) can share a folder.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from cr_classification.tokenization import TOKENIZE_BATCH_SIZE, tokenize_column
+
+TRUNCATION = True
+PADDING = "max_length"
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def tokenizer_config(tokenizer, total_len):
+    import transformers
+    return {
+        "name": tokenizer.name_or_path,
+        "class": type(tokenizer).__name__,
+        "transformers_version": transformers.__version__,
+        "vocab_size": len(tokenizer),
+        "max_length": total_len,
+        "truncation": TRUNCATION,
+        "padding": PADDING,
+    }
+
+
+class TokenCache:
+    def __init__(self, root, tokenizer, total_len):
+        self.tokenizer = tokenizer
+        self.total_len = total_len
+        self.config = tokenizer_config(tokenizer, total_len)
+        config_key = hashlib.sha1(json.dumps(self.config, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        self.folder = os.path.join(root, config_key)
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, 'config.json'), 'w') as f:
+            json.dump(self.config, f, indent=1, sort_keys=True)
+
+        self.db = sqlite3.connect(os.path.join(self.folder, 'index.sqlite'))
+        self.db.execute("CREATE TABLE IF NOT EXISTS tokens (hash TEXT PRIMARY KEY, chunk INTEGER, row INTEGER)")
+        # every chunk number ever indexed, a number is not reused even if all its rows were replaced since
+        self.db.execute("CREATE TABLE IF NOT EXISTS chunks (chunk INTEGER PRIMARY KEY)")
+        # chunk -> memory mapped (ids, mask), loaded when first looked up
+        self.chunks = dict()
+        self.stats = dict(hits=0, tokenized=0)
+
+    def chunk_path(self, chunk, kind):
+        return os.path.join(self.folder, 'chunk-%05d.%s.npy' % (chunk, kind))
+
+    def load_chunk(self, chunk):
+        if chunk not in self.chunks:
+            self.chunks[chunk] = (np.load(self.chunk_path(chunk, 'ids'), mmap_mode='r'),
+                                  np.load(self.chunk_path(chunk, 'mask'), mmap_mode='r'))
+        return self.chunks[chunk]
+
+    def add_chunk(self, hashes, input_ids, attention_masks):
+        # the write lock is held from picking the chunk number to indexing it, so no other cache on this folder
+        # can pick the same number. Arrays first, index last: a crash in between only leaves an unreferenced
+        # chunk behind, which the next chunk overwrites.
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            chunk = self.db.execute("SELECT COALESCE(MAX(chunk) + 1, 0) FROM "
+                                    "(SELECT chunk FROM tokens UNION ALL SELECT chunk FROM chunks)").fetchone()[0]
+            for kind, values in (('ids', input_ids), ('mask', attention_masks)):
+                tmp_path = self.chunk_path(chunk, kind) + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, values)
+                os.replace(tmp_path, self.chunk_path(chunk, kind))
+            self.db.execute("INSERT INTO chunks VALUES (?)", (chunk,))
+            self.db.executemany("INSERT OR REPLACE INTO tokens VALUES (?, ?, ?)",
+                                [(h, chunk, row) for row, h in enumerate(hashes)])
+            self.db.commit()
+        except BaseException:
+            self.db.rollback()
+            raise
+        self.chunks.pop(chunk, None)
+        return chunk
+
+    def lookup(self, hashes):
+        found = dict()
+        unique = list(set(hashes))
+        for start in range(0, len(unique), 500):
+            part = unique[start:start + 500]
+            rows = self.db.execute("SELECT hash, chunk, row FROM tokens WHERE hash IN (%s)" % ','.join('?' * len(part)), part)
+            for h, chunk, row in rows:
+                found[h] = (chunk, row)
+        return found
+
+    def tokenize_column(self, texts, batch_size=TOKENIZE_BATCH_SIZE):
+        """Same output as tokenization.tokenize_column, only texts missing from the cache are tokenized."""
+        texts = [str(text) for text in texts]
+        hashes = [text_hash(text) for text in texts]
+        found = self.lookup(hashes)
+
+        missing = dict()
+        for h, text in zip(hashes, texts):
+            if h not in found:
+                missing.setdefault(h, text)
+        self.stats = dict(hits=len(texts) - sum(h not in found for h in hashes), tokenized=len(missing))
+        if missing:
+            missing_hashes = list(missing)
+            input_ids, attention_masks = tokenize_column(self.tokenizer, [missing[h] for h in missing_hashes],
+                                                         self.total_len, batch_size)
+            self.add_chunk(missing_hashes, input_ids, attention_masks)
+            found.update(self.lookup(missing_hashes))
+
+        locations = np.array([found[h] for h in hashes], dtype=np.int64).reshape(-1, 2)
+        input_ids = np.zeros((len(texts), self.total_len), dtype=np.int32)
+        attention_masks = np.zeros((len(texts), self.total_len), dtype=np.int32)
+        for chunk in np.unique(locations[:, 0]):
+            chunk_ids, chunk_masks = self.load_chunk(int(chunk))
+            positions = np.flatnonzero(locations[:, 0] == chunk)
+            rows = locations[positions, 1]
+            input_ids[positions] = chunk_ids[rows]
+            attention_masks[positions] = chunk_masks[rows]
+        return input_ids, attention_masks
@@ -0,0 +1,36 @@
+"""Batched tokenization of whole text columns with the Rust fast tokenizer."""
+import os
+
+import numpy as np
+
+# the fast tokenizer spreads each encode_batch call over all cores
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+TOKENIZE_BATCH_SIZE = 1024
+
+
+def tokenize_text(tokenizer, sentence, total_len):
+    tokens = tokenizer.encode_plus(sentence,max_length=total_len, truncation=True,add_special_tokens=True, padding="max_length")
+
+    return tokens["input_ids"], tokens["attention_mask"]
+
+
+def tokenize_column(tokenizer, texts, total_len, batch_size=TOKENIZE_BATCH_SIZE):
+    """Tokenize every text, padded and truncated to total_len.
+
+    Gives the same ids and masks as calling tokenize_text on each text, as int32 arrays of shape (len(texts), total_len).
+    """
+    if not tokenizer.is_fast:
+        raise ValueError("batched tokenization needs a fast (Rust) tokenizer, got " + type(tokenizer).__name__)
+
+    # str() like the per row loop did, missing code becomes "None"
+    texts = [str(text) for text in texts]
+    input_ids = np.zeros((len(texts), total_len), dtype=np.int32)
+    attention_masks = np.zeros((len(texts), total_len), dtype=np.int32)
+    for start in range(0, len(texts), batch_size):
+        tokens = tokenizer(texts[start:start + batch_size], max_length=total_len, truncation=True,
+                           add_special_tokens=True, padding="max_length", return_tensors="np")
+        end = start + len(tokens["input_ids"])
+        input_ids[start:end] = tokens["input_ids"]
+        attention_masks[start:end] = tokens["attention_mask"]
+    return input_ids, attention_masks
@@ -0,0 +1,72 @@
+"""parity of code_attributes with MetricRunner's code_attributes.csv on a fixed sample of comments.
+
+    cd scripts && python -m unittest discover tests
+"""
+import contextlib
+import csv
+import importlib.util
+import io
+import os
+import tempfile
+import unittest
+
+from cr_classification import blob_store, code_attributes
+
+DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, 'dataset')
+DATA_FOLDER = os.path.join(DATASET, 'Data New')
+EXPECTED = os.path.join(DATASET, 'code_attributes.csv')
+
+# (comment_id, line_number) of the labeled dataset, small files so the sample runs in seconds
+SAMPLE = [
+    ('9fdfeff1_4532aaf4', 185), ('9fdfeff1_f3dc3f75', 1381), ('5fc1f717_7133cb63', 145),
+    ('3f79a3b5_8679ac82', 75), ('5fc1f717_ce48df5d', 39), ('9fdfeff1_2fa0c942', 384),
+    ('9fdfeff1_c3f688d9', 663), ('3f79a3b5_a262a9a6', 612), ('9fdfeff1_9564c023', 85),
+    ('3fce034c_ab1462a1', 271), ('9fdfeff1_2cb661de', 706), ('9fdfeff1_c58a71bd', 163),
+    # a syntax error in MetricRunner too
+    ('9fdfeff1_216483b8', 167),
+]
+
+
+@unittest.skipUnless(importlib.util.find_spec('parso') and os.path.isdir(DATA_FOLDER) and os.path.isfile(EXPECTED),
+                     "needs parso and the dataset")
+class ParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        data_folder = os.path.join(cls.tmp.name, 'Data New')
+        os.makedirs(data_folder)
+        for comment_id, _ in SAMPLE:
+            os.symlink(os.path.abspath(os.path.join(DATA_FOLDER, comment_id)), os.path.join(data_folder, comment_id))
+        cls.store = os.path.join(cls.tmp.name, 'blobs')
+        blob_store.build(data_folder, cls.store)
+        cls.comments = os.path.join(cls.tmp.name, 'comments.csv')
+        with open(cls.comments, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['comment_id', 'line_number'])
+            writer.writerows(SAMPLE)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def parity(self, *args):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return code_attributes.main(['parity', self.store, self.comments, EXPECTED] + list(args))
+
+    def test_every_column_within_tolerance(self):
+        report = code_attributes.parity(self.store, self.comments, EXPECTED)
+        self.assertEqual(report["rows"], len(SAMPLE))
+        self.assertEqual(report["error_mismatches"], 0)
+        for column, result in report["columns"].items():
+            self.assertGreaterEqual(result["equal"], code_attributes.TOLERANCE, column)
+        self.assertEqual(report["below_tolerance"], [])
+        self.assertFalse(self.parity())
+
+    def test_exit_code_below_tolerance(self):
+        # 5fc1f717_ce48df5d moves 35 src nodes where MetricRunner moves 33
+        self.assertEqual(self.parity('--tolerance', '1.0'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()